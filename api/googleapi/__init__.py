@@ -1,22 +1,33 @@
 import base64
-import io
 import mimetypes
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from email.message import EmailMessage
 from pathlib import Path
-from typing import Mapping
+from typing import Callable, Iterator, Mapping
 
+import httplib2
 import requests
 from google.auth.transport.requests import Request
+from google_auth_httplib2 import AuthorizedHttp
 from google.oauth2 import service_account
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import Resource
+from googleapiclient.discovery import Resource, build
 from googleapiclient.errors import HttpError
-from googleapiclient.http import MediaFileUpload, MediaIoBaseDownload
+from googleapiclient.http import HttpRequest, MediaFileUpload, MediaIoBaseDownload
 
 # load config
-from helper import EXPORTDIR_PATH, load_config
+from helper import (
+    EXPORTDIR_PATH,
+    decode_base64url_to_file,
+    iter_json_string_field,
+    load_config,
+)
+from helper.attachment_cache import AttachmentCache
+from helper.regexpatterns import RANGE_ADDR_PATTERN
 from itemparser import ExpandedMessageItem
 
 config = load_config.CONFIG
@@ -41,6 +52,32 @@ API_SCOPES = [
 ]
 CHAT_API_SCOPES = ["https://www.googleapis.com/auth/chat.bot"]
 
+# 並列実行時の最大同時リクエスト数。Sheets APIのユーザーごとのクォータ（60回/分）を超えにくい数にする
+CONCURRENT_MAX_WORKERS = 8
+# 429/5xxが返ってきたときのリトライ回数。googleapiclientの指数バックオフを使う
+REQUEST_NUM_RETRIES = 5
+# メッセージを一覧に表示するときに取得するヘッダー。本文を取得しない（format=metadata）ときに使う
+MESSAGE_LIST_HEADERS = ["Subject", "From", "To", "Cc", "Date"]
+# threads().listの1ページの最大件数（Gmail APIの上限）
+THREADS_LIST_MAX_PAGE_SIZE = 500
+# ファイルのダウンロードで1回のリクエストで取得するバイト数
+DOWNLOAD_CHUNK_SIZE = 10 * 1024 * 1024
+# 1回のバッチリクエストにまとめられる最大件数（Drive APIの上限）
+BATCH_MAX_REQUESTS = 100
+# Gmail APIのバッチの件数。50件を超えるとレート制限にかかりやすい
+GMAIL_BATCH_MAX_REQUESTS = 50
+# バッチ内で失敗したときに送り直すステータスコード
+RETRIABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+# バッチリクエストの通信で起きる例外（HttpError以外）
+TRANSPORT_ERRORS = (httplib2.HttpLib2Error, OSError)
+# requestsでダウンロードするときのタイムアウト（接続, 読み込み）秒
+DOWNLOAD_TIMEOUT_SECONDS = (10, 60)
+
+# get_serviceで作るサービスのバージョン
+SERVICE_VERSIONS = {"sheets": "v4", "gmail": "v1", "drive": "v3", "chat": "v1"}
+# サービスアカウントの認証情報を使うサービス
+SERVICE_ACCOUNT_SERVICES = {"chat"}
+
 
 def get_cledential(scopes: list[str]) -> Credentials:
     """
@@ -88,48 +125,304 @@ def get_cledential_by_serviceaccount(scopes: list[str]) -> Credentials:
     )
 
 
+# プロセス内で共有する認証情報。キーはOAuthなら"oauth"、サービスアカウントなら"service_account"
+_credentials: dict[str, Credentials] = {}
+_credentials_lock = threading.Lock()
+# 作成済みのサービス。httplib2.Httpはスレッドセーフではないので、スレッドごとに持つ
+_service_cache = threading.local()
+
+
+def get_credentials(service_account: bool = False) -> Credentials:
+    """
+    プロセス内で共有する認証情報を返します。
+    初回呼び出し時にget_cledential（サービスアカウントの場合はget_cledential_by_serviceaccount）で取得し、
+    期限切れになっていれば更新してから返します。
+
+    args:
+        service_account: Trueの場合はChat API用のサービスアカウントの認証情報を返す
+    return:
+        認証情報
+    """
+    key = "service_account" if service_account else "oauth"
+    with _credentials_lock:
+        if key not in _credentials:
+            _credentials[key] = (
+                get_cledential_by_serviceaccount(CHAT_API_SCOPES)
+                if service_account
+                else get_cledential(API_SCOPES)
+            )
+        credentials = _credentials[key]
+        if credentials.expired:
+            credentials.refresh(Request())
+        return credentials
+
+
+def get_service(service_name: str) -> Resource:
+    """
+    Google APIのサービスを返します。サービスはスレッドごとに一度だけ作り、以降は使い回します。
+    ディスカバリードキュメントはライブラリ同梱のものを使うので、作成時に通信しません。
+
+    args:
+        service_name: "sheets", "gmail", "drive", "chat"のいずれか
+    return:
+        サービス
+    """
+    services: dict[str, Resource] = _service_cache.__dict__.setdefault("services", {})
+    if service_name not in services:
+        services[service_name] = build(
+            service_name,
+            SERVICE_VERSIONS[service_name],
+            credentials=get_credentials(service_name in SERVICE_ACCOUNT_SERVICES),
+            static_discovery=True,
+            cache_discovery=False,
+        )
+    return services[service_name]
+
+
+def execute_requests_concurrently(
+    credentials: Credentials,
+    api_requests: list[HttpRequest],
+    max_workers: int = CONCURRENT_MAX_WORKERS,
+    num_retries: int = REQUEST_NUM_RETRIES,
+) -> list[dict]:
+    """
+    Google APIのリクエストをスレッドプールで並列に実行します。
+    同時実行数はmax_workersで制限し、429/5xxのエラーはnum_retriesの回数まで指数バックオフでリトライします。
+    httplib2.Httpはスレッドセーフではないので、スレッドごとに認証済みのHttpを用意して実行します。
+
+    args:
+        credentials: リクエストに使う認証情報
+        api_requests: 実行するリクエストのリスト。`service.xxx().yyy(...)` の戻り値（executeする前のもの）
+        max_workers: 最大同時リクエスト数
+        num_retries: 429/5xxのときのリトライ回数
+    return:
+        各リクエストのレスポンスのリスト。順番はapi_requestsと同じ
+    """
+    thread_local = threading.local()
+
+    def _execute(api_request: HttpRequest) -> dict:
+        if not hasattr(thread_local, "http"):
+            thread_local.http = AuthorizedHttp(credentials, http=httplib2.Http())
+        return api_request.execute(http=thread_local.http, num_retries=num_retries)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(_execute, api_requests))
+
+
+class BatchRequestQueue:
+    """
+    Google APIのリクエストをためておき、バッチリクエスト（multipart）でまとめて実行します。
+    max_batch_size件ずつ1回のHTTPリクエストにまとめて送り、結果は追加した順番で返します。
+    retry=Trueで追加したもの（get等、何度送っても結果が変わらないもの）だけ、
+    429/5xxや通信エラーで失敗したときにnum_retriesの回数まで指数バックオフで1件ずつ送り直します。
+    copyやdelete等は、失敗して見えてもサーバー側では処理されていることがあるので、既定では送り直しません。
+    バッチはサービスごとのエンドポイントに送るので、追加するリクエストは同じサービスから作ったものにします。
+    サービスと同じくスレッドセーフではないので、1つのスレッドの中で使います。
+
+    # queue = googleapi.BatchRequestQueue(drive_service)
+    # queue.add(drive_service.files().get(fileId=file_id), retry=True)
+    # results = queue.flush()  # [レスポンス or 例外]
+    """
+
+    def __init__(
+        self,
+        service: Resource,
+        max_batch_size: int = BATCH_MAX_REQUESTS,
+        num_retries: int = REQUEST_NUM_RETRIES,
+    ):
+        self.service = service
+        self.max_batch_size = max_batch_size
+        self.num_retries = num_retries
+        self._requests: list[tuple[HttpRequest, bool]] = []
+
+    def __len__(self) -> int:
+        return len(self._requests)
+
+    def add(self, api_request: HttpRequest, retry: bool = False) -> int:
+        """
+        リクエストを追加します
+        args:
+            api_request: `service.xxx().yyy(...)` の戻り値（executeする前のもの）
+            retry: 失敗したときに送り直すか。冪等なリクエストだけTrueにする
+        return:
+            flushの戻り値での位置
+        """
+        self._requests.append((api_request, retry))
+        return len(self._requests) - 1
+
+    def flush(self) -> list[dict | HttpError | Exception]:
+        """
+        ためたリクエストをバッチで実行し、キューを空にします
+        return:
+            追加した順番の、各リクエストのレスポンスのリスト。
+            失敗したものはHttpError、通信エラーの場合はhttplib2.HttpLib2Error/OSErrorが入る
+        """
+        api_requests, self._requests = self._requests, []
+        results: list[dict | HttpError | Exception | None] = [None] * len(api_requests)
+
+        def set_result(request_id: str, response: dict, exception: HttpError | None):
+            results[int(request_id)] = exception if exception else response
+
+        for start in range(0, len(api_requests), self.max_batch_size):
+            chunk_indexes = range(
+                start, min(start + self.max_batch_size, len(api_requests))
+            )
+            batch = self.service.new_batch_http_request(callback=set_result)
+            for index in chunk_indexes:
+                batch.add(api_requests[index][0], request_id=str(index))
+            try:
+                batch.execute()
+            except (HttpError, *TRANSPORT_ERRORS) as error:
+                # バッチ全体が失敗した場合は、結果のないものにその例外を入れる
+                for index in chunk_indexes:
+                    if results[index] is None:
+                        results[index] = error
+
+        # バッチ内ではリトライされないので、送り直してよいもののうち、429/5xxと通信エラーのものは1件ずつ送り直す
+        for index, (api_request, retry) in enumerate(api_requests):
+            if retry and is_retriable_error(results[index]):
+                try:
+                    results[index] = api_request.execute(num_retries=self.num_retries)
+                except (HttpError, *TRANSPORT_ERRORS) as error:
+                    results[index] = error
+
+        return results
+
+
+def is_retriable_error(result: dict | Exception | None) -> bool:
+    """
+    BatchRequestQueueの結果が、送り直せば成功する可能性のある失敗（429/5xx, 通信エラー）かを返します
+    """
+    if isinstance(result, HttpError):
+        return result.resp.status in RETRIABLE_STATUS_CODES
+    return isinstance(result, TRANSPORT_ERRORS)
+
+
+def write_response_content(response: requests.Response, output) -> None:
+    """レスポンスの本文をそのままファイルへ書き込みます。download_to_fileの既定の書き込み方法です"""
+    for chunk in response.iter_content(chunk_size=1024 * 1024):
+        output.write(chunk)
+
+
+def download_to_file(
+    url: str,
+    save_path: Path,
+    params: dict | None = None,
+    headers: dict | None = None,
+    write_response: Callable[
+        [requests.Response, object], None
+    ] = write_response_content,
+    num_retries: int = REQUEST_NUM_RETRIES,
+) -> None:
+    """
+    requestsでurlをストリームとして受け取り、save_pathへ保存します。
+    429/5xxと、接続エラー・タイムアウトはnum_retriesの回数まで指数バックオフでリトライします。途中で切れた場合もはじめから取り直します。
+    一時ファイル（.download）に書き込んでから置き換えるので、失敗しても壊れたファイルや一時ファイルは残りません。
+
+    args:
+        url: ダウンロードするURL
+        save_path: 保存先ファイルパス
+        params: クエリパラメーター
+        headers: リクエストヘッダー
+        write_response: (レスポンス, 書き込み先ファイル)を受け取って本文を書き込む関数
+        num_retries: リトライ回数
+    """
+    download_path = save_path.with_name(f"{save_path.name}.download")
+    try:
+        for retry_count in range(num_retries + 1):
+            try:
+                with requests.get(
+                    url,
+                    params=params,
+                    headers=headers,
+                    stream=True,
+                    timeout=DOWNLOAD_TIMEOUT_SECONDS,
+                ) as r:
+                    if (
+                        r.status_code in RETRIABLE_STATUS_CODES
+                        and retry_count < num_retries
+                    ):
+                        time.sleep(2**retry_count)
+                        continue
+                    r.raise_for_status()
+                    with download_path.open("wb") as output:
+                        write_response(r, output)
+            except (requests.ConnectionError, requests.Timeout):
+                if retry_count >= num_retries:
+                    raise
+                time.sleep(2**retry_count)
+                continue
+            download_path.replace(save_path)
+            return
+    finally:
+        download_path.unlink(missing_ok=True)
+
+
 # [Gmail API]
-def search_threads(
+def iter_threads(
     gmail_service: Resource,
     query,
     include_spam_trash: bool = False,
     user_id: str = "me",
-) -> list[dict]:
+    max_results: int | None = None,
+) -> Iterator[dict]:
     """
-    Google Gmail APIを使用して、スレッドを検索します。
+    Google Gmail APIを使用して、スレッドを検索し、1件ずつ返すジェネレーターです。
+    次のページは、前のページを使い切ったときに取得します。途中でやめれば、それ以降のページは取得しません。
     args:
         service: Gmail APIのサービス
         query: 検索クエリ
+        max_results: 取得する最大件数。指定した場合はページサイズにもする（最大THREADS_LIST_MAX_PAGE_SIZE）
     return:
-        スレッドのリスト
+        スレッドのイテレーター
     """
-    try:
+    page_size = min(max_results, THREADS_LIST_MAX_PAGE_SIZE) if max_results else None
+    page_token = None
+    yielded_count = 0
+    while True:
         response = (
             gmail_service.users()
             .threads()
-            .list(userId=user_id, q=query, includeSpamTrash=include_spam_trash)
-            .execute()
+            .list(
+                userId=user_id,
+                q=query,
+                includeSpamTrash=include_spam_trash,
+                maxResults=page_size,
+                pageToken=page_token,
+            )
+            .execute(num_retries=REQUEST_NUM_RETRIES)
         )
-        threads = []
-        if "threads" in response:
-            threads.extend(response["threads"])
+        for thread in response.get("threads", []):
+            yield thread
+            yielded_count += 1
+            if max_results and yielded_count >= max_results:
+                return
 
-        while "nextPageToken" in response:
-            page_token = response["nextPageToken"]
-            response = (
-                gmail_service.users()
-                .threads()
-                .list(
-                    userId=user_id,
-                    q=query,
-                    pageToken=page_token,
-                    includeSpamTrash=False,
-                )
-                .execute()
-            )
-            threads.extend(response["threads"])
+        page_token = response.get("nextPageToken")
+        if not page_token:
+            return
 
-        return threads
+
+def search_threads(
+    gmail_service: Resource,
+    query,
+    include_spam_trash: bool = False,
+    user_id: str = "me",
+    max_results: int | None = None,
+) -> list[dict]:
+    """
+    Google Gmail APIを使用して、スレッドを検索します。
+    args:
+        service: Gmail APIのサービス
+        query: 検索クエリ
+        max_results: 取得する最大件数。指定した場合はその件数をページサイズにして、集まった時点で検索をやめる
+    return:
+        スレッドのリスト
+    """
+    try:
+        return list(
+            iter_threads(gmail_service, query, include_spam_trash, user_id, max_results)
+        )
     except HttpError as error:
         print(f"An error occurred: {error}")
         return []
@@ -137,30 +430,51 @@ def search_threads(
 
 # メッセージIDを元にスレッドをgetする
 def get_thread_by_message_id(
-    gmail_service: Resource, message_id: str, user_id: str = "me", fields="messages"
+    gmail_service: Resource,
+    message_id: str,
+    user_id: str = "me",
+    fields="messages",
+    format_: str = "full",
+    metadata_headers: list[str] | None = None,
 ) -> dict:
     """
     Gmail APIを使用して、メッセージIDからスレッドを取得します。
     args:
         service: Gmail APIのサービス
         message_id: メッセージID
+        fields: 取得するフィールド 例: "messages(id,payload/headers)"
+        format_: "full", "metadata", "minimal"のいずれか。本文が不要な場合はmetadataかminimalにする
+        metadata_headers: format_がmetadataの時に取得するヘッダー 例: ["Subject", "Date"]
     return:
         スレッドのdict
     """
     return (
         gmail_service.users()
         .threads()
-        .get(userId=user_id, id=message_id, fields=fields)
-        .execute()
+        .get(
+            userId=user_id,
+            id=message_id,
+            fields=fields,
+            format=format_,
+            metadataHeaders=metadata_headers,
+        )
+        .execute(num_retries=REQUEST_NUM_RETRIES)
     )
 
 
-def get_messages_by_threadid(gmail_service: Resource, thread_id) -> list[dict]:
+def get_messages_by_threadid(
+    gmail_service: Resource,
+    thread_id,
+    format_: str = "full",
+    fields: str | None = None,
+) -> list[dict]:
     """
     Gmail APIを使用して、スレッドIDからメッセージを取得します。
     args:
         service: Gmail APIのサービス
         thread_id: スレッドID
+        format_: "full", "metadata", "minimal"のいずれか。IDだけ必要な場合はminimalにする
+        fields: 取得するフィールド 例: "messages/id"
     return:
         メッセージのリスト
     """
@@ -171,6 +485,8 @@ def get_messages_by_threadid(gmail_service: Resource, thread_id) -> list[dict]:
             .get(
                 userId="me",
                 id=thread_id,
+                format=format_,
+                fields=fields,
             )
             .execute()
         )
@@ -187,6 +503,8 @@ def get_messages_by_threadid(gmail_service: Resource, thread_id) -> list[dict]:
                     userId="me",
                     id=thread_id,
                     pageToken=page_token,
+                    format=format_,
+                    fields=fields,
                 )
                 .execute()
             )
@@ -200,17 +518,48 @@ def get_messages_by_threadid(gmail_service: Resource, thread_id) -> list[dict]:
 
 # メッセージIDを元にメッセージをgetする
 def get_message_by_message_id(
-    gmail_service: Resource, message_id: str, user_id: str = "me"
+    gmail_service: Resource,
+    message_id: str,
+    user_id: str = "me",
+    format_: str = "full",
+    fields: str | None = None,
+    metadata_headers: list[str] | None = None,
 ) -> dict:
     """
     Gmail APIを使用して、メッセージIDからメッセージを取得します。
     args:
         service: Gmail APIのサービス
         message_id: メッセージID
+        format_: "full", "metadata", "minimal"のいずれか。本文が不要な場合はmetadataかminimalにする
+        fields: 取得するフィールド 例: "id,payload/headers"
+        metadata_headers: format_がmetadataの時に取得するヘッダー 例: ["Subject", "Date"]
+    return:
+        メッセージのdict
+    """
+    return (
+        gmail_service.users()
+        .messages()
+        .get(
+            userId=user_id,
+            id=message_id,
+            format=format_,
+            fields=fields,
+            metadataHeaders=metadata_headers,
+        )
+        .execute(num_retries=REQUEST_NUM_RETRIES)
+    )
+
+
+def get_full_message(message_id: str) -> dict:
+    """
+    本文を含むメッセージを取得します。ExpandedMessageItemのmessage_loaderとして使います。
+    サービスは呼び出したスレッドのものを使います
+    args:
+        message_id: メッセージID
     return:
         メッセージのdict
     """
-    return gmail_service.users().messages().get(userId=user_id, id=message_id).execute()
+    return get_message_by_message_id(get_service("gmail"), message_id)
 
 
 def create_messagedata(
@@ -263,39 +612,86 @@ def create_messagedata(
 
 
 def save_attachment_file(
-    service,
     message_id: str,
     attachment_id: str,
     save_dirpath: Path,
     userid: str = "me",
+    attachment_cache: AttachmentCache | None = None,
+    cache_part_key: str | None = None,
 ) -> None:
     """
     Gmail APIを使用して、添付ファイルを保存します。
+    attachment_cacheとcache_part_keyを指定した場合は、キャッシュにあればダウンロードせずに配置し、
+    ダウンロードしたものはキャッシュに追加します。
+    レスポンスはrequestsでストリームとして受け取り、dataのbase64urlをチャンクごとにデコードしてファイルへ書き込みます。
+    添付ファイル全体をメモリに載せないので、大きなzipファイル等でもメモリを使いません。
+    リトライと一時ファイルの扱いはdownload_to_fileと同じです。
 
     args:
-        service: Gmail APIのサービス
         message_id: メッセージID
         attachment_id: 添付ファイルID
-        save_dirpath: 保存先ディレクトリ
+        save_dirpath: 保存先ファイルパス
         userid: ユーザーID
+        attachment_cache: 添付ファイルのキャッシュ
+        cache_part_key: メッセージ内の添付ファイルを表すキー 例: "1:sample.zip"
 
     """
-    attachment_file_data = (
-        service.users()
-        .messages()
-        .attachments()
-        .get(
-            userId=userid,
-            messageId=message_id,
-            id=attachment_id,
-        )
-        .execute()
-    )
+    use_cache = attachment_cache is not None and cache_part_key is not None
+    if use_cache and attachment_cache.restore(message_id, cache_part_key, save_dirpath):
+        print(f"savefle(cache): {save_dirpath}")
+        return
+
+    attachment_url = f"https://gmail.googleapis.com/gmail/v1/users/{userid}/messages/{message_id}/attachments/{attachment_id}"
+
     print(f"savefle: {save_dirpath}")
-    with (save_dirpath).open("wb") as attachment_file:
-        attachment_file.write(
-            base64.urlsafe_b64decode(attachment_file_data.get("data"))
-        )
+    download_to_file(
+        attachment_url,
+        save_dirpath,
+        # dataだけ返すようにして、レスポンスをdataの値から読めるようにする
+        params={"fields": "data"},
+        headers={"Authorization": f"Bearer {get_credentials().token}"},
+        write_response=lambda r, output: decode_base64url_to_file(
+            iter_json_string_field(r.iter_content(chunk_size=1024 * 1024), "data"),
+            output,
+        ),
+    )
+    if use_cache:
+        attachment_cache.store(message_id, cache_part_key, save_dirpath)
+
+
+def save_attachment_files(
+    message_id: str,
+    attachments: list[tuple[str, Path, str | None]],
+    userid: str = "me",
+    max_workers: int = CONCURRENT_MAX_WORKERS,
+    attachment_cache: AttachmentCache | None = None,
+) -> None:
+    """
+    1つのメッセージの添付ファイルを、スレッドプールで並列に保存します。
+    どれかの保存に失敗した場合は、全ての保存が終わった後に例外を出します。
+
+    args:
+        message_id: メッセージID
+        attachments: (添付ファイルID, 保存先ファイルパス, キャッシュのキー)のリスト。キーがNoneのものはキャッシュしない
+        userid: ユーザーID
+        max_workers: 最大同時ダウンロード数
+        attachment_cache: 添付ファイルのキャッシュ
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(
+                save_attachment_file,
+                message_id,
+                attachment_id,
+                save_path,
+                userid,
+                attachment_cache,
+                cache_part_key,
+            )
+            for attachment_id, save_path, cache_part_key in attachments
+        ]
+    for future in futures:
+        future.result()
 
 
 # 返信用のメッセージ生成
@@ -545,13 +941,46 @@ def upload_file(
     return drive_service.files().create(body=file_metadata, media_body=media).execute()
 
 
+def join_parent_ids(parent_ids: str | list[str] | None) -> str | None:
+    """
+    addParents/removeParents用に、フォルダIDをカンマ区切りの文字列にします。
+    設定ファイルではフォルダIDが文字列の場合とリストの場合があるので、どちらも受け取ります
+    """
+    if not parent_ids:
+        return None
+    if isinstance(parent_ids, str):
+        return parent_ids
+    return ",".join(parent_ids)
+
+
+def build_update_file_request(
+    drive_service: Resource,
+    file_id: str,
+    body: dict | None = None,
+    fields: str = None,
+    add_parents: str | list[str] | None = None,
+    remove_parents: str | list[str] | None = None,
+) -> HttpRequest:
+    """
+    ファイルを更新するリクエストを作ります（executeはしない）。BatchRequestQueueに追加するときに使います。
+    引数はupdate_fileと同じです
+    """
+    return drive_service.files().update(
+        fileId=file_id,
+        body=body,
+        addParents=join_parent_ids(add_parents),
+        removeParents=join_parent_ids(remove_parents),
+        fields=fields,
+    )
+
+
 def update_file(
     drive_service: Resource,
     file_id: str,
     body: dict | None = None,
     fields: str = None,
-    add_parents: list[str] | None = None,
-    remove_parents: list[str] | None = None,
+    add_parents: str | list[str] | None = None,
+    remove_parents: str | list[str] | None = None,
 ) -> dict:
     """
     Google Drive APIを使用して、ファイルを更新します。
@@ -560,22 +989,14 @@ def update_file(
         file_id: ファイルID
         body: 更新するファイルのメタデータ
         fields: 取得するフィールド
-        add_parents: 追加する親フォルダID。文字列が入ったリストで受け取り文字列に変換して渡す
-        remove_parents: 削除する親フォルダID。文字列が入ったリストで受け取り文字列に変換して渡す
+        add_parents: 追加する親フォルダID。文字列か、文字列が入ったリストで受け取り、カンマ区切りの文字列に変換して渡す
+        remove_parents: 削除する親フォルダID。文字列か、文字列が入ったリストで受け取り、カンマ区切りの文字列に変換して渡す
     return:
         更新したファイルの情報
     """
-    return (
-        drive_service.files()
-        .update(
-            fileId=file_id,
-            body=body,
-            addParents=",".join(add_parents) if add_parents else None,
-            removeParents=",".join(remove_parents) if remove_parents else None,
-            fields=fields,
-        )
-        .execute()
-    )
+    return build_update_file_request(
+        drive_service, file_id, body, fields, add_parents, remove_parents
+    ).execute()
 
 
 def delete_file(
@@ -602,88 +1023,223 @@ def delete_file(
     )
 
 
+def print_download_progress(downloaded_bytes: int, total_bytes: int | None) -> None:
+    """save_gdrive_fileの進捗を標準出力に表示します。進捗のコールバックとして使います"""
+    if total_bytes:
+        print(f"Download {int(downloaded_bytes / total_bytes * 100)}.")
+    else:
+        print(f"Download {downloaded_bytes} bytes.")
+
+
 def save_gdrive_file(
-    drive_service: Resource, file_id: str, export_mimetype: str, export_filepath: Path
+    drive_service: Resource,
+    file_id: str,
+    export_mimetype: str,
+    export_filepath: Path,
+    chunk_size: int = DOWNLOAD_CHUNK_SIZE,
+    progress_callback: Callable[[int, int | None], None] | None = None,
 ) -> None:
     """
     Google Drive APIを使用して、ファイルをエクスポートします。
+    チャンクごとに保存先へ直接書き込むので、ファイル全体をメモリに載せません。
+    チャンクの取得に失敗した場合は、REQUEST_NUM_RETRIESの回数まで、そのチャンクから取得し直します。
+    途中で失敗した場合に壊れたファイルを残さないように、一時ファイルへ書き込んでから置き換えます。失敗した場合は一時ファイルも削除します。
     args:
         drive_service: Drive APIのサービス
         file_id: エクスポートしたいファイルID
         export_mimetype: エクスポートするファイルのMIMEタイプ
+        export_filepath: 保存先ファイルパス
+        chunk_size: 1回のリクエストで取得するバイト数
+        progress_callback: チャンクを取得するたびに(取得済みバイト数, 全体のバイト数)で呼び出す関数。
+            全体のバイト数が分からない場合はNone。表示する場合はprint_download_progressを渡す
     return:
-        エクスポートしたファイルのバイナリデータ
+        なし
     """
 
     dl_request = drive_service.files().export_media(
         fileId=file_id, mimeType=export_mimetype
     )
 
-    file = io.BytesIO()
-    downloader = MediaIoBaseDownload(file, dl_request)
+    download_path = export_filepath.with_name(f"{export_filepath.name}.download")
+    try:
+        with download_path.open("wb") as export_file:
+            downloader = MediaIoBaseDownload(
+                export_file, dl_request, chunksize=chunk_size
+            )
 
-    done = False
-    while done is False:
-        status, done = downloader.next_chunk()
-        print(f"Download {int(status.progress() * 100)}.")
+            done = False
+            while done is False:
+                status, done = downloader.next_chunk(num_retries=REQUEST_NUM_RETRIES)
+                if progress_callback:
+                    progress_callback(status.resumable_progress, status.total_size)
 
-    with (export_filepath).open("wb") as export_exceltopdf:
-        export_exceltopdf.write(file.getvalue())
+        download_path.replace(export_filepath)
+    finally:
+        # 失敗した場合は一時ファイルを残さない（置き換え済みなら何もしない）
+        download_path.unlink(missing_ok=True)
 
 
 # drive apiのファイルコピーのみ
-def copy_file(drive_service: Resource, file_id: str, fields: str = "id") -> dict:
+def copy_file(
+    drive_service: Resource,
+    file_id: str,
+    fields: str = "id",
+    body: dict | None = None,
+) -> dict:
     """
     Google Drive APIを使用して、ファイルをコピーします。
     args:
         drive_service: Drive APIのサービス
         file_id: コピーしたいファイルID
         fields: 取得するフィールド
+        body: コピーしたファイルのメタデータ（name, parents, properties等）。コピーと同時に設定される
     return:
         コピーしたファイルの情報
 
     """
 
-    return drive_service.files().copy(fileId=file_id, fields=fields).execute()
+    return (
+        drive_service.files()
+        .copy(fileId=file_id, body=body, fields=fields)
+        .execute(num_retries=REQUEST_NUM_RETRIES)
+    )
+
+
+def generate_copy_body(
+    file_name: str | None = None,
+    parent_ids: list[str] | None = None,
+    properties: dict[str, str] | None = None,
+) -> dict:
+    """
+    テンプレートを複製するときに、コピーのリクエストで一緒に設定するメタデータを作ります。
+    args:
+        file_name: 複製したファイルの名前。Noneの場合はbodyにnameを入れず、Driveの既定の名前
+            （「Copy of [複製元のファイル名]」、日本語のアカウントでは「[複製元のファイル名]のコピー」）になる
+        parent_ids: 保存先のフォルダID。Noneの場合は複製元と同じフォルダになる
+        properties: ファイルに付けるカスタムプロパティ 例: {"quote_id": "0001"}
+    return:
+        files().copyのbody
+    """
+    body = {}
+    if file_name:
+        body["name"] = file_name
+    if parent_ids:
+        body["parents"] = parent_ids
+    if properties:
+        body["properties"] = properties
+    return body
 
 
 def dupulicate_file(
-    drive_service: Resource, file_id: str, file_name: str | None = None
+    drive_service: Resource,
+    file_id: str,
+    file_name: str | None = None,
+    parent_ids: list[str] | None = None,
+    properties: dict[str, str] | None = None,
 ) -> str:
     """
     Google Drive APIを使用して、シートを複製します。
+    ファイル名・保存先・プロパティはコピーのリクエストで一緒に設定するので、1回のリクエストで済みます。
     args:
         drive_service: Drive APIのサービス
         file_id: ファイルID
-        file_name: 複製したファイルの名前。Noneの場合は複製元のファイル名をそのまま使う
+        file_name: 複製したファイルの名前。Noneの場合はbodyにnameを入れず、Driveの既定の名前
+            （「Copy of [複製元のファイル名]」、日本語のアカウントでは「[複製元のファイル名]のコピー」）になる
+        parent_ids: 保存先のフォルダID。Noneの場合は複製元と同じフォルダになる
+        properties: ファイルに付けるカスタムプロパティ
     return:
         複製したファイルのID。API利用時に例外が発生した場合は空文字を返す
     """
 
     # テンプレートを複製します
-    dupulicated_file_id = ""
     try:
-        response = copy_file(drive_service, file_id)
-
-        # 複製したファイルのIDを取得
-        dupulicated_file_id = response["id"]
-
-        # file_nameがある場合は、ファイル名を変更する
-        if file_name:
-            _ = (
-                drive_service.files()
-                .update(
-                    fileId=dupulicated_file_id,
-                    body={"name": file_name},
-                )
-                .execute()
-            )
+        response = copy_file(
+            drive_service,
+            file_id,
+            body=generate_copy_body(file_name, parent_ids, properties),
+        )
     except HttpError as error:
         print(f"An error occurred: {error}")
         return ""
 
     # 複製したファイルのIDを返す
-    return dupulicated_file_id
+    return response["id"]
+
+
+def dupulicate_files(
+    drive_service: Resource,
+    file_id: str,
+    copy_bodies: list[dict],
+    fields: str = "id",
+) -> list[dict | HttpError | Exception]:
+    """
+    Google Drive APIのバッチリクエストを使用して、1つのテンプレートから複数のファイルを複製します。
+    copyは送り直すと複製が重複するので、送り直しません。
+    5xxや通信エラーで失敗したものは、Drive側では複製できていることがあるので、
+    bodyのpropertiesが一致するファイルが1件だけ見つかれば、それを複製したファイルとして返します。
+    args:
+        drive_service: Drive APIのサービス
+        file_id: 複製元のファイルID
+        copy_bodies: 複製したファイルごとのメタデータ。generate_copy_bodyで作る。
+            propertiesを付けておくと、失敗したときに複製済みのファイルを探せる
+        fields: 取得するフィールド
+    return:
+        copy_bodiesと同じ順番の、複製したファイルの情報のリスト。失敗したものは例外が入る
+    """
+    batch_queue = BatchRequestQueue(drive_service)
+    for copy_body in copy_bodies:
+        batch_queue.add(
+            drive_service.files().copy(fileId=file_id, body=copy_body, fields=fields),
+            retry=False,
+        )
+    results = batch_queue.flush()
+
+    # 複製できたか分からないものは、propertiesで複製済みのファイルを探す（listは送り直してよい）
+    unknown_indexes = [
+        index
+        for index, result in enumerate(results)
+        if is_retriable_error(result) and copy_bodies[index].get("properties")
+    ]
+    if not unknown_indexes:
+        return results
+
+    search_queue = BatchRequestQueue(drive_service)
+    for index in unknown_indexes:
+        search_queue.add(
+            drive_service.files().list(
+                q=generate_properties_query(copy_bodies[index]["properties"]),
+                fields=f"files({fields})",
+                pageSize=2,
+            ),
+            retry=True,
+        )
+    for index, search_result in zip(unknown_indexes, search_queue.flush(), strict=True):
+        if isinstance(search_result, Exception):
+            continue
+        found_files = search_result.get("files", [])
+        # 見つからないもの、複数見つかったものは、失敗のままにする
+        if len(found_files) == 1:
+            results[index] = found_files[0]
+    return results
+
+
+def generate_properties_query(properties: dict[str, str]) -> str:
+    """
+    カスタムプロパティが全て一致する、ゴミ箱にないファイルを探すDrive APIの検索クエリを作ります。
+    args:
+        properties: カスタムプロパティ 例: {"quote_id": "0001"}
+    return:
+        files().listのq
+    """
+    conditions = []
+    for key, value in properties.items():
+        # クエリの文字列はシングルクォートで囲むので、値の中のシングルクォートはエスケープする
+        escaped_value = value.replace("'", "\\'")
+        conditions.append(
+            f"properties has {{ key='{key}' and value='{escaped_value}' }}"
+        )
+    conditions.append("trashed = false")
+    return " and ".join(conditions)
 
 
 # TODO:2024-02-12 ここはPDFだけではなくfileタイプを指定できるようにする。変換してDLができない場合は明示的なエラーにすること
@@ -698,7 +1254,8 @@ def export_pdf_by_driveexporturl(
     GoogleドライブのエクスポートURLを元に、PDFファイルをダウンロードします。
     googleapiclientモジュールは利用せず、requestsモジュールを使用しています。そのため、google_auth_oauthlibモジュールで取得したトークンをtoken引数に渡してください。
 
-    ダウンロードに失敗した場合は、requests.exceptions.HTTPError例外を出します。
+    429/5xxと接続エラーはREQUEST_NUM_RETRIESの回数まで指数バックオフでリトライし、それでも失敗した場合は
+    requests.exceptions.HTTPError（接続エラーの場合はConnectionError, Timeout）例外を出します。
     通常はAPI経由でダウンロードしますが、pdfの場合はエクスポートのパラメーター指定をして
     のダウンロードは対応していません。（例えば、pdf, 横向きでエクスポートはできない）
 
@@ -739,13 +1296,8 @@ def export_pdf_by_driveexporturl(
         export_url = f"https://docs.google.com/spreadsheets/d/{file_id}/export?format=pdf&{query_str}"
 
     # requestsでダウンロードする。stream指定でチャンクサイズは1MBでダウンロードする
-    params = {"access_token": token}
-
-    with requests.get(export_url, params=params, stream=True) as r:
-        r.raise_for_status()
-        with save_path.open("wb") as f:
-            for chunk in r.iter_content(chunk_size=1024 * 1024):
-                f.write(chunk)
+    # エクスポートは同時に行うと429になりやすいので、429/5xxと接続エラーはリトライする
+    download_to_file(export_url, save_path, params={"access_token": token})
 
 
 # [Google Spreadsheet API]
@@ -819,6 +1371,97 @@ def update_sheet(
     )
 
 
+def reserve_numbered_rows(
+    sheet_service: Resource,
+    sheet_id: str,
+    worksheet_name: str,
+    count: int,
+    number_row: list,
+) -> list[tuple[str, int]]:
+    """
+    管理表に番号を振る行をまとめて追加し、追加された番号と行番号を返します。
+    number_rowの先頭の列に番号を計算する数式（例: =TEXT(ROW()-1,"0000")）を入れておくと、
+    count行を1回の追加で連番として確保できます。
+    追加は冪等ではないので、429のとき以外はリトライしません。失敗した場合はHttpErrorをそのまま出します。
+    args:
+        sheet_service: Spreadsheet APIのサービス
+        sheet_id: スプレッドシートID
+        worksheet_name: ワークシート名
+        count: 確保する行数
+        number_row: 1行分の値。先頭の列の計算結果が番号になる
+    return:
+        (番号, 行番号)のリスト。追加した順番
+    """
+    if count == 0:
+        return []
+
+    append_request = (
+        sheet_service.spreadsheets()
+        .values()
+        .append(
+            spreadsheetId=sheet_id,
+            range=worksheet_name,
+            body={"values": [number_row] * count},
+            valueInputOption="USER_ENTERED",
+            insertDataOption="INSERT_ROWS",
+            includeValuesInResponse=True,
+        )
+    )
+    # appendは冪等ではないので、execute(num_retries)の自動リトライは使わない
+    # 5xxや接続エラーはサーバー側で追加済みのことがあり、送り直すと番号が重複して確保される
+    # 429（レート制限）は追加されていないので、指数バックオフで送り直す
+    for retry_count in range(REQUEST_NUM_RETRIES + 1):
+        try:
+            append_result = append_request.execute()
+            break
+        except HttpError as error:
+            if error.resp.status != 429 or retry_count >= REQUEST_NUM_RETRIES:
+                raise
+            time.sleep(2**retry_count)
+    updates = append_result.get("updates")
+    # 例: "見積書管理!A11:D20" -> 11行目から順番に追加されている
+    first_row = int(
+        RANGE_ADDR_PATTERN.match(updates.get("updatedRange")).group("firstrow")
+    )
+    return [
+        (row_values[0], first_row + i)
+        for i, row_values in enumerate(updates.get("updatedData").get("values"))
+    ]
+
+
+def batch_update_sheet(
+    service: Resource,
+    spreadsheet_id: str,
+    range_values: dict[str, list[list]],
+    value_input_option: str = "RAW",
+) -> dict:
+    """
+    Google Spreadsheet APIを使用して、複数のセル範囲へ1回のリクエストで値を記入します。
+    args:
+        service: Spreadsheet APIのサービス
+        spreadsheet_id: スプレッドシートID
+        range_values: {セル範囲: 記入する値のリスト}
+        value_input_option: 値の入力方法
+    return:
+        APIからのレスポンス
+    """
+    return (
+        service.spreadsheets()
+        .values()
+        .batchUpdate(
+            spreadsheetId=spreadsheet_id,
+            body={
+                "valueInputOption": value_input_option,
+                "data": [
+                    {"range": range_name, "values": values}
+                    for range_name, values in range_values.items()
+                ],
+            },
+        )
+        .execute(num_retries=REQUEST_NUM_RETRIES)
+    )
+
+
 # [Google Chat API]
 
 # メッセージ作成
@@ -0,0 +1,46 @@
+import os
+
+import redis
+from rq import Queue
+
+import chat.card
+import chat.session
+from chat.registry import ChatRequest, TaskRegistry
+from helper import chatcard
+
+# チャットから呼び出すタスクのハンドラー
+# タスクを追加する場合は、このパッケージにモジュールを作り、TASK_REGISTRYに登録する
+# ハンドラーモジュールは最初に呼び出されたときにimportされる
+
+# RQのキューを初期化
+queue = Queue(connection=redis.from_url(os.environ.get("RQ_REDIS_URL")))
+
+# チャットボットの設定
+bot_header = chatcard.bot_header
+
+# アクションレスポンスの定義
+# https://developers.google.com/hangouts/chat/reference/message-formats/cards#action_response
+ACTION_RESPONSE_OK_JSON = chat.card.genactionresponse_dialog()
+
+
+def cancel_task_session(request: ChatRequest, task_name: str) -> dict:
+    """タスクのセッションをキャンセル済みにして、キャンセルしたことを伝えるカードを返す"""
+    request.session_manager.update_session(
+        request.user_id, task_name, chat.session.TaskState.CANCELLED
+    )
+    return chat.card.create_card_text("cancel_task", bot_header, "キャンセルしました")
+
+
+TASK_REGISTRY = TaskRegistry()
+TASK_REGISTRY.register(
+    "calc_add", "chat.handlers.calc_add", slash_command_ids=("1",)
+)
+TASK_REGISTRY.register(
+    "generate_quotes", "chat.handlers.generate_quotes", slash_command_ids=("102",)
+)
+TASK_REGISTRY.register(
+    "generate_invoice", "chat.handlers.generate_invoice", slash_command_ids=("103",)
+)
+TASK_REGISTRY.register(
+    "run_mail_action", "chat.handlers.run_mail_action", slash_command_ids=("104",)
+)
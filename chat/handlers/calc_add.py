@@ -0,0 +1,86 @@
+# [calc_add]: 設定カード→内容確認カード→メインタスク実行
+import chat.card
+import chat.session
+from chat.handlers import (
+    ACTION_RESPONSE_OK_JSON,
+    bot_header,
+    cancel_task_session,
+    queue,
+)
+from chat.registry import ChatRequest
+from task import bot_calc_add
+
+# セッションに使うタスク名
+SESSION_TASK_NAME = "run_calc_add"
+
+
+def prepare(request: ChatRequest) -> dict:
+    print("slash command 1: run_calc")
+    # セッション初期化
+    request.session_manager.initialize_session(
+        request.user_id, SESSION_TASK_NAME, initial_data=None
+    )
+
+    first_num = chat.card.genwidget_textinput_singleline("first_num", "first_num")
+    second_num = chat.card.genwidget_textinput_singleline("second_num", "second_num")
+    buttonlist = chat.card.genwidget_buttonlist(
+        [chat.card.gencomponent_button("確認", "confirm__calc_add")]
+    )
+    config_body = chat.card.create_card(
+        "config_card__calc_add", bot_header, [first_num, second_num, buttonlist]
+    )
+    return config_body
+
+
+def confirm(request: ChatRequest) -> dict:
+    print("confirm_calc_add")
+    form_inputs = request.form_inputs
+    now_session = request.session_manager.update_and_get_session(
+        request.user_id,
+        SESSION_TASK_NAME,
+        chat.session.TaskState.RUNNING,
+        data={
+            "first_num": int(form_inputs["first_num"]["stringInputs"]["value"][0]),
+            "second_num": int(form_inputs["second_num"]["stringInputs"]["value"][0]),
+        },
+    )
+    session_data = now_session.get("data", "{}")
+    first_num = int(session_data["first_num"])
+    second_num = int(session_data["second_num"])
+
+    cardbody = chat.card.create_card(
+        "confirm_card__run_calc",
+        header=bot_header,
+        widgets=[
+            chat.card.genwidget_textparagraph(
+                f"計算を実行しますか？: {first_num} + {second_num} ",
+            ),
+            chat.card.genwidget_buttonlist(
+                [
+                    chat.card.gencomponent_button("実行", "run_task__calc_add"),
+                    chat.card.gencomponent_button("キャンセル", "cancel_task__calc_add"),
+                ]
+            ),
+        ],
+    )
+    return cardbody
+
+
+def run(request: ChatRequest) -> dict:
+    print("runtask__calc_add")
+    now_session = request.session_manager.get_and_update_session(
+        request.user_id, SESSION_TASK_NAME, chat.session.TaskState.COMPLETED
+    )
+    session_data = now_session.get("data", "{}")
+
+    job = queue.enqueue(
+        bot_calc_add.bot_calc_add,
+        args=(int(session_data["first_num"]), int(session_data["second_num"])),
+    )
+
+    print(f"job.id:{job.id}")
+    return ACTION_RESPONSE_OK_JSON
+
+
+def cancel(request: ChatRequest) -> dict:
+    return cancel_task_session(request, SESSION_TASK_NAME)
@@ -0,0 +1,111 @@
+# [generate_invoice]: 設定カード→内容確認→メインタスク実行
+import json
+
+import chat.card
+import chat.session
+from chat.handlers import (
+    ACTION_RESPONSE_OK_JSON,
+    bot_header,
+    cancel_task_session,
+    queue,
+)
+from chat.registry import ChatRequest
+from helper import convert_dict_to_dataclass
+from task import generate_invoice
+
+
+def prepare(request: ChatRequest) -> dict:
+    print("slash command 103: generate_invoice")
+    # prepareタスク実行後に設定カードを開く
+    prepare_task = generate_invoice.PrepareTask()
+    job = queue.enqueue(prepare_task.execute_task_by_chat)
+
+    print(f"job.id:{job.id}")
+    return ACTION_RESPONSE_OK_JSON
+
+
+def confirm(request: ChatRequest) -> dict:
+    print("confirm__generate_invoice")
+
+    # 設定カードの値はjson文字列なので、ここで一度だけdictにしてセッションに保存する
+    choiced_quote_list = [
+        json.loads(choiced_quote_jsonstr)
+        for choiced_quote_jsonstr in request.form_inputs["quoteitems"]["stringInputs"][
+            "value"
+        ]
+    ]
+
+    # 更新と取得は1往復で行う
+    now_session = request.session_manager.update_and_get_session(
+        request.user_id,
+        "generate_invoice",
+        chat.session.TaskState.RUNNING,
+        data={"choiced_quote_list": choiced_quote_list},
+    )
+    session_data = now_session["data"]
+
+    # 請求書の計算を行う: セッションデータにはdictが入っているので、dataclassへ変換する
+    ask_choiced_quote_list = [
+        convert_dict_to_dataclass(choiced_quote, generate_invoice.QuoteData)
+        for choiced_quote in session_data.get("choiced_quote_list")
+    ]
+
+    # 見積書の情報を元に、金額の合計を出す
+    invoice_data = generate_invoice.generate_invoice_data(ask_choiced_quote_list)
+
+    # ここで請求書情報を出して、こちらの検証と正しいか確認
+    calc_result = f"""
+    [請求情報]
+    件数: {len(ask_choiced_quote_list)}
+    合計金額:{invoice_data.price}
+    """
+
+    cardbody = chat.card.create_card(
+        "confirm__generate_invoice",
+        header=bot_header,
+        widgets=[
+            chat.card.genwidget_textparagraph(
+                "請求書作成を実行しますか？",
+            ),
+            chat.card.genwidget_textparagraph(calc_result),
+            chat.card.genwidget_buttonlist(
+                [
+                    chat.card.gencomponent_button("実行", "run_task__generate_invoice"),
+                    chat.card.gencomponent_button(
+                        "キャンセル", "cancel_task__generate_invoice"
+                    ),
+                ]
+            ),
+        ],
+    )
+
+    return cardbody
+
+
+def run(request: ChatRequest) -> dict:
+    print("run_task__generate_invoice")
+    # 取得と完了への更新は1往復で行う
+    now_session = request.session_manager.get_and_update_session(
+        request.user_id, "generate_invoice", chat.session.TaskState.COMPLETED
+    )
+    session_data = now_session.get("data", "{}")
+
+    # メインタスク向けに、セッションデータを整形する
+    task_data = {
+        "task_data": {
+            # ask_dataの中身はdictのリストなので、dataclassに変換する
+            "choiced_quote_list": [
+                convert_dict_to_dataclass(choiced_quote, generate_invoice.QuoteData)
+                for choiced_quote in session_data.get("choiced_quote_list")
+            ]
+        }
+    }
+    script_task = generate_invoice.MainTask()
+    job = queue.enqueue(script_task.execute_task_by_chat, args=(task_data,))
+
+    print(f"job.id:{job.id}")
+    return ACTION_RESPONSE_OK_JSON
+
+
+def cancel(request: ChatRequest) -> dict:
+    return cancel_task_session(request, "generate_invoice")
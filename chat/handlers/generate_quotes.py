@@ -0,0 +1,40 @@
+# [generate_quotes]: 設定カード→メインタスク実行
+import json
+
+from chat.handlers import ACTION_RESPONSE_OK_JSON, cancel_task_session, queue
+from chat.registry import ChatRequest
+from task import generate_quotes
+
+
+def prepare(request: ChatRequest) -> dict:
+    print("slash command 102: generate_quotes")
+    # prepareタスク実行後に設定カードを開く
+    script_task = generate_quotes.PrepareTask()
+    job = queue.enqueue(script_task.execute_task_by_chat)
+
+    print(f"job.id:{job.id}")
+    return ACTION_RESPONSE_OK_JSON
+
+
+def run(request: ChatRequest) -> dict:
+    print("run_task__generate_quotes")
+    task_data = {
+        "task_data": {
+            # 設定カードの結果はjson文字列のリストなのでloadする
+            "selected_estimate_calcsheets": [
+                json.loads(estimate_calcsheet)
+                for estimate_calcsheet in request.form_inputs[
+                    "estimate_list_checkbox"
+                ]["stringInputs"]["value"]
+            ]
+        }
+    }
+    script_task = generate_quotes.MainTask()
+    job = queue.enqueue(script_task.execute_task_by_chat, args=(task_data,))
+
+    print(f"job.id:{job.id}")
+    return ACTION_RESPONSE_OK_JSON
+
+
+def cancel(request: ChatRequest) -> dict:
+    return cancel_task_session(request, "generate_quotes")
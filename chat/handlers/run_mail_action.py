@@ -0,0 +1,39 @@
+# [run_mail_action]: 設定カード→メインタスク実行
+from chat.handlers import ACTION_RESPONSE_OK_JSON, cancel_task_session, queue
+from chat.registry import ChatRequest
+from task import run_mail_action
+
+
+def prepare(request: ChatRequest) -> dict:
+    print("slash command 104: run_mail_action")
+    # prepareタスク実行後に、設定カードを開く。設定カードはREST API経由で開く
+    script_task = run_mail_action.PrepareTask()
+    job = queue.enqueue(script_task.execute_task_by_chat)
+
+    print(f"job.id:{job.id}")
+    return ACTION_RESPONSE_OK_JSON
+
+
+def run(request: ChatRequest) -> dict:
+    print("run_task__run_mail_action")
+    settings = request.form_inputs["run_mail_action_settings"]["stringInputs"]["value"]
+    task_data = {
+        "task_data": {
+            "selected_message_id": request.form_inputs["selected_message_id"][
+                "stringInputs"
+            ]["value"][0],
+            "ask_generate_projectfile": "ask_generate_projectfile" in settings,
+            "ask_add_schedule_and_generate_estimate_calcsheet": "ask_add_schedule_and_generate_estimate_calcsheet"
+            in settings,
+            "ask_add_schedule_nextmonth": "ask_add_schedule_nextmonth" in settings,
+        }
+    }
+    script_task = run_mail_action.MainTask()
+    job = queue.enqueue(script_task.execute_task_by_chat, args=(task_data,))
+
+    print(f"job.id:{job.id}")
+    return ACTION_RESPONSE_OK_JSON
+
+
+def cancel(request: ChatRequest) -> dict:
+    return cancel_task_session(request, "run_mail_action")
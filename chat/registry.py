@@ -0,0 +1,98 @@
+import importlib
+from dataclasses import dataclass, field
+from types import ModuleType
+from typing import Callable
+
+import chat.session
+
+# invokedFunctionの接頭辞と、ハンドラーモジュールの関数名の対応
+# invokedFunctionは [接頭辞]__[タスク名] の形式にする 例: confirm__generate_invoice
+ACTION_HANDLER_NAMES = {
+    "confirm": "confirm",
+    "run_task": "run",
+    "cancel_task": "cancel",
+}
+
+
+@dataclass
+class ChatRequest:
+    """
+    ハンドラーに渡すチャットのイベント情報
+
+    args:
+        event: Google Chatのイベント
+        user_id: イベントを起こしたユーザー 例: users/123
+        form_inputs: カードの入力値。カードクリック以外は空
+        session_manager: セッションマネージャー
+    """
+
+    event: dict
+    user_id: str
+    form_inputs: dict = field(default_factory=dict)
+    session_manager: chat.session.SessionManager = field(
+        default_factory=chat.session.get_session_manager
+    )
+
+
+ChatHandler = Callable[[ChatRequest], dict]
+
+
+class TaskRegistry:
+    """
+    チャットから呼び出すタスクのハンドラーを登録し、invokedFunctionやスラッシュコマンドから引き当てます。
+
+    ハンドラーはタスクごとのモジュールに、prepare(スラッシュコマンド), confirm, run, cancelという名前の関数で定義します。
+    モジュールは最初に呼び出されたときにimportするので、起動時にタスク側の重いモジュールを読み込みません。
+
+    # registry = TaskRegistry()
+    # registry.register("generate_invoice", "chat.handlers.generate_invoice", slash_command_ids=("103",))
+    # handler = registry.resolve_invoked_function("confirm__generate_invoice")
+    """
+
+    def __init__(self):
+        self._module_names: dict[str, str] = {}
+        self._slash_commands: dict[str, str] = {}
+        self._invoked_functions: dict[str, tuple[str, str]] = {}
+
+    def register(
+        self,
+        task_name: str,
+        module_name: str,
+        slash_command_ids: tuple[str, ...] = (),
+    ) -> None:
+        """
+        タスクのハンドラーモジュールを登録します
+
+        args:
+            task_name: invokedFunctionの後ろにつくタスク名
+            module_name: ハンドラーを定義したモジュール名 例: chat.handlers.generate_invoice
+            slash_command_ids: prepareを呼び出すスラッシュコマンドのID
+        """
+        self._module_names[task_name] = module_name
+        for command_id in slash_command_ids:
+            self._slash_commands[command_id] = task_name
+        for action, handler_name in ACTION_HANDLER_NAMES.items():
+            self._invoked_functions[f"{action}__{task_name}"] = (task_name, handler_name)
+
+    def register_invoked_function(
+        self, invoked_function: str, task_name: str, handler_name: str
+    ) -> None:
+        """命名規則に沿っていないinvokedFunctionを、登録済みタスクのハンドラーに割り当てます"""
+        self._invoked_functions[invoked_function] = (task_name, handler_name)
+
+    def _load_handler(self, task_name: str, handler_name: str) -> ChatHandler | None:
+        # import_moduleは2回目以降sys.modulesから返すので、ここでキャッシュしなくてよい
+        module: ModuleType = importlib.import_module(self._module_names[task_name])
+        return getattr(module, handler_name, None)
+
+    def resolve_invoked_function(self, invoked_function: str) -> ChatHandler | None:
+        """invokedFunctionに対応するハンドラーを返します。登録がなければNone"""
+        if (route := self._invoked_functions.get(invoked_function)) is None:
+            return None
+        return self._load_handler(*route)
+
+    def resolve_slash_command(self, command_id: str) -> ChatHandler | None:
+        """スラッシュコマンドのIDに対応するprepareハンドラーを返します。登録がなければNone"""
+        if (task_name := self._slash_commands.get(command_id)) is None:
+            return None
+        return self._load_handler(task_name, "prepare")
@@ -1,9 +1,33 @@
+from collections.abc import Mapping
 from dataclasses import dataclass
+import logging
 import redis
-import json
 import os
+import threading
 from enum import Enum
 
+from chat.session_codec import SessionCodec, get_session_codec
+from helper import load_config
+
+logger = logging.getLogger(__name__)
+
+# セッションの有効期限などの設定。設定ファイルに[session]がない場合は既定値を使う
+SESSION_CONFIG = load_config.CONFIG.get("session", {})
+# タスクごとの指定がない場合のセッション有効期限（秒）
+DEFAULT_TTL_SECONDS = SESSION_CONFIG.get("DEFAULT_TTL_SECONDS", 60 * 60 * 24)
+# タスク名ごとのセッション有効期限（秒）
+TASK_TTL_SECONDS: dict = SESSION_CONFIG.get("TASK_TTL_SECONDS", {})
+# 完了・キャンセル・エラーになったセッションの有効期限（秒）。0ならすぐに削除する
+TERMINAL_STATE_TTL_SECONDS = SESSION_CONFIG.get("TERMINAL_STATE_TTL_SECONDS", 0)
+# スイーパーの実行間隔（秒）
+SWEEP_INTERVAL_SECONDS = SESSION_CONFIG.get("SWEEP_INTERVAL_SECONDS", 60 * 10)
+# dataの保存形式: "json", "msgpack", "auto"（msgpackと同じ）
+CODEC_NAME = SESSION_CONFIG.get("CODEC", "auto")
+# dataがこのサイズ（バイト）を超えたらzlibで圧縮する
+COMPRESS_THRESHOLD_BYTES = SESSION_CONFIG.get("COMPRESS_THRESHOLD_BYTES", 1024)
+# 複数ワーカーのうち1つだけがセッションを整理するためのロックのキー。セッションのキー（*:*）と重ならない名前にする
+SWEEP_LOCK_KEY = "session_sweeper_lock"
+
 
 # タスク状態をEnumで定義
 class TaskState(Enum):
@@ -14,6 +38,10 @@ class TaskState(Enum):
     ERROR = "error"
 
 
+# これ以上進まないタスク状態。この状態になったセッションは削除か短い有効期限にする
+TERMINAL_TASK_STATES = (TaskState.COMPLETED, TaskState.CANCELLED, TaskState.ERROR)
+
+
 @dataclass
 class SessionData:
     current_task: str
@@ -21,15 +49,67 @@ class SessionData:
     data: dict
 
 
+class SessionRecord(Mapping):
+    """
+    Redisから取得したセッションです。dictと同じように読み取れます。
+    dataは最初にアクセスしたときにデコードするので、state等だけを見る場合はデコードしません。
+    """
+
+    def __init__(self, raw_session: dict, codec: SessionCodec):
+        # Redisからはバイト列で返ってくるので、dataの他は文字列にしておく
+        self._fields = {
+            key.decode(): value if key == b"data" else value.decode()
+            for key, value in raw_session.items()
+        }
+        self._codec = codec
+        self._data_decoded = False
+
+    def __getitem__(self, key: str):
+        if key == "data" and not self._data_decoded:
+            self._fields["data"] = self._codec.decode(self._fields["data"])
+            self._data_decoded = True
+        return self._fields[key]
+
+    def __iter__(self):
+        return iter(self._fields)
+
+    def __len__(self) -> int:
+        return len(self._fields)
+
+    def __repr__(self) -> str:
+        return f"SessionRecord({dict(self)})"
+
+
+# プロセス全体で共有するコネクションプール。スレッドをまたいで使える
+_connection_pool: redis.ConnectionPool | None = None
+_connection_pool_lock = threading.Lock()
+
+
+def get_connection_pool() -> redis.ConnectionPool:
+    """
+    セッション用のRedisコネクションプールを返します。
+    初回呼び出し時にSESSION_REDIS_URLから作成し、以降はプロセス内で同じものを使い回します。
+    """
+    global _connection_pool
+    with _connection_pool_lock:
+        if _connection_pool is None:
+            redis_url = os.environ.get("SESSION_REDIS_URL", "redis://localhost:6379/10")
+            # dataはバイト列で保存するので、decode_responsesは使わない
+            _connection_pool = redis.ConnectionPool.from_url(redis_url)
+        return _connection_pool
+
+
 class SessionManager:
     """
     チャットで利用するセッションマネージャーです。
     初期化を行い、更新、取得を行うことができます。
     タスク状態であるTaskStateはEnumで定義しています。
+    Redisへの接続はプロセス全体で共有するコネクションプールから取り出します。
 
-    # TODO:2023-10-10
-    # 状態管理はタスク状態で行うようにする。
-    # COMPLETED, CANCELLED, ERRORの場合は、redis上から削除するような仕様にする（できる？
+    セッションには書き込みのたびに有効期限を付けます。期限はタスク名ごとにTASK_TTL_SECONDSで設定でき、
+    ない場合はDEFAULT_TTL_SECONDSになります。
+    COMPLETED, CANCELLED, ERRORになったセッションはTERMINAL_STATE_TTL_SECONDSの期限にします（0なら削除）。
+    dataはcodec（既定は設定ファイルのCODEC）でバイト列にして保存し、取得時はSessionRecordで遅延デコードします。
 
     # session_manager = SessionManager()
     # data = {"key1": "value1", "key2": "value2"}
@@ -39,35 +119,247 @@ class SessionManager:
     # session_manager.update_session("user_id", "task_name", TaskState.RUNNING, data)
     # 取得...
     # session_info = session_manager.get_session("user_id", "task_name")
+    # 更新して取得（1往復）...
+    # session_info = session_manager.update_and_get_session("user_id", "task_name", TaskState.RUNNING, data)
     """
 
-    def __init__(self):
-        redis_url = os.environ.get("SESSION_REDIS_URL", "redis://localhost:6379/10")
-        self.redis = redis.StrictRedis.from_url(redis_url, decode_responses=True)
+    def __init__(
+        self,
+        connection_pool: redis.ConnectionPool | None = None,
+        codec: SessionCodec | None = None,
+    ):
+        self.redis = redis.StrictRedis(
+            connection_pool=connection_pool or get_connection_pool()
+        )
+        self.codec = codec or get_session_codec(CODEC_NAME, COMPRESS_THRESHOLD_BYTES)
 
     def _generate_session_key(self, user_id: str, task_name: str) -> str:
         return f"{user_id}:{task_name}"
 
+    def _generate_update_mapping(
+        self, task_name: str, state: TaskState, data=None
+    ) -> dict:
+        # 整理や期限0で削除されたキーを作り直す場合もあるので、current_taskも毎回書き込む
+        # dataはコーデックでバイト列にして保存する
+        return {
+            "current_task": task_name,
+            "state": state.value,
+            "data": self.codec.encode(data or {}),
+        }
+
+    def _load_session(self, session_data: dict) -> SessionRecord:
+        # dataのデコードはアクセスされるまで行わない
+        return SessionRecord(session_data, self.codec)
+
+    def _get_ttl_seconds(self, task_name: str, state: TaskState) -> int:
+        if state in TERMINAL_TASK_STATES:
+            return TERMINAL_STATE_TTL_SECONDS
+        return TASK_TTL_SECONDS.get(task_name, DEFAULT_TTL_SECONDS)
+
+    def _queue_write(
+        self, pipe, key: str, task_name: str, state: TaskState, mapping: dict
+    ) -> None:
+        # 書き込みと有効期限の設定をパイプラインに積む。期限が0の場合は削除する
+        ttl_seconds = self._get_ttl_seconds(task_name, state)
+        if ttl_seconds <= 0:
+            pipe.delete(key)
+            return
+        pipe.hset(key, mapping=mapping)
+        pipe.expire(key, ttl_seconds)
+
     def initialize_session(self, user_id: str, task_name: str, initial_data=None):
         key = self._generate_session_key(user_id, task_name)
         session_data = {
             "current_task": task_name,
             "state": TaskState.INITIAL.value,
-            # dataはjson文字列にして保存する
-            "data": json.dumps(initial_data or {}),
+            # dataはコーデックでバイト列にして保存する
+            "data": self.codec.encode(initial_data or {}),
         }
-        self.redis.hmset(key, session_data)
+        pipe = self.redis.pipeline()
+        self._queue_write(pipe, key, task_name, TaskState.INITIAL, session_data)
+        pipe.execute()
 
-    def get_session(self, user_id: str, task_name: str) -> dict:
+    def get_session(self, user_id: str, task_name: str) -> SessionRecord:
         key = self._generate_session_key(user_id, task_name)
+        return self._load_session(self.redis.hgetall(key))
 
-        # dataはjson文字列なので、loadする
-        session_data = self.redis.hgetall(key)
-        session_data["data"] = json.loads(session_data["data"])
+    def update_session(self, user_id: str, task_name: str, state: TaskState, data=None):
+        key = self._generate_session_key(user_id, task_name)
+        pipe = self.redis.pipeline()
+        self._queue_write(
+            pipe,
+            key,
+            task_name,
+            state,
+            self._generate_update_mapping(task_name, state, data),
+        )
+        pipe.execute()
 
-        return session_data
+    def update_and_get_session(
+        self, user_id: str, task_name: str, state: TaskState, data=None
+    ) -> SessionRecord:
+        """
+        update_sessionとget_sessionをパイプラインで1往復にまとめて行います。
+        戻り値は更新後のセッションです。
+        """
+        key = self._generate_session_key(user_id, task_name)
+        pipe = self.redis.pipeline()
+        self._queue_write(
+            pipe,
+            key,
+            task_name,
+            state,
+            self._generate_update_mapping(task_name, state, data),
+        )
+        pipe.hgetall(key)
+        session_data = pipe.execute()[-1]
+        return self._load_session(session_data)
 
-    def update_session(self, user_id: str, task_name: str, state: TaskState, data=None):
+    def get_and_update_session(
+        self, user_id: str, task_name: str, state: TaskState, data=None
+    ) -> SessionRecord:
+        """
+        get_sessionとupdate_sessionをパイプラインで1往復にまとめて行います。
+        戻り値は更新前のセッションです。タスク実行時に設定を取り出して状態を進めるときに使います。
+        """
         key = self._generate_session_key(user_id, task_name)
-        session_data = {"state": state.value, "data": json.dumps(data or {})}
-        self.redis.hmset(key, session_data)
+        pipe = self.redis.pipeline()
+        pipe.hgetall(key)
+        self._queue_write(
+            pipe,
+            key,
+            task_name,
+            state,
+            self._generate_update_mapping(task_name, state, data),
+        )
+        session_data = pipe.execute()[0]
+        return self._load_session(session_data)
+
+    def _sweep_session_key(self, key: bytes) -> TaskState | None:
+        """
+        1件のセッションに有効期限がなければ付けます（終了状態のものは削除）。
+        セッションではないキーか、削除したキーの場合はNoneを返します
+        """
+        # セッションはハッシュで保存しているので、それ以外の型のキーは読まない
+        if self.redis.type(key) != b"hash":
+            return None
+        state_value, current_task = self.redis.hmget(key, "state", "current_task")
+        try:
+            state = TaskState(state_value.decode())
+        except (AttributeError, ValueError):
+            # セッションではないキーか、途中で消えたキー
+            return None
+
+        if self.redis.ttl(key) == -1:
+            task_name = (current_task or key.split(b":")[-1]).decode()
+            ttl_seconds = self._get_ttl_seconds(task_name, state)
+            if ttl_seconds <= 0:
+                self.redis.delete(key)
+                return None
+            self.redis.expire(key, ttl_seconds)
+        return state
+
+    def acquire_sweep_lock(self, lock_seconds: int) -> bool:
+        """
+        セッションの整理を行う権利をlock_seconds秒間取得します。
+        uvicornの複数ワーカーがそれぞれスイーパーを起動しても、整理は1つのワーカーだけが行います。
+        ロックは解放せず期限切れで消すので、整理は間隔ごとに1回になります
+        """
+        return bool(
+            self.redis.set(
+                SWEEP_LOCK_KEY, os.getpid(), nx=True, ex=max(int(lock_seconds), 1)
+            )
+        )
+
+    def sweep_sessions(self) -> dict:
+        """
+        有効期限のないセッション（期限の仕組みを入れる前に作られたもの）を整理し、セッションの状況を集計します。
+        終了状態のものは削除し、それ以外は状態に合った有効期限を付けます。
+
+        return:
+            {"live_sessions": セッション数, "sessions_by_state": {状態: 件数},
+             "session_memory_bytes": セッションのメモリ使用量の合計, "used_memory_bytes": Redis全体のメモリ使用量}
+            メモリ使用量は取得できない場合Noneになります
+        """
+        live_sessions = 0
+        sessions_by_state: dict[str, int] = {}
+        # MEMORYコマンドが使えないRedisではNoneのままにする
+        session_memory_bytes: int | None = 0
+
+        for key in self.redis.scan_iter(match="*:*", count=100):
+            try:
+                state = self._sweep_session_key(key)
+                if state is None:
+                    continue
+
+                live_sessions += 1
+                sessions_by_state[state.value] = (
+                    sessions_by_state.get(state.value, 0) + 1
+                )
+                if session_memory_bytes is not None:
+                    try:
+                        session_memory_bytes += self.redis.memory_usage(key) or 0
+                    except redis.ResponseError:
+                        session_memory_bytes = None
+            except redis.RedisError as error:
+                # ハッシュではないキー（WRONGTYPE）などは、そのキーだけ飛ばして続ける
+                logger.warning(f"session sweep skipped key {key!r}: {error}")
+
+        try:
+            used_memory_bytes = self.redis.info("memory").get("used_memory")
+        except redis.ResponseError:
+            used_memory_bytes = None
+
+        return {
+            "live_sessions": live_sessions,
+            "sessions_by_state": sessions_by_state,
+            "session_memory_bytes": session_memory_bytes,
+            "used_memory_bytes": used_memory_bytes,
+        }
+
+
+# プロセス全体で共有するセッションマネージャー
+_session_manager: SessionManager | None = None
+_session_manager_lock = threading.Lock()
+
+
+def get_session_manager() -> SessionManager:
+    """プロセス内で共有するSessionManagerを返します。リクエストごとに作り直す必要はありません"""
+    global _session_manager
+    with _session_manager_lock:
+        if _session_manager is None:
+            _session_manager = SessionManager()
+        return _session_manager
+
+
+def _run_session_sweeper(interval_seconds: int, stop_event: threading.Event) -> None:
+    while not stop_event.wait(interval_seconds):
+        try:
+            session_manager = get_session_manager()
+            if not session_manager.acquire_sweep_lock(interval_seconds):
+                # 別のワーカーが今回の整理を行っている
+                continue
+            metrics = session_manager.sweep_sessions()
+            logger.info(f"session metrics: {metrics}")
+        except redis.RedisError as error:
+            logger.warning(f"session sweep failed: {error}")
+
+
+def start_session_sweeper(
+    interval_seconds: int = SWEEP_INTERVAL_SECONDS,
+    stop_event: threading.Event | None = None,
+) -> threading.Thread:
+    """
+    セッションの整理と集計を一定間隔で行うスレッドを起動します。デーモンスレッドなのでプロセス終了時に止まります。
+    stop_eventを渡した場合は、setすると次の待機で止まります。
+    ワーカーごとに起動しても、Redisのロック（SWEEP_LOCK_KEY）を取れたワーカーだけが整理します。
+    集計結果（セッション数とメモリ使用量）はloggingでINFOとして出力します。
+    """
+    sweeper = threading.Thread(
+        target=_run_session_sweeper,
+        args=(interval_seconds, stop_event or threading.Event()),
+        name="session-sweeper",
+        daemon=True,
+    )
+    sweeper.start()
+    return sweeper
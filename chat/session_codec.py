@@ -0,0 +1,103 @@
+import json
+import zlib
+
+import msgpack
+
+# 先頭1バイトのタグで形式を見分ける。タグがないもの（"{"で始まる）は以前のjson文字列として読む
+TAG_JSON = b"j"
+TAG_JSON_ZLIB = b"J"
+TAG_MSGPACK = b"m"
+TAG_MSGPACK_ZLIB = b"M"
+
+# このサイズ（バイト）を超えたらzlibで圧縮する
+DEFAULT_COMPRESS_THRESHOLD = 1024
+
+
+class SessionCodec:
+    """
+    セッションのdataをRedisに保存するバイト列へ変換するコーデックです。
+    compress_thresholdを超えるサイズのデータはzlibで圧縮します。Noneの場合は圧縮しません。
+    decodeはどのコーデックで保存されたデータでも読めるので、コーデックを切り替えても既存のセッションはそのまま使えます。
+    壊れたデータは、形式に関係なくValueErrorになります。
+
+    # codec = SessionCodec()
+    # payload = codec.encode({"key1": "value1"})
+    # codec.decode(payload)
+    """
+
+    tag = TAG_JSON
+    compressed_tag = TAG_JSON_ZLIB
+
+    def __init__(self, compress_threshold: int | None = DEFAULT_COMPRESS_THRESHOLD):
+        self.compress_threshold = compress_threshold
+
+    def _dumps(self, data) -> bytes:
+        return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode()
+
+    def encode(self, data) -> bytes:
+        payload = self._dumps(data)
+        if self.compress_threshold is not None and len(payload) > self.compress_threshold:
+            return self.compressed_tag + zlib.compress(payload)
+        return self.tag + payload
+
+    def decode(self, payload: bytes | str):
+        if isinstance(payload, str):
+            payload = payload.encode()
+
+        tag, body = payload[:1], payload[1:]
+        match tag:
+            case b"j":
+                return json.loads(body)
+            case b"J":
+                return json.loads(_decompress(body))
+            case b"m":
+                return _unpack_msgpack(body)
+            case b"M":
+                return _unpack_msgpack(_decompress(body))
+            case _:
+                # タグのないデータは以前のjson文字列
+                return json.loads(payload)
+
+
+class MsgpackSessionCodec(SessionCodec):
+    """msgpackで保存するコーデックです"""
+
+    tag = TAG_MSGPACK
+    compressed_tag = TAG_MSGPACK_ZLIB
+
+    def _dumps(self, data) -> bytes:
+        return msgpack.packb(data, use_bin_type=True)
+
+
+def _decompress(body: bytes) -> bytes:
+    # json・msgpackの壊れたデータと同じように、ValueErrorにする
+    try:
+        return zlib.decompress(body)
+    except zlib.error as error:
+        raise ValueError(f"invalid compressed session data: {error}") from error
+
+
+def _unpack_msgpack(body: bytes):
+    return msgpack.unpackb(body, raw=False)
+
+
+def get_session_codec(
+    codec_name: str = "auto",
+    compress_threshold: int | None = DEFAULT_COMPRESS_THRESHOLD,
+) -> SessionCodec:
+    """
+    コーデック名からコーデックを返します
+
+    args:
+        codec_name: "json", "msgpack", "auto"のいずれか。autoはmsgpackになる
+        compress_threshold: 圧縮するサイズ（バイト）。Noneの場合は圧縮しない
+    return:
+        SessionCodec
+    """
+    match codec_name:
+        case "json":
+            return SessionCodec(compress_threshold)
+        case "msgpack" | "auto":
+            return MsgpackSessionCodec(compress_threshold)
+        case _:
+            raise ValueError(f"unknown session codec: {codec_name}")
@@ -1,37 +1,17 @@
-import json
 import logging
-import os
 from pprint import pprint
-from dataclasses import dataclass
 
-import redis
 from flask import Flask, request
 from flask import json as f_json
-from rq import Queue
 
 import chat.card
 import chat.session
-from helper import chatcard, convert_dataclass_to_jsonhash_str
-from task import (
-    bot_calc_add,
-    generate_invoice,
-    generate_quotes,
-    run_mail_action,
-)
+from chat.handlers import TASK_REGISTRY, bot_header
+from chat.registry import ChatRequest
 
 # Flaskアプリケーションの初期化
 app = Flask(__name__)
 
-# RQのキューを初期化
-queue = Queue(connection=redis.from_url(os.environ.get("RQ_REDIS_URL")))
-
-# チャットボットの設定
-bot_header = chatcard.bot_header
-
-# アクションレスポンスの定義
-# https://developers.google.com/hangouts/chat/reference/message-formats/cards#action_response
-ACTION_RESPONSE_OK_JSON = chat.card.genactionresponse_dialog()
-
 
 # TODO:2023-10-19 cardIdとinvokedFunctionの名前についてメモを残す。
 # いずれは
@@ -42,7 +22,7 @@ ACTION_RESPONSE_OK_JSON = chat.card.genactionresponse_dialog()
 # * run_prepare: PrepareTaskを実行する
 # * comfirm: 確認用カードを出す
 # * run_task: MainTaskを実行する
-# * cancell: キャンセル処理を行う
+# * cancel_task: キャンセル処理を行う
 
 # ##カード名
 # * config_card: タスク実行のための設定を行うカード
@@ -50,178 +30,8 @@ ACTION_RESPONSE_OK_JSON = chat.card.genactionresponse_dialog()
 # * result_card: タスク実行の結果で伝えるときに使う
 # * nortify_task_card: 実行中などに起こる色々な状態を伝えるときに使う
 
-
-# [generate_quotes]: 設定カード→メインタスク実行
-def run_preparetask_generate_quotes() -> dict:
-    # prepareタスク実行後に設定カードを開く
-    script_task = generate_quotes.PrepareTask()
-    job = queue.enqueue(script_task.execute_task_by_chat)
-
-    print(f"job.id:{job.id}")
-    return ACTION_RESPONSE_OK_JSON
-
-
-def run_task_generate_quotes(session_data: dict) -> dict:
-    task_data = {
-        "task_data": {
-            # selected_estimate_calcsheetsリスト中身はjson文字列なのでloadする
-            "selected_estimate_calcsheets": [
-                json.loads(estimate_calcsheet)
-                for estimate_calcsheet in session_data.get(
-                    "selected_estimate_calcsheets"
-                )
-            ]
-        }
-    }
-    script_task = generate_quotes.MainTask()
-    job = queue.enqueue(script_task.execute_task_by_chat, args=(task_data,))
-
-    print(f"job.id:{job.id}")
-    return ACTION_RESPONSE_OK_JSON
-
-
-# [generate_invoice]: 設定カード→内容確認→メインタスク実行
-def run_preparetask_generate_invoice() -> dict:
-    # prepareタスク実行後に設定カードを開く
-    prepare_task = generate_invoice.PrepareTask()
-    job = queue.enqueue(prepare_task.execute_task_by_chat)
-
-    print(f"job.id:{job.id}")
-    return ACTION_RESPONSE_OK_JSON
-
-
-def confirm_generate_invoice(session_data: dict) -> dict:
-    # 請求書の計算を行う: セッションデータにはjson文字列が入っているので、dataclassへ変換する
-    ask_choiced_quote_list = [
-        convert_dataclass_to_jsonhash_str(
-            choiced_quote_jsonstr, generate_invoice.QuoteData
-        )
-        for choiced_quote_jsonstr in session_data.get("choiced_quote_list")
-    ]
-
-    # 見積書の情報を元に、金額の合計を出す
-    invoice_data = generate_invoice.generate_invoice_data(ask_choiced_quote_list)
-
-    # ここで請求書情報を出して、こちらの検証と正しいか確認
-    calc_result = f"""
-    [請求情報]
-    件数: {len(ask_choiced_quote_list)}
-    合計金額:{invoice_data.price}
-    """
-
-    cardbody = chat.card.create_card(
-        "confirm__generate_invoice",
-        header=bot_header,
-        widgets=[
-            chat.card.genwidget_textparagraph(
-                "請求書作成を実行しますか？",
-            ),
-            chat.card.genwidget_textparagraph(calc_result),
-            chat.card.genwidget_buttonlist(
-                [
-                    chat.card.gencomponent_button("実行", "run_task__generate_invoice"),
-                    chat.card.gencomponent_button("キャンセル", "cancell_task"),
-                ]
-            ),
-        ],
-    )
-
-    return cardbody
-
-
-def runtask_generate_invoice(session_data: dict) -> dict:
-    # メインタスク向けに、セッションデータを整形する
-    task_data = {
-        "task_data": {
-            # ask_dataの中身はjson文字列のリストなので、dataclassに変換する
-            "choiced_quote_list": [
-                convert_dataclass_to_jsonhash_str(
-                    choiced_quote_jsonstr, generate_invoice.QuoteData
-                )
-                for choiced_quote_jsonstr in session_data.get("choiced_quote_list")
-            ]
-        }
-    }
-    script_task = generate_invoice.MainTask()
-    job = queue.enqueue(script_task.execute_task_by_chat, args=(task_data,))
-
-    print(f"job.id:{job.id}")
-    return ACTION_RESPONSE_OK_JSON
-
-
-# [run_mail_action]: 設定カード→メインタスク実行
-def run_preparetask_run_mail_action() -> dict:
-    # prepareタスク実行後に、設定カードを開く。設定カードはREST API経由で開く
-    script_task = run_mail_action.PrepareTask()
-    job = queue.enqueue(script_task.execute_task_by_chat)
-
-    print(f"job.id:{job.id}")
-    return ACTION_RESPONSE_OK_JSON
-
-
-def runtask_run_mail_action(session_data: dict) -> dict:
-    task_data = {
-        "task_data": {
-            "selected_message_id": session_data.get("selected_message_id"),
-            "ask_generate_projectfile": session_data.get("ask_generate_projectfile"),
-            "ask_add_schedule_and_generate_estimate_calcsheet": session_data.get(
-                "ask_add_schedule_and_generate_estimate_calcsheet"
-            ),
-            "ask_add_schedule_nextmonth": session_data.get(
-                "ask_add_schedule_nextmonth"
-            ),
-        }
-    }
-    script_task = run_mail_action.MainTask()
-    job = queue.enqueue(script_task.execute_task_by_chat, args=(task_data,))
-
-    print(f"job.id:{job.id}")
-    return ACTION_RESPONSE_OK_JSON
-
-
-# [calc_add]: 設定カード→内容確認カード→メインタスク実行
-def open_cofig_card_calc_add() -> dict:
-    first_num = chat.card.genwidget_textinput_singleline("first_num", "first_num")
-    second_num = chat.card.genwidget_textinput_singleline("second_num", "second_num")
-    buttonlist = chat.card.genwidget_buttonlist(
-        [chat.card.gencomponent_button("確認", "confirm__calc_add")]
-    )
-    config_body = chat.card.create_card(
-        "config_card__calc_add", bot_header, [first_num, second_num, buttonlist]
-    )
-    return config_body
-
-
-def confirm_calc_add(session_data) -> dict:
-    first_num = int(session_data["first_num"])
-    second_num = int(session_data["second_num"])
-
-    cardbody = chat.card.create_card(
-        "confirm_card__run_calc",
-        header=bot_header,
-        widgets=[
-            chat.card.genwidget_textparagraph(
-                f"計算を実行しますか？: {first_num} + {second_num} ",
-            ),
-            chat.card.genwidget_buttonlist(
-                [
-                    chat.card.gencomponent_button("実行", "run_task__calc_add"),
-                    chat.card.gencomponent_button("キャンセル", "cancell_task"),
-                ]
-            ),
-        ],
-    )
-    return cardbody
-
-
-def runtask_calc_add(session_data):
-    job = queue.enqueue(
-        bot_calc_add.bot_calc_add,
-        args=(int(session_data["first_num"]), int(session_data["second_num"])),
-    )
-
-    print(f"job.id:{job.id}")
-    return ACTION_RESPONSE_OK_JSON
+# 各タスクの処理はchat.handlersのモジュールにあり、TASK_REGISTRYから引き当てる
+# confirm__[タスク名], run_task__[タスク名], cancel_task__[タスク名]とスラッシュコマンドが対象
 
 
 # メインタスク実行
@@ -250,163 +60,39 @@ def response_generator(event):
     print(f"slachCommand: {slash_command}")
     print(f"invoked_function:{invoked_function}")
 
-    # セッションマネージャーを用意して、セッション管理に必要な情報を取得する
-    session_manager = chat.session.SessionManager()
-    user_id = event["user"]["name"]
+    # セッションマネージャーはプロセス全体で共有しているので、リクエストごとに接続しない
+    chat_request = ChatRequest(
+        event=event,
+        user_id=event["user"]["name"],
+        form_inputs=event_common.get("formInputs", dict()),
+    )
 
     # TODO: 2023-10-13 カードメニューから各種タスク実行をする機能も入れる
 
     # CARD_CLICKEDイベントの処理
     if event_type == "CARD_CLICKED":
-        event_forminputs = event_common.get("formInputs", dict())
-        match invoked_function:
-            # [各種機能のグループ分け]
-            # generate_quote
-            case "run_task__generate_quotes":
-                print("run_task__generate_quotes")
-
-                # 設定カードの結果はjson文字列をそのまま入れる。タスク側で変換する
-                session_data = {
-                    "selected_estimate_calcsheets": event_forminputs[
-                        "estimate_list_checkbox"
-                    ]["stringInputs"]["value"]
-                }
-
-                # タスクを実行する-> アクションレスポンスを返す
-                return run_task_generate_quotes(session_data)
-
-            # generate_invoice
-            case "confirm__generate_invoice":
-                print("confirm__generate_invoice")
-
-                choiced_quote_list = event_forminputs["quoteitems"]["stringInputs"][
-                    "value"
-                ]
-
-                session_manager.update_session(
-                    user_id,
-                    "generate_invoice",
-                    chat.session.TaskState.RUNNING,
-                    data={"choiced_quote_list": choiced_quote_list},
-                )
-                # 確認用のカードを表示する
-                return confirm_generate_invoice(
-                    session_manager.get_session(user_id, "generate_invoice")["data"]
-                )
-
-            case "run_task__generate_invoice":
-                print("run_task__generate_invoice")
-                now_session = session_manager.get_session(user_id, "generate_invoice")
-                session_data = now_session.get("data", "{}")
-                session_manager.update_session(
-                    user_id, "generate_invoice", chat.session.TaskState.COMPLETED
-                )
-
-                # タスクを実行する-> アクションレスポンスを返す
-                return runtask_generate_invoice(session_data)
-
-            # run_mail_action
-            case "run_task__run_mail_action":
-                print("run_task__run_mail_action")
-
-                session_data = {
-                    "selected_message_id": event_forminputs["selected_message_id"][
-                        "stringInputs"
-                    ]["value"][0],
-                    "ask_generate_projectfile": "ask_generate_projectfile"
-                    in event_forminputs["run_mail_action_settings"]["stringInputs"][
-                        "value"
-                    ],
-                    "ask_add_schedule_and_generate_estimate_calcsheet": "ask_add_schedule_and_generate_estimate_calcsheet"
-                    in event_forminputs["run_mail_action_settings"]["stringInputs"][
-                        "value"
-                    ],
-                    "ask_add_schedule_nextmonth": "ask_add_schedule_nextmonth"
-                    in event_forminputs["run_mail_action_settings"]["stringInputs"][
-                        "value"
-                    ],
-                }
-
-                # タスクを実行する-> アクションレスポンスを返す
-                return runtask_run_mail_action(session_data)
-
-            # calc_add:動作確認用
-            case "confirm__calc_add":
-                print("confirm_calc_add")
-                session_manager.update_session(
-                    user_id,
-                    "run_calc_add",
-                    chat.session.TaskState.RUNNING,
-                    data={
-                        "first_num": int(
-                            event_forminputs["first_num"]["stringInputs"]["value"][0]
-                        ),
-                        "second_num": int(
-                            event_forminputs["second_num"]["stringInputs"]["value"][0]
-                        ),
-                    },
-                )
-                confirm_card = confirm_calc_add(
-                    session_manager.get_session(user_id, "run_calc_add").get(
-                        "data", "{}"
-                    )
-                )
-
-                return confirm_card
-
-            case "run_task__calc_add":
-                print("runtask__calc_add")
-                now_session = session_manager.get_session(user_id, "run_calc_add")
-                session_data = now_session.get("data", "{}")
-                session_manager.update_session(
-                    user_id, "run_calc_add", chat.session.TaskState.COMPLETED
-                )
-
-                # タスクを実行する-> アクションレスポンスを返す
-                return runtask_calc_add(session_data)
-
-            # 各タスクキャンセル処理
-            # TODO: 2023-10-13 このキャンセル処理は各タスクに紐づいてない。
-            # セッションも除去できないので、実質動かない。タスクアプリごとにキャンセル処理を実装するか、名前をもとに解決できる手段を考える
-            # チャットのレスポンスの内部にある何らかの名前が使えないかな？
-            case "cancell_task":
-                print("cancell")
-                # セッションを終了したとする
-                session_manager.update_session(
-                    user_id, "run_calc_add", chat.session.TaskState.CANCELLED
-                )
-                return chat.card.create_card_text(
-                    "cancell_task", bot_header, "キャンセルしました"
-                )
-
-            # カードクリック時に判別できなかったがあればこちらが呼ばれる
-            case _:
-                print("default")
-                return chat.card.create_card_text(
-                    "default", bot_header, "判断できなかった処理がありました。"
-                )
+        # [各種機能のグループ分け]は、invokedFunctionの名前からTASK_REGISTRYで引き当てる
+        if handler := TASK_REGISTRY.resolve_invoked_function(invoked_function):
+            return handler(chat_request)
+
+        # タスク名の付いていないキャンセル（以前のカード）は、calc_addのキャンセルとして扱う
+        if invoked_function in ("cancell_task", "cancel_task"):
+            print("cancell")
+            handler = TASK_REGISTRY.resolve_invoked_function("cancel_task__calc_add")
+            return handler(chat_request)
+
+        # カードクリック時に判別できなかったがあればこちらが呼ばれる
+        print("default")
+        return chat.card.create_card_text(
+            "default", bot_header, "判断できなかった処理がありました。"
+        )
 
     # 2. スラッシュコマンドの処理
     if slash_command := event["message"].get("slashCommand"):
         command_id = slash_command.get("commandId", 0)
         # TODO:2023-10-10 スラッシュコマンドでそれぞれの機能を呼び出すカードを出す機能も実装する
-        match command_id:
-            case "1":
-                print("slash command 1: run_calc")
-                # セッション初期化
-                session_manager.initialize_session(
-                    user_id, "run_calc", initial_data=None
-                )
-                return open_cofig_card_calc_add()
-            case "102":
-                print("slash command 102: generate_quotes")
-                return run_preparetask_generate_quotes()
-            case "103":
-                print("slash command 103: generate_invoice")
-                return run_preparetask_generate_invoice()
-            case "104":
-                print("slash command 104: run_mail_action")
-                return run_preparetask_run_mail_action()
+        if handler := TASK_REGISTRY.resolve_slash_command(command_id):
+            return handler(chat_request)
 
     # 3. チャットボットのオンボーディング処理
     # 4. 通常のメッセージに対してのレスポンス
@@ -471,6 +157,7 @@ def home_post():
 # [END basic-bot]
 
 if __name__ == "__main__":
+    chat.session.start_session_sweeper()
     # This is used when running locally. Gunicorn is used to run the
     # application on Google App Engine. See entrypoint in app.yaml.
     app.run(host="0.0.0.0", port=8080, debug=True)
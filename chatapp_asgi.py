@@ -0,0 +1,48 @@
+"""
+Google Chatのwebhookを受けるASGIアプリです。uvicornで複数ワーカーを起動して使います。
+
+    uvicorn chatapp_asgi:app --host 0.0.0.0 --port 8080 --workers 4
+
+chatapp.pyのFlaskアプリを、a2wsgiでそのままASGIに変換しています。ルーティングとJSONの扱いはFlaskのものです。
+ハンドラーは同期処理のままで、ノンブロッキングにはなっていません。セッションの読み書きやRQへのenqueueは、
+ワーカーごとのスレッドプール（HANDLER_THREADS）のスレッドを待たせます。イベントループは止まらないので、
+同時に処理できるリクエストの数はスレッド数までで、それを超えた分はスレッドが空くまで待ちます。
+
+セッションの整理は、importしたときではなく、ASGIのlifespanのstartupで始めて、shutdownで止めます。
+"""
+
+import os
+import threading
+
+from a2wsgi import WSGIMiddleware
+
+import chat.session
+import chatapp
+
+# リクエストを処理するスレッド数（ワーカーごと）。Redisのコネクションプールはスレッド間で共有する
+HANDLER_THREADS = int(os.environ.get("CHATAPP_HANDLER_THREADS", 16))
+
+wsgi_app = WSGIMiddleware(chatapp.app, workers=HANDLER_THREADS)
+
+
+async def app(scope, receive, send) -> None:
+    """
+    lifespanだけをここで処理し、それ以外（http）はFlaskアプリへ渡します
+    """
+    if scope["type"] != "lifespan":
+        await wsgi_app(scope, receive, send)
+        return
+
+    sweeper_stop_event = threading.Event()
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            # ワーカーごとにセッションマネージャーを用意して、セッションの整理を始める
+            # 整理はRedisのロックを取れたワーカーだけが行うので、ワーカーの数だけ重複して動くことはない
+            chat.session.get_session_manager()
+            chat.session.start_session_sweeper(stop_event=sweeper_stop_event)
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            sweeper_stop_event.set()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
@@ -1,6 +1,9 @@
 import base64
+import itertools
 import json
+import re
 from pathlib import Path
+from typing import BinaryIO, Iterable, Iterator
 
 # dirpath
 ROOTDIR = Path(__file__).parents[1]
@@ -22,6 +25,77 @@ def decode_base64url(base64_s) -> bytes:
     return base64.urlsafe_b64decode(base64_s) + b"=" * (4 - (len(base64_s) % 4))
 
 
+def iter_json_string_field(chunks: Iterable[bytes], field_name: str) -> Iterator[bytes]:
+    """
+    jsonのバイト列をチャンクごとに読み、指定したフィールドの文字列の値をチャンクのまま返す
+    jsonを全て読み込まずに、大きな値（Gmail APIの添付ファイルのdata等）を取り出すために使う。
+    値はエスケープを含まない文字列（base64url等）を想定している
+
+    Args:
+        chunks (Iterable[bytes]): jsonのバイト列のチャンク
+        field_name (str): 取り出すフィールド名
+
+    Returns:
+        Iterator[bytes]: 値のチャンク（"は含まない）
+    """
+    chunks = iter(chunks)
+    marker = f'"{field_name}"'.encode()
+    buffer = b""
+    for chunk in chunks:
+        buffer += chunk
+        start = buffer.find(marker)
+        if start == -1:
+            # フィールド名がチャンクの境目で分かれている場合のために、末尾だけ残す
+            buffer = buffer[-len(marker) :]
+            continue
+        value_start = re.match(rb'\s*:\s*"', buffer[start + len(marker) :])
+        if value_start:
+            buffer = buffer[start + len(marker) + value_start.end() :]
+            break
+    else:
+        raise ValueError(f"field not found: {field_name}")
+
+    # ここから値の終わりの"までを返す
+    for chunk in itertools.chain([buffer], chunks):
+        if (value_end := chunk.find(b'"')) != -1:
+            if value_end:
+                yield chunk[:value_end]
+            return
+        if chunk:
+            yield chunk
+    raise ValueError(f"unterminated field value: {field_name}")
+
+
+def decode_base64url_to_file(chunks: Iterable[bytes], output: BinaryIO) -> int:
+    """
+    urlセーフなbase64文字列をチャンクごとにデコードして、ファイルへ書き込む
+    4文字単位でデコードし、端数は次のチャンクに回すので、全体をメモリに載せずにデコードできる
+
+    Args:
+        chunks (Iterable[bytes]): base64文字列のチャンク
+        output (BinaryIO): 書き込み先のファイル
+
+    Returns:
+        int: 書き込んだバイト数
+    """
+    written_size = 0
+    remainder = b""
+    for chunk in chunks:
+        data = remainder + chunk
+        decodable_size = len(data) - len(data) % 4
+        remainder = data[decodable_size:]
+        if decodable_size:
+            written_size += output.write(
+                base64.urlsafe_b64decode(data[:decodable_size])
+            )
+    if remainder:
+        # パディングが省略されている場合は補う
+        written_size += output.write(
+            base64.urlsafe_b64decode(remainder + b"=" * (-len(remainder) % 4))
+        )
+    return written_size
+
+
 def convert_dataclass_to_jsonhash_str(jsonhash_str: str, dataclass_):
     """
     設定カードから返されたjsonハッシュ文字列を、dataclassの形式に変換する
@@ -58,6 +132,23 @@ def convert_dataclass_to_jsonhash_str(jsonhash_str: str, dataclass_):
     if not isinstance(converted_jsonobject, dict):
         raise ValueError("dialog_str is not json object string")
 
+    return convert_dict_to_dataclass(converted_jsonobject, dataclass_)
+
+
+def convert_dict_to_dataclass(dict_: dict, dataclass_):
+    """
+    dictを、dataclassの形式に変換する
+
+    dictにないフィールドはNoneになる。dataclassはinit=Falseのフィールドは除外すること
+
+    Args:
+        dict_ (dict): 変換元のdict
+        dataclass_ ([type]): 変換先のdataclass
+
+    Returns:
+        dataclass_: 変換後のdataclass
+    """
+
     # dataclassのフィールド名を取得する。init=Trueのフィールドのみを取得する
     dataclass_field_names = (
         dataclass_fieldname
@@ -67,7 +158,7 @@ def convert_dataclass_to_jsonhash_str(jsonhash_str: str, dataclass_):
 
     return dataclass_(
         **{
-            dataclass_field_name: converted_jsonobject.get(dataclass_field_name)
+            dataclass_field_name: dict_.get(dataclass_field_name)
             for dataclass_field_name in dataclass_field_names
         }
     )
@@ -0,0 +1,112 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+from helper import EXPORTDIR_PATH
+
+# 添付ファイルキャッシュの保存先
+ATTACHMENT_CACHE_DIRPATH = EXPORTDIR_PATH / "attachment_cache"
+
+# キャッシュ全体の上限サイズ（バイト）。超えた分は最後に使った日時が古いものから削除する
+ATTACHMENT_CACHE_MAX_BYTES = 500 * 1024 * 1024
+
+
+def link_or_copy(src_path: Path, dest_path: Path) -> None:
+    """
+    ハードリンクでファイルを配置する。別のファイルシステム等でリンクできない場合はコピーする
+    """
+    dest_path.unlink(missing_ok=True)
+    try:
+        os.link(src_path, dest_path)
+    except OSError:
+        shutil.copy2(src_path, dest_path)
+
+
+class AttachmentCache:
+    """
+    メールの添付ファイルをローカルに保存しておくキャッシュです。
+    メッセージIDと、メッセージ内の添付ファイルを表すキー（パートIDとファイル名）から作ったハッシュをファイル名にします。
+    Gmail APIのattachmentIdは取得のたびに変わるので、キーには使いません。
+
+    キャッシュからの取り出しはハードリンク（できない場合はコピー）で行います。
+    取り出したファイルは書き換えないでください。
+    合計サイズがmax_size_bytesを超えたら、最後に使った日時（mtime）が古いものから削除します。
+
+    # cache = AttachmentCache()
+    # if not cache.restore(message_id, "1:sample.zip", save_path):
+    #     ...ダウンロードしてsave_pathに保存...
+    #     cache.store(message_id, "1:sample.zip", save_path)
+    """
+
+    def __init__(
+        self,
+        cache_dirpath: Path = ATTACHMENT_CACHE_DIRPATH,
+        max_size_bytes: int = ATTACHMENT_CACHE_MAX_BYTES,
+    ):
+        self.cache_dirpath = cache_dirpath
+        self.max_size_bytes = max_size_bytes
+        self.cache_dirpath.mkdir(parents=True, exist_ok=True)
+
+    def _get_cache_path(self, message_id: str, part_key: str) -> Path:
+        cache_key = hashlib.sha256(f"{message_id}/{part_key}".encode()).hexdigest()
+        return self.cache_dirpath / cache_key
+
+    def restore(self, message_id: str, part_key: str, save_path: Path) -> bool:
+        """
+        キャッシュにあればsave_pathへ配置します
+
+        args:
+            message_id: メッセージID
+            part_key: メッセージ内の添付ファイルを表すキー 例: "1:sample.zip"
+            save_path: 保存先ファイルパス
+        return:
+            キャッシュから配置できた場合はTrue
+        """
+        cache_path = self._get_cache_path(message_id, part_key)
+        try:
+            # 最後に使った日時として、mtimeを更新する
+            os.utime(cache_path)
+            link_or_copy(cache_path, save_path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def store(self, message_id: str, part_key: str, filepath: Path) -> None:
+        """
+        保存したファイルをキャッシュに追加します。上限サイズを超える場合は古いものを削除します
+
+        args:
+            message_id: メッセージID
+            part_key: メッセージ内の添付ファイルを表すキー 例: "1:sample.zip"
+            filepath: キャッシュに追加するファイルのパス
+        """
+        # 1ファイルで上限を超えるものはキャッシュしない
+        if filepath.stat().st_size > self.max_size_bytes:
+            return
+
+        # 並列に追加されても途中のファイルが見えないように、一時ファイルを作ってから置き換える
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dirpath, suffix=".tmp")
+        os.close(fd)
+        link_or_copy(filepath, Path(tmp_path))
+        os.replace(tmp_path, self._get_cache_path(message_id, part_key))
+        self.evict()
+
+    def evict(self) -> None:
+        """合計サイズがmax_size_bytesに収まるまで、最後に使った日時が古いものから削除します"""
+        cache_files = []
+        for cache_path in self.cache_dirpath.iterdir():
+            if cache_path.suffix == ".tmp":
+                continue
+            try:
+                cache_files.append((cache_path, cache_path.stat()))
+            except FileNotFoundError:
+                continue
+
+        total_size = sum(stat.st_size for _, stat in cache_files)
+        for cache_path, stat in sorted(cache_files, key=lambda x: x[1].st_mtime):
+            if total_size <= self.max_size_bytes:
+                break
+            cache_path.unlink(missing_ok=True)
+            total_size -= stat.st_size
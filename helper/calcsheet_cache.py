@@ -0,0 +1,76 @@
+import json
+import sqlite3
+from contextlib import closing
+from pathlib import Path
+
+from helper import EXPORTDIR_PATH
+
+# 見積もり計算表キャッシュの保存先
+CALCSHEET_CACHE_DBPATH = EXPORTDIR_PATH / "calcsheet_cache.sqlite3"
+
+CALCSHEET_CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS calcsheets (
+    spreadsheet_id TEXT PRIMARY KEY,
+    modified_time TEXT NOT NULL,
+    calcsheet_data TEXT NOT NULL
+);
+"""
+
+
+class CalcSheetCache:
+    """
+    見積もり計算表から取得したシート情報を、ローカルのSQLiteに記録するキャッシュです。
+    キーはスプレッドシートIDで、Google DriveのmodifiedTimeも一緒に記録します。
+    modifiedTimeが一致するときだけキャッシュを返すので、シートが更新されると自動で取得し直しになります。
+    ファイルに記録するので、CLI・チャットのタスク・リトライの間で共有されます。
+
+    # calcsheet_cache = CalcSheetCache()
+    # calcsheet_cache.find_calcsheet_data({spreadsheet_id: modified_time})
+    # calcsheet_cache.upsert_calcsheet_data([(spreadsheet_id, modified_time, calcsheet_data)])
+    """
+
+    def __init__(self, db_path: Path = CALCSHEET_CACHE_DBPATH):
+        self.db_path = db_path
+        with closing(self._connect()) as conn, conn:
+            conn.executescript(CALCSHEET_CACHE_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path)
+
+    def find_calcsheet_data(self, modified_times: dict[str, str]) -> dict[str, dict]:
+        """
+        modifiedTimeが一致するシート情報を返す
+
+        args:
+            modified_times: {スプレッドシートID: modifiedTime}
+        return:
+            {スプレッドシートID: シート情報}。キャッシュがないもの、更新されたものは含まない
+        """
+        if not modified_times:
+            return {}
+
+        spreadsheet_ids = list(modified_times)
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                f"SELECT * FROM calcsheets WHERE spreadsheet_id IN ({','.join('?' * len(spreadsheet_ids))})",
+                spreadsheet_ids,
+            ).fetchall()
+        return {
+            spreadsheet_id: json.loads(calcsheet_data)
+            for spreadsheet_id, modified_time, calcsheet_data in rows
+            if modified_times[spreadsheet_id] == modified_time
+        }
+
+    def upsert_calcsheet_data(self, items: list[tuple[str, str, dict]]) -> None:
+        """
+        シート情報を追加する。同じスプレッドシートIDがあれば上書きする（古いmodifiedTimeのものは残さない）
+
+        args:
+            items: (スプレッドシートID, modifiedTime, シート情報)のリスト
+        """
+        rows = [
+            (spreadsheet_id, modified_time, json.dumps(calcsheet_data))
+            for spreadsheet_id, modified_time, calcsheet_data in items
+        ]
+        with closing(self._connect()) as conn, conn:
+            conn.executemany("INSERT OR REPLACE INTO calcsheets VALUES (?, ?, ?)", rows)
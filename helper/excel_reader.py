@@ -0,0 +1,63 @@
+import hashlib
+import threading
+from pathlib import Path
+
+import openpyxl
+from openpyxl.utils.cell import coordinate_from_string, column_index_from_string
+
+# (ファイルのハッシュ, セル番地) -> セルの値。同じ内容のブックは1回の実行で1回だけ読む
+_cell_values_cache: dict[tuple[str, tuple[str, ...]], dict] = {}
+_cell_values_cache_lock = threading.Lock()
+
+
+def get_file_hash(filepath: Path) -> str:
+    return hashlib.sha256(filepath.read_bytes()).hexdigest()
+
+
+def read_excel_cells(filepath: Path, cell_addrs: tuple[str, ...]) -> dict:
+    """
+    Excelファイルのアクティブなシートから、指定したセルの値だけを読み込む
+    ブックは読み取り専用モードで開き、必要な範囲の行だけを値で読むので、スタイルや他のシートは読み込まない。
+    読み込んだ値はファイルの内容のハッシュで覚えておき、同じ内容のブックは読み直さない
+
+    Args:
+        filepath (Path): Excelファイルのパス
+        cell_addrs (tuple[str, ...]): 読み込むセル番地 例: ("B9", "D6")
+
+    Returns:
+        dict: {セル番地: 値}。数式のセルは数式の文字列になる（load_workbookの既定と同じ）
+    """
+    cache_key = (get_file_hash(filepath), tuple(cell_addrs))
+    with _cell_values_cache_lock:
+        if cache_key in _cell_values_cache:
+            return dict(_cell_values_cache[cache_key])
+
+    # セル番地を(行, 列)にして、読み込む範囲を決める
+    cell_positions = {}
+    for cell_addr in cell_addrs:
+        column_letter, row = coordinate_from_string(cell_addr)
+        cell_positions[cell_addr] = (row, column_index_from_string(column_letter))
+    max_row = max(row for row, _ in cell_positions.values())
+    max_column = max(column for _, column in cell_positions.values())
+
+    workbook = openpyxl.load_workbook(filepath, read_only=True)
+    try:
+        rows = list(
+            workbook.active.iter_rows(
+                min_row=1, max_row=max_row, max_col=max_column, values_only=True
+            )
+        )
+    finally:
+        workbook.close()
+
+    cell_values = {}
+    for cell_addr, (row, column) in cell_positions.items():
+        # 読み取り専用モードでは、値のない行や列は短くなる
+        row_values = rows[row - 1] if row <= len(rows) else ()
+        cell_values[cell_addr] = (
+            row_values[column - 1] if column <= len(row_values) else None
+        )
+
+    with _cell_values_cache_lock:
+        _cell_values_cache[cache_key] = cell_values
+    return dict(cell_values)
@@ -0,0 +1,145 @@
+import sqlite3
+from contextlib import closing
+from dataclasses import dataclass
+from datetime import date
+from pathlib import Path
+
+from helper import EXPORTDIR_PATH
+
+# 見積書インデックスの保存先
+QUOTE_INDEX_DBPATH = EXPORTDIR_PATH / "quote_index.sqlite3"
+
+# 見積書管理表のどの行まで読み込んだかを記録するキー
+LAST_SYNCED_ROW_KEY = "quote_list_last_synced_row"
+
+# 番号だけ確保して見積書を作成できなかった見積書管理表の行に、B列（ファイル名）へ記録する接頭辞
+# 例: "作成失敗:MA-0000-1"。この行はC列（URL）が空のままになる
+VOID_QUOTE_FILENAME_PREFIX = "作成失敗:"
+
+QUOTE_INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS quotes (
+    spreadsheet_id TEXT PRIMARY KEY,
+    row_number INTEGER,
+    quote_id TEXT,
+    quote_date TEXT NOT NULL,
+    hinmoku_name TEXT,
+    hinmoku_detail TEXT,
+    hinmoku_price TEXT
+);
+CREATE INDEX IF NOT EXISTS quotes_quote_date ON quotes (quote_date);
+CREATE TABLE IF NOT EXISTS sync_state (
+    name TEXT PRIMARY KEY,
+    value INTEGER
+);
+"""
+
+
+@dataclass
+class QuoteIndexItem:
+    """
+    インデックスに記録する見積書1件分の情報
+
+    args:
+        spreadsheet_id: 見積書のスプレッドシートID
+        row_number: 見積書管理表の行番号。不明な場合はNone
+        quote_id: 見積書番号 例: DCCF6E-Q-0001
+        quote_date: 見積日
+        hinmoku_name: 品目名（最初の1行）
+        hinmoku_detail: 品目の詳細（納期が入る）
+        hinmoku_price: 品目の金額。シートの値をそのまま文字列で持つ
+    """
+
+    spreadsheet_id: str
+    row_number: int | None
+    quote_id: str
+    quote_date: date
+    hinmoku_name: str
+    hinmoku_detail: str
+    hinmoku_price: str
+
+
+class QuoteIndex:
+    """
+    発行済み見積書の情報をローカルのSQLiteに記録するインデックスです。
+    見積書は発行後に変わらないので、一度読み込んだものは再取得しません。
+    キーはスプレッドシートIDで、見積日にはインデックスを張っています。
+
+    # quote_index = QuoteIndex()
+    # quote_index.upsert_quotes([QuoteIndexItem(...)])
+    # quote_index.find_quotes_by_date(date(2024, 1, 1))
+    """
+
+    def __init__(self, db_path: Path = QUOTE_INDEX_DBPATH):
+        self.db_path = db_path
+        with closing(self._connect()) as conn, conn:
+            conn.executescript(QUOTE_INDEX_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path)
+
+    def upsert_quotes(self, quote_items: list[QuoteIndexItem]) -> None:
+        """見積書の情報を追加する。同じスプレッドシートIDがあれば上書きする"""
+        rows = [
+            (
+                quote_item.spreadsheet_id,
+                quote_item.row_number,
+                quote_item.quote_id,
+                quote_item.quote_date.isoformat(),
+                quote_item.hinmoku_name,
+                quote_item.hinmoku_detail,
+                quote_item.hinmoku_price,
+            )
+            for quote_item in quote_items
+        ]
+        with closing(self._connect()) as conn, conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO quotes VALUES (?, ?, ?, ?, ?, ?, ?)", rows
+            )
+
+    def filter_unindexed_ids(self, spreadsheet_ids: list[str]) -> list[str]:
+        """インデックスにまだないスプレッドシートIDだけを、元の順番のまま返す"""
+        if not spreadsheet_ids:
+            return []
+
+        with closing(self._connect()) as conn:
+            indexed_ids = {
+                row[0]
+                for row in conn.execute(
+                    f"SELECT spreadsheet_id FROM quotes WHERE spreadsheet_id IN ({','.join('?' * len(spreadsheet_ids))})",
+                    spreadsheet_ids,
+                )
+            }
+        return [i for i in spreadsheet_ids if i not in indexed_ids]
+
+    def find_quotes_by_date(
+        self, from_date: date, to_date: date | None = None
+    ) -> list[QuoteIndexItem]:
+        """見積日がfrom_date以降（to_dateがあればto_dateまで）の見積書を見積日順に返す"""
+        query = "SELECT * FROM quotes WHERE quote_date >= ?"
+        params = [from_date.isoformat()]
+        if to_date is not None:
+            query += " AND quote_date <= ?"
+            params.append(to_date.isoformat())
+        query += " ORDER BY quote_date, row_number"
+
+        with closing(self._connect()) as conn:
+            # カラムの順番はQuoteIndexItemのフィールド順と同じ。quote_dateだけdateに戻す
+            return [
+                QuoteIndexItem(*row[:3], date.fromisoformat(row[3]), *row[4:])
+                for row in conn.execute(query, params)
+            ]
+
+    def get_last_synced_row(self) -> int | None:
+        """見積書管理表をどの行まで読み込んだかを返す。まだ一度も読み込んでいなければNone"""
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT value FROM sync_state WHERE name = ?", (LAST_SYNCED_ROW_KEY,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def set_last_synced_row(self, row_number: int) -> None:
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO sync_state VALUES (?, ?)",
+                (LAST_SYNCED_ROW_KEY, row_number),
+            )
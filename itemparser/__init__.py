@@ -1,17 +1,19 @@
+import csv
 import re
 from dataclasses import dataclass, field
 from datetime import datetime
+from enum import Enum
 from pathlib import Path
-from typing import ClassVar
+from typing import Callable, ClassVar
 
 import dateutil.parser
 import dateutil.tz
-import openpyxl
 import pandas
 from googleapiclient.discovery import Resource
 from googleapiclient.errors import HttpError
 
 from helper import decode_base64url, load_config, rangeconvert
+from helper.excel_reader import read_excel_cells
 from helper.regexpatterns import MSM_ANKEN_NUMBER, RANGE_ADDR_PATTERN
 
 # load config
@@ -24,12 +26,116 @@ def convert_gmail_datetimestr(gmail_datetimeformat: str) -> datetime:
     return persed_time.astimezone(dateutil.tz.gettz("Asia/Tokyo"))
 
 
-@dataclass
+def index_headers(headers: list[dict]) -> dict[str, list[str]]:
+    """
+    Gmail APIのヘッダーのリストを、小文字のヘッダー名から値のリストを引ける辞書にする
+    同じ名前のヘッダー（To, Cc等）が複数ある場合は、出てきた順番で値を並べる
+    """
+    header_index: dict[str, list[str]] = {}
+    for header in headers or []:
+        header_index.setdefault(header.get("name", "").lower(), []).append(
+            header.get("value", "")
+        )
+    return header_index
+
+
+class MessagePartKind(Enum):
+    TEXT = "text"
+    HTML = "html"
+    INLINE_IMAGE = "inline_image"
+    ATTACHMENT = "attachment"
+    MULTIPART = "multipart"
+    OTHER = "other"
+
+
+@dataclass(slots=True)
+class MessagePart:
+    """
+    メールのMIMEパート1つ分です。本文のデコードは最初に呼び出したときに1回だけ行います
+    """
+
+    part: dict
+    kind: MessagePartKind
+    header_index: dict[str, list[str]]
+    _decoded_body: bytes | None = field(default=None, init=False, repr=False)
+
+    @property
+    def part_id(self) -> str:
+        return self.part.get("partId", "")
+
+    @property
+    def mime_type(self) -> str:
+        return self.part.get("mimeType", "")
+
+    @property
+    def filename(self) -> str:
+        return self.part.get("filename", "")
+
+    @property
+    def attachment_id(self) -> str | None:
+        return self.part.get("body", {}).get("attachmentId")
+
+    def decode_body(self) -> bytes:
+        """本文のデータ（base64url）をデコードして返します。添付ファイル等でデータがない場合は空のバイト列"""
+        if self._decoded_body is None:
+            data = self.part.get("body", {}).get("data")
+            self._decoded_body = decode_base64url(data) if data else b""
+        return self._decoded_body
+
+    def decode_text(self) -> str:
+        # Gmail APIの本文のデータはUTF-8に変換されている
+        return self.decode_body().decode("utf8")
+
+
+def classify_message_part(
+    part: dict, header_index: dict[str, list[str]], in_related: bool
+) -> MessagePartKind:
+    """
+    パートを本文（text, html）、本文中の画像、添付ファイル、マルチパートに分類する
+    args:
+        part: Gmail APIのパート
+        header_index: パートのヘッダーの辞書。index_headersで作る
+        in_related: multipart/relatedの中のパートか
+    """
+    mime_type = part.get("mimeType", "").lower()
+    if mime_type.startswith("multipart/"):
+        return MessagePartKind.MULTIPART
+
+    disposition = ",".join(header_index.get("content-disposition", [])).lower()
+    if (
+        mime_type.startswith("image/")
+        and not disposition.startswith("attachment")
+        and (in_related or "content-id" in header_index)
+    ):
+        return MessagePartKind.INLINE_IMAGE
+    if part.get("filename"):
+        return MessagePartKind.ATTACHMENT
+    if mime_type == "text/plain":
+        return MessagePartKind.TEXT
+    if mime_type == "text/html":
+        return MessagePartKind.HTML
+    return MessagePartKind.OTHER
+
+
+@dataclass(slots=True)
 class ExpandedMessageItem:
-    "メッセージ一覧の選択や、メール回りで使うときに利用する"
+    """
+    メッセージ一覧の選択や、メール回りで使うときに利用する
+    ヘッダーは作成時に1回だけ読み、小文字のヘッダー名で引ける辞書（header_index）にする。
+    本文と添付ファイルは、最初にアクセスしたときにパートを1回だけ再帰的にたどって分類する。
+    本文を含まない形式（format=metadata）で取得したメッセージの場合は、本文へのアクセス時に
+    message_loaderで本文を含むメッセージを取得する
+    """
+
     gmail_message: dict
+    # メッセージIDから本文を含むメッセージを取得する関数。RQのジョブ結果として渡せるように、モジュールの関数にする
+    # 例: googleapi.get_full_message
+    message_loader: Callable[[str], dict] | None = field(
+        default=None, repr=False, compare=False
+    )
     payload: dict = field(init=False)
-    headers: dict = field(init=False)
+    headers: list[dict] = field(init=False)
+    header_index: dict[str, list[str]] = field(init=False, repr=False)
 
     id: str = field(init=False)
     title: str = field(init=False)
@@ -38,110 +144,112 @@ class ExpandedMessageItem:
     to_address: str = field(init=False)
     cc_address: str = field(init=False)
     datetime_: datetime = field(init=False)
-    body_related: dict = field(init=False)
-    body_parts: dict = field(init=False)
-    body: str = field(init=False)
+
+    _parts: list[MessagePart] | None = field(default=None, init=False, repr=False)
+    _body_related: dict = field(default_factory=dict, init=False, repr=False)
 
     def __post_init__(self):
         self.payload = self.gmail_message.get("payload")
         self.headers = self.payload.get("headers")
+        self.header_index = index_headers(self.headers)
 
         self.id = self.gmail_message.get("id")
-        self.title = next(
-            (i for i in self.headers if i.get("name").lower() == "Subject".lower())
-        ).get("value")
+        self.title = self.get_header("Subject")
         self.subject = self.title
-        self.from_address = next(
-            (i for i in self.headers if i.get("name").lower() == "From".lower())
-        ).get("value")
+        self.from_address = self.get_header("From")
 
         # toとccは複数アドレスがあるので、",でjoinする
-        self.to_address = ",".join(
-            (
-                i.get("value", "")
-                for i in self.headers
-                if i.get("name").lower() == "To".lower()
-            )
-        )
-        self.cc_address = ",".join(
-            (
-                i.get("value", "")
-                for i in self.headers
-                if i.get("name").lower() == "Cc".lower()
-            )
-        )
-
-        self.datetime_ = convert_gmail_datetimestr(
-            next(
-                (i for i in self.headers if i.get("name").lower() == "Date".lower())
-            ).get("value")
-        )
-
-        # TODO:2023-09-22
-        # メールで使うbodyの部分は、htmlとplainがあるが、何方もstrで保存されるような構造にする
-        # また、imgファイルの収集も行うこと。imgファイルはbase64で保存されているので、decodeしておく
-
-        # メールのmimeマルチパートを考慮して、構造が違うモノに対応する
-        # メールがリッチテキストかつimgファイルがある場合は、multipart/relatedとなり、body_relatedを入れるとimgファイル収集も可能なので、別で用意している
-        self.body_related = {}
-
-        # partsがない場合 = シンプルなテキストベースの場合
-        if not self.payload.get("parts"):
-            self.body_parts = [self.payload]
-        else:
-            # リッチテキスト系の場合
-            mail_part_mimetype = next(
-                i.get("mimeType")
-                for i in self.payload.get("parts")
-                if i.get("partId") in ("0")
+        self.to_address = ",".join(self.header_index.get("to", []))
+        self.cc_address = ",".join(self.header_index.get("cc", []))
+
+        self.datetime_ = convert_gmail_datetimestr(self.get_header("Date"))
+
+    def get_header(self, name: str) -> str | None:
+        """ヘッダーの値を返します。ヘッダー名の大文字小文字は区別しません。同じ名前が複数ある場合は最初のもの"""
+        return next(iter(self.header_index.get(name.lower(), [])), None)
+
+    def _load_full_payload(self) -> dict:
+        # partsか本文のデータがあれば、本文を含む形式（format=full）で取得したメッセージ
+        if "parts" in self.payload or "data" in self.payload.get("body", {}):
+            return self.payload
+        if self.message_loader is None:
+            raise ValueError(
+                f"本文を含まないメッセージです。message_loaderを指定してください: {self.id}"
             )
 
-            # body_partsを取得する。mimeTypeによって構造が違うので、それぞれの場合で処理を変える
-            match mail_part_mimetype:
-                case "text/plain":
-                    self.body_parts = self.payload.get("parts")
-                case "multipart/alternative":
-                    self.body_parts = next(
-                        (
-                            i
-                            for i in self.payload.get("parts")
-                            if i.get("mimeType") == "multipart/alternative"
-                        ),
-                        {},
-                    ).get("parts")
-                case "multipart/related":
-                    self.body_related = next(
-                        (
-                            i
-                            for i in self.payload.get("parts")
-                            if i.get("mimeType") == "multipart/related"
-                        )
-                    )
-                    self.body_parts = next(
-                        (
-                            i
-                            for i in self.body_related.get("parts")
-                            if i.get("mimeType") == "multipart/alternative"
-                        )
-                    ).get("parts")
-                case _:
-                    pass
-
-        # body_partsからbodyを取得する
-        mailbody = next(
-            (
-                i["body"]["data"]
-                for i in self.body_parts
-                if "text/plain" in i.get("mimeType")
-            )
+        self.gmail_message = self.message_loader(self.id)
+        self.payload = self.gmail_message.get("payload")
+        return self.payload
+
+    def _walk_parts(
+        self, part: dict, in_related: bool, parts: list[MessagePart]
+    ) -> None:
+        # ルートのヘッダーはheader_indexを使い回す
+        header_index = (
+            self.header_index
+            if part is self.payload
+            else index_headers(part.get("headers"))
         )
+        kind = classify_message_part(part, header_index, in_related)
+        parts.append(MessagePart(part, kind, header_index))
+
+        # メールがリッチテキストかつimgファイルがある場合は、multipart/relatedとなる
+        is_related = part.get("mimeType", "").lower() == "multipart/related"
+        if is_related and not self._body_related:
+            self._body_related = part
+        for child_part in part.get("parts", []):
+            self._walk_parts(child_part, in_related or is_related, parts)
+
+    @property
+    def parts(self) -> list[MessagePart]:
+        """メッセージの全てのパート。ルートのパートから深さ優先の順番"""
+        if self._parts is None:
+            parts: list[MessagePart] = []
+            self._walk_parts(self._load_full_payload(), False, parts)
+            self._parts = parts
+        return self._parts
+
+    def _find_part(self, kind: MessagePartKind) -> MessagePart | None:
+        return next((part for part in self.parts if part.kind == kind), None)
+
+    @property
+    def text_part(self) -> MessagePart | None:
+        return self._find_part(MessagePartKind.TEXT)
+
+    @property
+    def html_part(self) -> MessagePart | None:
+        return self._find_part(MessagePartKind.HTML)
+
+    @property
+    def inline_images(self) -> list[MessagePart]:
+        return [p for p in self.parts if p.kind == MessagePartKind.INLINE_IMAGE]
+
+    @property
+    def attachments(self) -> list[MessagePart]:
+        return [p for p in self.parts if p.kind == MessagePartKind.ATTACHMENT]
+
+    @property
+    def body_related(self) -> dict:
+        """multipart/relatedのパート。ない場合は空のdict"""
+        _ = self.parts
+        return self._body_related
+
+    @property
+    def body_parts(self) -> list[dict]:
+        """本文（text/plain, text/html）のパート"""
+        return [
+            p.part
+            for p in self.parts
+            if p.kind in (MessagePartKind.TEXT, MessagePartKind.HTML)
+        ]
 
+    @property
+    def body(self) -> str:
         # TODO:2023-09-21 これは使われているのかいまいちわからなかった。bodyはstrが望ましい。
         # htmlとplane両方ある場合、planeはそのまま。htmlはhtml2textで変換する
-        self.body = decode_base64url(mailbody).decode("utf8")
-
-        # TODO:2023-09-22
-        # 添付ファイルの収集もここで行う。添付ファイルはGmail API経由でDLが必要になるので、ここでは行わない
+        if (text_part := self.text_part) is None:
+            raise ValueError(f"text/plainの本文がありません: {self.id}")
+        return text_part.decode_text()
 
 
 @dataclass
@@ -156,6 +264,8 @@ class RenrakukoumokuInfo:
         "before202211": {"kokyaku_name_celaddr": "D6", "enduser_name_celaddr": "D9"},
         "new": {"kokyaku_name_celaddr": "D6", "enduser_name_celaddr": "D10"},
     }
+    # 連絡項目表から読み込むセル。フォーマットの判定（B9）と、どちらのフォーマットの値も1回で読み込む
+    renrakukoumoku_cell_addrs: ClassVar[tuple[str, ...]] = ("B9", "D6", "D9", "D10")
 
     def __post_init__(self):
         # 念のために前処理でスペースがあれば除去してる
@@ -163,8 +273,10 @@ class RenrakukoumokuInfo:
             self.renrakukoumoku_path.name.replace(" ", "")
         ).group("basepartnumber")
 
-        renrakukoumoku_ws = openpyxl.load_workbook(self.renrakukoumoku_path).active
-        version_pattern_check = renrakukoumoku_ws["B9"].value
+        renrakukoumoku_cells = read_excel_cells(
+            self.renrakukoumoku_path, self.renrakukoumoku_cell_addrs
+        )
+        version_pattern_check = renrakukoumoku_cells["B9"]
         version_cell_addr = {}
         match version_pattern_check:
             case "エンドユーザー":
@@ -177,21 +289,48 @@ class RenrakukoumokuInfo:
                 print("連絡項目の内容が不正の可能性があります")
                 return None
 
-        self.kokyaku_name = renrakukoumoku_ws[
+        self.kokyaku_name = renrakukoumoku_cells[
             version_cell_addr["kokyaku_name_celaddr"]
-        ].value
-        self.enduser_name = renrakukoumoku_ws[
+        ]
+        self.enduser_name = renrakukoumoku_cells[
             version_cell_addr["enduser_name_celaddr"]
-        ].value
+        ]
+
+
+def parse_suryou(value: str) -> int:
+    """
+    部品表の数量のセルを整数にする。空のセル、数値として読めないセルは0
+    "2.0"のような小数の表記も受け付ける
+    """
+    try:
+        return int(float(value))
+    except ValueError:
+        return 0
 
 
 @dataclass
 class CsvFileInfo:
+    """
+    部品表（BOM）のCSVファイルから、スケジュール表に載せる値を集計する
+    CSVは1行ずつ読み、必要な列（品名, 備考, 型式・寸法, 数量）だけを取り出して1回で集計するので、大きなファイルでもメモリを使わない
+    本数は数量の列の合計。数量の列がない部品表では行数を本数とする
+    """
+
     csv_filepath: Path
     anken_number: str = field(init=False)
     anken_base_number: str = field(init=False)
-    hose_type: str = field(init=False)
-    hose_attachment_types: set[str] = field(init=False)
+    gas_qty: int = field(init=False)
+    hose_qty: int = field(init=False)
+    hose_type: str | None = field(init=False)
+    hose_attachment_types: str = field(init=False)
+
+    # 集計に使う列と品名
+    hinmei_column: ClassVar[str] = "品名"
+    bikou_column: ClassVar[str] = "備考"
+    katasiki_column: ClassVar[str] = "型式・寸法"
+    suryou_column: ClassVar[str] = "数量"
+    hose_hinmei: ClassVar[str] = "ホース(継手付)"
+    gas_hinmei: ClassVar[str] = "ガススプリング"
 
     def __post_init__(self):
         # 前処理: ファイル名にスペースとアンダーバーが入ることがあるので、置き換え
@@ -202,15 +341,49 @@ class CsvFileInfo:
             "basepartnumber"
         )
 
-        csv_pd = pandas.read_csv(self.csv_filepath, encoding="shift-jis")
-        hose_parts_pd = csv_pd[csv_pd["品名"] == "ホース(継手付)"]
+        self.gas_qty = 0
+        self.hose_qty = 0
+        self.hose_type = None
+        hose_attachment_types = set()
+
+        with self.csv_filepath.open("r", encoding="shift-jis", newline="") as f:
+            csv_reader = csv.reader(f)
+            header = next(csv_reader)
+            hinmei_index = header.index(self.hinmei_column)
+            bikou_index = header.index(self.bikou_column)
+            katasiki_index = header.index(self.katasiki_column)
+            # 数量の列がない部品表もあるので、その場合は1行を1本として数える
+            suryou_index = (
+                header.index(self.suryou_column)
+                if self.suryou_column in header
+                else None
+            )
+            required_length = (
+                max(hinmei_index, bikou_index, katasiki_index, suryou_index or 0) + 1
+            )
+
+            for row in csv_reader:
+                if len(row) < required_length:
+                    continue
+                hinmei = row[hinmei_index]
+                if hinmei not in (self.gas_hinmei, self.hose_hinmei):
+                    continue
+                qty = 1 if suryou_index is None else parse_suryou(row[suryou_index])
 
-        self.hose_type = hose_parts_pd["備考"].drop_duplicates().values[0]
+                # ガススプリングの本数: 品名がガススプリングの行の数量の合計
+                if hinmei == self.gas_hinmei:
+                    self.gas_qty += qty
+                    continue
 
-        # 型式寸法から、SS,SL,LLを取り出して、重複を外して種類を確定させる
-        self.hose_attachment_types = "/".join(
-            {item.split("-")[1] for item in hose_parts_pd["型式・寸法"].values}
-        )
+                # ホースの本数: 品名がホース(継手付)の行の数量の合計
+                self.hose_qty += qty
+                # ホースのタイプは最初に出てきた備考を使う
+                if self.hose_type is None:
+                    self.hose_type = row[bikou_index]
+                # 型式寸法から、SS,SL,LLを取り出して、重複を外して種類を確定させる
+                hose_attachment_types.add(row[katasiki_index].split("-")[1])
+
+        self.hose_attachment_types = "/".join(sorted(hose_attachment_types))
 
 
 # TODO:2023-10-15 このデータクラスをasdictすると、EstimateCalcSheetInfoのgapiのserviseが変換できないと思われる。
@@ -225,6 +398,8 @@ class EstimateCalcSheetInfo:
 
     # gsheet_url | openpyxl.ws を受け取るような仕様にする。
     calcsheet_source: str | Path
+    # 取得済みのシート情報（fetch_calcsheet_dataの戻り値と同じ形）。ある場合はAPIに問い合わせない
+    calcsheet_data: dict | None = field(default=None, repr=False)
     anken_number: str = field(init=False)
     anken_base_number: str = field(init=False)
     calcsheet_parents: list[str] = field(init=False)
@@ -234,6 +409,18 @@ class EstimateCalcSheetInfo:
     # TODO:2023-04-19 ここはstrだが、利用する場所でintに置き換えるのでstrで良い
     price: str = field(init=False)
 
+    # スプレッドシートの情報は、ファイル名とシート名だけ取得する
+    metadata_fields: ClassVar[str] = "properties/title,sheets/properties/title"
+    # 古い仕様のシートと新しいシートの違いで、range_mapを変える。計算結果シートがある場合はそこを参照
+    range_map: ClassVar[dict] = {
+        "Sheet1!F17": "price",
+        "Sheet1!F1": "_duration_src",
+    }
+    result_sheet_range_map: ClassVar[dict] = {
+        "'計算結果'!B5": "price",
+        "'計算結果'!B6": "_duration_src",
+    }
+
     def __post_init__(self):
         # sourceの種類で取り込む処理を変える
         match self.calcsheet_source:
@@ -244,77 +431,111 @@ class EstimateCalcSheetInfo:
                 pass
             # gsheet形式: IDの羅列なのでIDが利用できるかはAPIに問い合わせる
             case str():
-                # TODO:2023-04-19 ここはtryの中身が多すぎるので、API問い合わせ事にexceptする。
-                try:
-                    # スプレッドシート名を収集して、anken_numberを生成
-
-                    self.gsheet_values = (
-                        self.sheet_service.spreadsheets()
-                        .get(
-                            spreadsheetId=self.calcsheet_source,
+                if self.calcsheet_data is None:
+                    try:
+                        self.calcsheet_data = self.fetch_calcsheet_data(
+                            self.sheet_service, self.calcsheet_source
                         )
-                        .execute()
-                    )
-
-                    self.anken_number = MSM_ANKEN_NUMBER.search(
-                        self.gsheet_values["properties"]["title"]
-                    ).group(0)
-                    self.anken_base_number = MSM_ANKEN_NUMBER.search(
-                        self.anken_number
-                    ).group("basepartnumber")
-
-                    # 古い仕様のシートと新しいシートの違いで、range_mapを変える。計算結果シートがある場合はそこを参照
-                    estimate_calc_sheetnames = [
-                        sheets["properties"]["title"]
-                        for sheets in self.gsheet_values["sheets"]
-                    ]
-                    # print(estimate_calc_sheetnames)
-                    # TODO:2023-01-12 この部分は判断方法と結果を返す関数にした方がいいと思われる。クラスの裏に分離したほうがいいな
-                    range_map = {
-                        "Sheet1!F17": "price",
-                        "Sheet1!F1": "_duration_src",
-                    }
-
-                    if "計算結果" in estimate_calc_sheetnames:
-                        range_map = {
-                            "'計算結果'!B5": "price",
-                            "'計算結果'!B6": "_duration_src",
-                        }
-
-                    # シートの情報を収集して各フィールドへ追加す各
-                    range_names = list(range_map.keys())
-                    estimate_calc_gsheet_values_res = (
-                        self.sheet_service.spreadsheets()
-                        .values()
-                        .batchGet(
-                            spreadsheetId=self.calcsheet_source,
-                            ranges=range_names,
-                            # valueRenderOption="UNFORMATTED_VALUE",
-                        )
-                        .execute()
-                    )
-                    for res_value in estimate_calc_gsheet_values_res.get("valueRanges"):
-                        setattr(
-                            self,
-                            range_map[res_value.get("range")],
-                            str(res_value.get("values")[0][0]),
-                        )
-                    # gsheetで取り込んだ結果が数字になってしまう...
-                    self.duration = self.fix_datetime(self._duration_src)
-                    self.duration_str = self.duration.strftime("%m/%d")
-                    self.price = re.sub(r"[\¥\,]", "", self.price)
-
-                except HttpError as error:
-                    # TODO:2022-12-09 エラーハンドリングは基本行わずここで落とすこと
-                    # TODO: 2022/12/28 このエラーは致命的なのでそのままプログラム自体も終了する
-                    print(f"An error occurred: {error}")
-                    exit()
+                    except HttpError as error:
+                        # TODO:2022-12-09 エラーハンドリングは基本行わずここで落とすこと
+                        # TODO: 2022/12/28 このエラーは致命的なのでそのままプログラム自体も終了する
+                        print(f"An error occurred: {error}")
+                        exit()
+                self.set_calcsheet_data(self.calcsheet_data)
             # Path, str以外はエラーとする
             case _:
                 raise ValueError(
                     f"This source is cant use class:{self.calcsheet_source}"
                 )
 
+    @classmethod
+    def select_range_map(cls, metadata: dict) -> dict:
+        """
+        シート名の一覧から、値を読むセル範囲とフィールド名の対応を選ぶ
+
+        args:
+            metadata: build_metadata_requestのレスポンス
+        return:
+            {セル範囲: フィールド名}
+        """
+        estimate_calc_sheetnames = [
+            sheets["properties"]["title"] for sheets in metadata["sheets"]
+        ]
+        if "計算結果" in estimate_calc_sheetnames:
+            return cls.result_sheet_range_map
+        return cls.range_map
+
+    @classmethod
+    def build_metadata_request(cls, sheet_service: Resource, spreadsheet_id: str):
+        """
+        ファイル名とシート名だけを取得するリクエストを作る（executeはしない）
+        """
+        return sheet_service.spreadsheets().get(
+            spreadsheetId=spreadsheet_id, fields=cls.metadata_fields
+        )
+
+    @classmethod
+    def build_values_request(
+        cls, sheet_service: Resource, spreadsheet_id: str, metadata: dict
+    ):
+        """
+        価格と納期のセルの値を取得するリクエストを作る（executeはしない）
+
+        args:
+            sheet_service: sheetのservice
+            spreadsheet_id: 見積もり計算表のID
+            metadata: build_metadata_requestのレスポンス
+        """
+        return (
+            sheet_service.spreadsheets()
+            .values()
+            .batchGet(
+                spreadsheetId=spreadsheet_id,
+                ranges=list(cls.select_range_map(metadata).keys()),
+                fields="valueRanges/values",
+                # valueRenderOption="UNFORMATTED_VALUE",
+            )
+        )
+
+    @classmethod
+    def fetch_calcsheet_data(cls, sheet_service: Resource, spreadsheet_id: str) -> dict:
+        """
+        1件分のシート情報を取得する。複数件の場合はリクエストを作って並列に実行すること
+
+        return:
+            {"metadata": ファイル名とシート名, "value_ranges": 価格と納期の値}
+        """
+        metadata = cls.build_metadata_request(sheet_service, spreadsheet_id).execute()
+        values_res = cls.build_values_request(
+            sheet_service, spreadsheet_id, metadata
+        ).execute()
+        return {"metadata": metadata, "value_ranges": values_res.get("valueRanges")}
+
+    def set_calcsheet_data(self, calcsheet_data: dict) -> None:
+        """
+        取得したシート情報を各フィールドへ入れる
+        """
+        metadata = calcsheet_data["metadata"]
+        # スプレッドシート名を収集して、anken_numberを生成
+        self.anken_number = MSM_ANKEN_NUMBER.search(
+            metadata["properties"]["title"]
+        ).group(0)
+        self.anken_base_number = MSM_ANKEN_NUMBER.search(self.anken_number).group(
+            "basepartnumber"
+        )
+
+        # valueRangesはリクエストしたrangesと同じ順番で返ってくる
+        for field_name, res_value in zip(
+            self.select_range_map(metadata).values(),
+            calcsheet_data["value_ranges"],
+            strict=True,
+        ):
+            setattr(self, field_name, str(res_value.get("values")[0][0]))
+        # gsheetで取り込んだ結果が数字になってしまう...
+        self.duration = self.fix_datetime(self._duration_src)
+        self.duration_str = self.duration.strftime("%m/%d")
+        self.price = re.sub(r"[\¥\,]", "", self.price)
+
     def fix_datetime(self, datetime_str: str) -> datetime:
         """
         日付の入力の区切り文字を修正する。
@@ -6,6 +6,7 @@ import questionary
 import redis
 from rq import Queue
 
+from api import googleapi
 from task import generate_invoice
 
 
@@ -14,6 +15,9 @@ today_datetime = datetime.now()
 
 
 def main():
+    # Googleのトークンがなければ、ここで認証フローを行ってトークンを作成する
+    googleapi.get_credentials()
+
     queue = Queue(connection=redis.from_url(os.environ.get("RQ_REDIS_URL")))
 
     # 見積一覧から必要情報を収集
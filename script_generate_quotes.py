@@ -8,10 +8,11 @@ import questionary
 import redis
 from rq import Queue
 
+from api import googleapi
 from task import generate_quotes
 
 
-def dry_run(anken_quotes: list[generate_quotes.AnkenQuote]):
+def print_dry_run(anken_quotes: list[generate_quotes.AnkenQuote]):
     """
     dry run用の関数
     args:
@@ -37,6 +38,9 @@ def dry_run(anken_quotes: list[generate_quotes.AnkenQuote]):
 @click.command()
 @click.option("--dry-run", is_flag=True, help="Dry Run Flag")
 def main(dry_run):
+    # Googleのトークンがなければ、ここで認証フローを行ってトークンを作成する
+    googleapi.get_credentials()
+
     queue = Queue(connection=redis.from_url(os.environ.get("RQ_REDIS_URL")))
 
     prepare_task = generate_quotes.PrepareTask()
@@ -65,6 +69,14 @@ def main(dry_run):
         print("操作をキャンセルしました。終了します。")
         sys.exit(0)
 
+    # dry run: 見積もり情報を表示して終了する（見積書は作成しない）
+    # 取得したシート情報はキャッシュに残るので、続けて実行するときは取得し直さない
+    if dry_run:
+        print_dry_run(
+            generate_quotes.generate_anken_quote_list(selected_estimate_calcsheets)
+        )
+        sys.exit(0)
+
     task_data = {
         "task_data": {"selected_estimate_calcsheets": selected_estimate_calcsheets}
     }
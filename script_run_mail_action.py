@@ -3,20 +3,19 @@ import time
 
 import questionary
 import redis
-from googleapiclient.discovery import build
 from rq import Queue
 
 from api import googleapi
 from itemparser import ExpandedMessageItem
 from task import run_mail_action
 
-google_cred = googleapi.get_cledential(googleapi.API_SCOPES)
-gmail_service = build("gmail", "v1", credentials=google_cred)
-
 
 def main() -> None:
     print("[Start Process...]")
 
+    # Googleのトークンがなければ、ここで認証フローを行ってトークンを作成する
+    googleapi.get_credentials()
+
     queue = Queue(connection=redis.from_url(os.environ.get("RQ_REDIS_URL")))
 
     prepare_task = run_mail_action.PrepareTask()
@@ -1,6 +1,3 @@
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
-
 from api import googleapi
 import chat.card
 from helper import load_config, chatcard
@@ -8,12 +5,6 @@ from helper import load_config, chatcard
 # 認証情報をtomlファイルから読み込む
 config = load_config.CONFIG
 
-
-google_cred: Credentials = googleapi.get_cledential_by_serviceaccount(
-    googleapi.CHAT_API_SCOPES
-)
-chat_service = build("chat", "v1", credentials=google_cred)
-
 spacename = config.get("google").get("CHAT_SPACENAME")
 bot_header = chatcard.bot_header
 
@@ -38,4 +29,6 @@ def bot_calc_add(a: int, b: int) -> dict:
             ),
         ],
     )
-    return googleapi.create_chat_message(chat_service, spacename, send_message_body)
+    return googleapi.create_chat_message(
+        googleapi.get_service("chat"), spacename, send_message_body
+    )
@@ -1,12 +1,13 @@
+import bisect
 import json
 from dataclasses import asdict, dataclass, field
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from pathlib import Path
 
 import openpyxl
 from dateutil import parser
 from dateutil.relativedelta import relativedelta
-from googleapiclient.discovery import build
+from googleapiclient.http import HttpRequest
 from openpyxl.styles import Border, Side
 from zoneinfo import ZoneInfo
 from api.googleapi import sheet_data_mapper
@@ -15,6 +16,7 @@ import chat.card
 from api import googleapi
 
 from helper import EXPORTDIR_PATH, ROOTDIR, chatcard, load_config
+from helper.quote_index import VOID_QUOTE_FILENAME_PREFIX, QuoteIndex, QuoteIndexItem
 from helper.regexpatterns import INVOICE_DURARION, MSM_ANKEN_NUMBER
 from task import BaseTask, ProcessData
 
@@ -42,6 +44,12 @@ with open(QUOTE_TEMPLATE_CELL_MAPPING_JSON_PATH, "r", encoding="utf-8") as f:
     quote_template_cell_mapping_dict = json.load(f)
 
 
+# 請求対象として選択肢に出す見積書の期間（見積日から何日前まで）
+QUOTE_SELECTION_DAYS = 40
+# 見積書管理表で見積日（E列）がない古い行から、見積書を探すときにさかのぼる最大の行数
+QUOTE_LIST_DATELESS_FALLBACK_ROWS = 200
+
+
 # 請求書のファイル一覧を記録するGoogleスプレッドシートのID
 # https://docs.google.com/spreadsheets/d/1_x1yBpm34FWJ1shXQeUZVwwqp8CdT34t9zH5T-urzHs
 INVOICE_FILE_LIST_GSHEET_ID = SCRIPT_CONFIG.get("INVOICE_FILE_LIST_GSHEET_ID")
@@ -60,36 +68,43 @@ INVOICE_GSHEET_SAVE_DIR_IDS = SCRIPT_CONFIG.get("INVOICE_GSHEET_SAVE_DIR_IDS")
 INVOICE_DOC_SAVE_DIR_IDS = SCRIPT_CONFIG.get("INVOICE_DOC_SAVE_DIR_IDS")
 
 # 各定数から全体で使う変数を作成
+# 保存先フォルダはワーカーで実行するたびに作る（get_invoice_filepaths）
 export_invoice_dirpath = EXPORTDIR_PATH / "invoice"
-export_invoice_dirpath.mkdir(parents=True, exist_ok=True)
 
 with open(INVOICE_TEMPLATE_CELL_MAPPING_JSON_PATH, "r", encoding="utf-8") as f:
     invoice_template_cell_mapping_dict = json.load(f)
 
-# 本日の日付を全体で使うためにここで宣言
-today_datetime = datetime.now(ZoneInfo("Asia/Tokyo"))
-INVOICE_PDFFILEPATH = (
-    export_invoice_dirpath / f"{today_datetime:%Y%m}_ミスミ配管請求書.pdf"
-)
-INVOICE_LIST_EXCELPATH = (
-    export_invoice_dirpath / f"{today_datetime:%Y%m}_ミスミ配管納品一覧.xlsx"
-)
 
-# API Session
-# TODO:2023-09-19 ここはtry exceptで囲む
-google_cred = googleapi.get_cledential(googleapi.API_SCOPES)
-gsheet_service = build("sheets", "v4", credentials=google_cred)
-gmail_service = build("gmail", "v1", credentials=google_cred)
-gdrive_service = build("drive", "v3", credentials=google_cred)
+def get_today_datetime() -> datetime:
+    """
+    本日の日時（日本時間）を返す
+    ワーカーはモジュールを読み込んだまま複数のジョブを実行するので、import時ではなく使う時に取得する
+    """
+    return datetime.now(ZoneInfo("Asia/Tokyo"))
+
+
+def get_invoice_filepaths(today_datetime: datetime) -> tuple[Path, Path]:
+    """
+    請求書PDFと納品一覧xlsxの保存先を返す。保存先フォルダがなければ作る
+
+    args:
+        today_datetime: 実行日
+    return:
+        (請求書PDFのパス, 納品一覧xlsxのパス)
+    """
+    export_invoice_dirpath.mkdir(parents=True, exist_ok=True)
+    return (
+        export_invoice_dirpath / f"{today_datetime:%Y%m}_ミスミ配管請求書.pdf",
+        export_invoice_dirpath / f"{today_datetime:%Y%m}_ミスミ配管納品一覧.xlsx",
+    )
+
 
+# API Session
+# Google APIのサービスは使う時にgoogleapi.get_serviceで取得する（プロセス内で使い回される）
 
 # mfcloudのセッション作成
 # mfcl_session = MFCIClient().get_session()
 
-# チャット用の認証情報を取得
-google_sa_cred = googleapi.get_cledential_by_serviceaccount(googleapi.CHAT_API_SCOPES)
-chat_service = build("chat", "v1", credentials=google_sa_cred)
-
 spacename = config.get("google").get("CHAT_SPACENAME")
 bot_header = chatcard.bot_header
 
@@ -213,11 +228,12 @@ def set_border_style(
 
 # TODO:2024-02-12 ここはgoogleスプレッドシートに保存して、excelのファイルとしてダウンロードさせる
 def generate_invoice_list_excel(
-    invoice_target_quotes: list[QuoteData],
+    invoice_target_quotes: list[QuoteData], invoice_list_excelpath: Path
 ) -> Path:
     """
     請求対象一覧をxlsxファイルに出力する
     """
+    today_datetime = get_today_datetime()
     # テンプレートの形式に沿った数字の設定
     row_start = 6
     # InvoiceTargetQuoteの構造に従ったマップ
@@ -247,8 +263,8 @@ def generate_invoice_list_excel(
 
     # ファイルを保存する
     # TODO:2023-08-29 ここのファイル名の戻り値って意味ある？
-    wb.save(INVOICE_LIST_EXCELPATH)
-    return INVOICE_LIST_EXCELPATH
+    wb.save(invoice_list_excelpath)
+    return invoice_list_excelpath
 
 
 def str_to_datetime_with_dateutil(date_str):
@@ -327,7 +343,7 @@ def generate_invoice_data(
     return InvoiceInfo(
         sum((i.price for i in quote_checked_list)),
         "ガススプリング配管図作製費",
-        f"{today_datetime:%Y年%m月}請求分",
+        f"{get_today_datetime():%Y年%m月}請求分",
     )
 
 
@@ -337,9 +353,10 @@ def set_draft_mail(attchment_filepaths: list[Path]) -> dict:
     タイトルと本文を入力してメール下書きを作成する
     タイトルの例 "2023年03月請求書送付について"
     """
+    gmail_service = googleapi.get_service("gmail")
     # タイトルは日付が入ったもの。例:2023年03月請求書送付について
     mailtitle = SCRIPT_CONFIG.get("mail_template_title").replace(
-        "{{datetime}}", f"{today_datetime:%Y年%m月}"
+        "{{datetime}}", f"{get_today_datetime():%Y年%m月}"
     )
 
     mailbody = SCRIPT_CONFIG.get("mail_template_body")
@@ -352,28 +369,29 @@ def set_draft_mail(attchment_filepaths: list[Path]) -> dict:
     )
 
 
-def get_quote_gsheet_by_quote_list_gsheet(
-    gsheet_service, per_page_length: int
-) -> list | None:
-    # Googleスプレッドシートの見積書一覧をみて、最後尾から必要な件数の見積書スプレッドシートのURLリストを取得する
-
-    # 見積計算表の生成元シートの最大行範囲を取得
-    range_name = "見積書管理!C2:C"
-    result = (
+def build_values_by_range_request(
+    gsheet_service, spreadsheet_id, name_and_range_dict: dict
+) -> HttpRequest:
+    """{"意味名":"セル番号"}の辞書をもとに、値をバッチでgetするリクエストを作る。ここではexecuteしない"""
+    return (
         gsheet_service.spreadsheets()
         .values()
-        .get(spreadsheetId=QUOTE_FILE_LIST_GSHEET_ID, range=range_name)
-        .execute()
+        .batchGet(
+            spreadsheetId=spreadsheet_id,
+            ranges=list(name_and_range_dict.values()),
+            majorDimension="COLUMNS",
+        )
     )
-    values = result.get("values", [])
 
-    if not values:
-        return None
-    else:
-        # 最後の行を取得
-        last_row = len(values)
-        print(f"{range_name} 最後の行: {last_row}")
-        return values[last_row - per_page_length : last_row]
+
+def convert_values_by_range_result(name_and_range_dict: dict, result: dict) -> dict:
+    """batchGetの結果を{"意味名": "セルの値"}の辞書にする。結果のrangeの数が合わない場合はValueError"""
+    return {
+        key: value.get("values", [[""]])[0][0]
+        for key, value in zip(
+            name_and_range_dict, result.get("valueRanges"), strict=True
+        )
+    }
 
 
 def get_values_by_range(
@@ -383,21 +401,34 @@ def get_values_by_range(
     ここでは、シートの値は必ず1行1列の値として取得することを前提としている。
     戻り値は、{"意味名": "セルの値"}の辞書
     """
-    result = (
-        gsheet_service.spreadsheets()
-        .values()
-        .batchGet(
-            spreadsheetId=spreadsheet_id,
-            ranges=list(name_and_range_dict.values()),
-            majorDimension="COLUMNS",
-        )
-        .execute()
-    )
+    result = build_values_by_range_request(
+        gsheet_service, spreadsheet_id, name_and_range_dict
+    ).execute(num_retries=googleapi.REQUEST_NUM_RETRIES)
     # 取得した値を辞書にして返す
-    return {
-        key: value.get("values", [[""]])[0][0]
-        for key, value in zip(name_and_range_dict, result.get("valueRanges"))
-    }
+    return convert_values_by_range_result(name_and_range_dict, result)
+
+
+def get_values_by_range_list(
+    gsheet_service, spreadsheet_ids: list[str], name_and_range_dict: dict
+) -> list[dict]:
+    """
+    get_values_by_rangeを複数のスプレッドシートに対して並列で行う。
+    同時実行数とリトライはgoogleapi.execute_requests_concurrentlyに従う。
+    戻り値の順番はspreadsheet_idsと同じ
+    """
+    results = googleapi.execute_requests_concurrently(
+        googleapi.get_credentials(),
+        [
+            build_values_by_range_request(
+                gsheet_service, spreadsheet_id, name_and_range_dict
+            )
+            for spreadsheet_id in spreadsheet_ids
+        ],
+    )
+    return [
+        convert_values_by_range_result(name_and_range_dict, result)
+        for result in results
+    ]
 
 
 def get_hinmoku_celladdrs_by_gsheet():
@@ -419,51 +450,221 @@ def get_hinmoku_celladdrs_by_gsheet():
     }
 
 
-class PrepareTask(BaseTask):
-    def execute_task(self) -> list[tuple[QuoteData, bool]]:
-        # 見積書一覧を取得
+def get_quote_gsheet_urls_from_row(
+    gsheet_service, start_row: int
+) -> tuple[list[tuple[int, str]], set[int]]:
+    """
+    見積書管理表のB列（ファイル名）とC列（見積書スプレッドシートのURL）をstart_row行目から最後まで取得する。
+    URLが空の行（番号だけ確保された行など）は除く。作成に失敗した行（B列が作成失敗の印）は別に返す。
 
-        # TODO: 2024-02-06 この100件を取り出す方法は本来は動作が微妙
-        # 見積書の納期日をもとに40日前までの見積書を取得するようにするほうがベスト。
-        # もしくはスケジュール表の実納期日をもとにすると良さそう
+    args:
+        gsheet_service: Sheets APIのサービス
+        start_row: 読み込みを始める行番号
+    return:
+        ((行番号, URL)のリスト, 作成に失敗した行番号の集合)
+    """
+    range_name = f"見積書管理!B{start_row}:C"
+    result = (
+        gsheet_service.spreadsheets()
+        .values()
+        .get(spreadsheetId=QUOTE_FILE_LIST_GSHEET_ID, range=range_name)
+        .execute(num_retries=googleapi.REQUEST_NUM_RETRIES)
+    )
+    quote_url_rows = []
+    void_rows = set()
+    for row_number, value in enumerate(result.get("values", []), start=start_row):
+        # 値は[B列:ファイル名, C列:URL]の順に入る。後ろの空セルは省略される
+        if len(value) >= 2 and value[1]:
+            quote_url_rows.append((row_number, value[1]))
+        elif value and value[0].startswith(VOID_QUOTE_FILENAME_PREFIX):
+            void_rows.add(row_number)
+    return quote_url_rows, void_rows
+
+
+def get_quote_list_dates(gsheet_service) -> list[date | None]:
+    """
+    見積書管理表のE列（見積日）を2行目から最後まで1回で取得する。
+    E列はgenerate_quotesがYYYY-MM-DDの文字列（RAW）で記録する。空の行や読めない値はNone
+
+    return:
+        2行目からの見積日のリスト。後ろの空行は含まない
+    """
+    result = (
+        gsheet_service.spreadsheets()
+        .values()
+        .get(spreadsheetId=QUOTE_FILE_LIST_GSHEET_ID, range="見積書管理!E2:E")
+        .execute(num_retries=googleapi.REQUEST_NUM_RETRIES)
+    )
+    quote_dates = []
+    for value in result.get("values", []):
+        try:
+            quote_dates.append(date.fromisoformat(value[0]) if value else None)
+        except ValueError:
+            quote_dates.append(None)
+    return quote_dates
+
+
+def find_start_row_by_quote_dates(
+    quote_dates: list[date | None], from_date: date
+) -> int:
+    """
+    見積書管理表の見積日のリスト（2行目から）から、from_date以降の見積書が始まる行番号を求める。
+    見積書管理表は見積書作成順（見積日順）に追記されるので、見積日がある行だけを二分探索する。
+    見積日がない行は次のように扱う。
+    - 見積日がある行の間・後ろの行（作成中の行など）は、直前の見積日がある行の続きとして含める
+    - 最初の見積日がある行より前の行（E列追加前の古い行）は見積日が分からないので、
+      from_date以前の見積日がある行が見つからない場合に限り、QUOTE_LIST_DATELESS_FALLBACK_ROWS行だけさかのぼって含める
 
-        # 見積管理表の最後尾100件の見積書スプレッドシートのURLリストを取得する
-        # URL（https://docs.google.com/spreadsheets/d/fasfdasfa_IDS_fsdfadsfa）からID(fasfdasfa_IDS_fsdfadsfa)を取得する
-        quote_gsheet_url_list_under_100 = get_quote_gsheet_by_quote_list_gsheet(
-            gsheet_service, 100
+    args:
+        quote_dates: get_quote_list_datesの戻り値
+        from_date: 探したい見積日の開始日
+    return:
+        from_date以降の見積書が始まる行番号
+    """
+    dated_rows = [
+        (index, quote_date)
+        for index, quote_date in enumerate(quote_dates)
+        if quote_date is not None
+    ]
+    if not dated_rows:
+        # 見積日がある行がない場合は、最後の行からさかのぼる
+        start_index = len(quote_dates) - QUOTE_LIST_DATELESS_FALLBACK_ROWS
+    else:
+        position = bisect.bisect_left(
+            dated_rows, from_date, key=lambda dated_row: dated_row[1]
         )
-        print(f"見積書のURLリスト: {quote_gsheet_url_list_under_100}")
+        if position == 0:
+            # from_dateより前の見積日がない = 古い行にfrom_date以降の見積書があるかもしれない
+            start_index = dated_rows[0][0] - QUOTE_LIST_DATELESS_FALLBACK_ROWS
+        else:
+            # from_dateより前の最後の見積日がある行の次から
+            start_index = dated_rows[position - 1][0] + 1
 
-        quote_gsheet_id_list_under_100 = [
-            i[0].split("/")[-1] for i in quote_gsheet_url_list_under_100
-        ]
-        print(f"見積書のIDリスト: {quote_gsheet_id_list_under_100}")
+    # 1行目はヘッダーなので2行目から
+    return 2 + max(start_index, 0)
+
+
+def find_quote_list_start_row_by_date(gsheet_service, from_date: date) -> int:
+    """
+    見積書管理表からfrom_date以降の見積書が始まる行番号を探す。
+    E列の見積日を1回で取得して、find_start_row_by_quote_datesで探す。
+
+    args:
+        gsheet_service: Sheets APIのサービス
+        from_date: 探したい見積日の開始日
+    return:
+        from_date以降の見積書が始まる行番号
+    """
+    start_row = find_start_row_by_quote_dates(
+        get_quote_list_dates(gsheet_service), from_date
+    )
+
+    print(f"見積書管理表 {from_date} 以降の開始行: {start_row}")
+    return start_row
 
-        # URLリストからAPIで見積書の情報を取得。GoogleスプレッドシートのIDから情報を取得する。
-        quota_values_list_extracted_from_gsheet = [
-            get_values_by_range(gsheet_service, id, get_hinmoku_celladdrs_by_gsheet())
-            for id in quote_gsheet_id_list_under_100
-        ]
 
-        print(f"見積書の情報: {quota_values_list_extracted_from_gsheet}")
+def convert_quote_values_to_index_item(
+    spreadsheet_id: str, row_number: int, quote_values: dict
+) -> QuoteIndexItem | None:
+    """見積書から取得した値をインデックス用に変換する。見積日が読めない場合はNone"""
+    try:
+        quote_date = datetime.strptime(quote_values["quote_date"], "%Y/%m/%d").date()
+    except ValueError:
+        print(f"見積日が読めない見積書があります。スキップします: {spreadsheet_id}")
+        return None
+
+    return QuoteIndexItem(
+        spreadsheet_id=spreadsheet_id,
+        row_number=row_number,
+        quote_id=quote_values["quote_id"],
+        quote_date=quote_date,
+        hinmoku_name=quote_values["hinmoku_name"],
+        hinmoku_detail=quote_values["hinmoku_detail"],
+        hinmoku_price=quote_values["hinmoku_price"],
+    )
+
+
+def sync_quote_index(
+    gsheet_service, quote_index: QuoteIndex, from_date: date
+) -> None:
+    """
+    見積書管理表で前回読み込んだ行より後ろを読み、インデックスにない見積書だけを取得して記録する。
+    初回（読み込み記録がない場合）は、見積日がfrom_date以降の行を二分探索で探してそこから読み込む。
+    """
+    last_synced_row = quote_index.get_last_synced_row()
+    if last_synced_row is None:
+        start_row = find_quote_list_start_row_by_date(gsheet_service, from_date)
+    else:
+        start_row = last_synced_row + 1
+    quote_url_rows, void_rows = get_quote_gsheet_urls_from_row(
+        gsheet_service, start_row
+    )
+
+    if not quote_url_rows and not void_rows:
+        print("見積書管理表に新しい見積書はありません")
+        return
+
+    # URL（https://docs.google.com/spreadsheets/d/fasfdasfa_IDS_fsdfadsfa）からID(fasfdasfa_IDS_fsdfadsfa)を取得する
+    row_number_by_id = {url.split("/")[-1]: row_number for row_number, url in quote_url_rows}
+    unindexed_ids = quote_index.filter_unindexed_ids(list(row_number_by_id))
+    print(f"インデックスにない見積書のIDリスト: {unindexed_ids}")
+
+    # URLリストからAPIで見積書の情報を取得。GoogleスプレッドシートのIDから情報を並列で取得する。
+    quote_values_list = get_values_by_range_list(
+        gsheet_service, unindexed_ids, get_hinmoku_celladdrs_by_gsheet()
+    )
+    quote_items = [
+        quote_item
+        for spreadsheet_id, quote_values in zip(
+            unindexed_ids, quote_values_list, strict=True
+        )
+        if (
+            quote_item := convert_quote_values_to_index_item(
+                spreadsheet_id, row_number_by_id[spreadsheet_id], quote_values
+            )
+        )
+    ]
+    quote_index.upsert_quotes(quote_items)
+
+    # 読み込み済みの行は、先頭からインデックスに記録できた行が続くところまでにする
+    # URLが空の行や見積日が読めない行で止めるので、あとで修正されれば次回の読み込みで記録される
+    # 作成に失敗した行は、見積書がないことが確定しているので読み込み済みとして扱う
+    indexed_rows = (
+        {quote_item.row_number for quote_item in quote_items}
+        | {
+            row_number_by_id[spreadsheet_id]
+            for spreadsheet_id in row_number_by_id.keys() - set(unindexed_ids)
+        }
+        | void_rows
+    )
+    synced_row = start_row - 1
+    while synced_row + 1 in indexed_rows:
+        synced_row += 1
+    if synced_row >= start_row:
+        quote_index.set_last_synced_row(synced_row)
+
+
+class PrepareTask(BaseTask):
+    def execute_task(self) -> list[tuple[QuoteData, bool]]:
+        gsheet_service = googleapi.get_service("sheets")
+        # 見積書一覧を取得
+        # 見積書管理表の新しい行だけを読み、見積書の情報はローカルのインデックスに記録しておく
+        # 見積作成時からQUOTE_SELECTION_DAYS日前までを対象とする
+        today_datetime = get_today_datetime()
+        from_date = (today_datetime + timedelta(days=-QUOTE_SELECTION_DAYS)).date()
+        quote_index = QuoteIndex()
+        sync_quote_index(gsheet_service, quote_index, from_date)
 
         # 見積一覧から必要情報を収集
         # 見積作成時から40日前まで and 品目のフォーマットがミスミの案件番号（正規表現で判断）かでフィルター
-        from_date = datetime.now(ZoneInfo("Asia/Tokyo")) + timedelta(days=-40)
         quote_data_list = [
             QuoteData(
-                durarion_src=quote_values["hinmoku_detail"],
-                price=float(quote_values["hinmoku_price"]),
-                hinmoku_title=quote_values["hinmoku_name"],
-            )
-            for quote_values in quota_values_list_extracted_from_gsheet
-            if is_range_date(
-                datetime.strptime(quote_values["quote_date"], "%Y/%m/%d").replace(
-                    tzinfo=ZoneInfo("Asia/Tokyo")
-                ),
-                from_date,
+                durarion_src=quote_item.hinmoku_detail,
+                price=float(quote_item.hinmoku_price),
+                hinmoku_title=quote_item.hinmoku_name,
             )
-            and MSM_ANKEN_NUMBER.match(quote_values["hinmoku_name"])
+            for quote_item in quote_index.find_quotes_by_date(from_date)
+            if MSM_ANKEN_NUMBER.match(quote_item.hinmoku_name)
         ]
 
         # デフォルト表示の選択マーク用のリストを作成
@@ -516,27 +717,36 @@ class PrepareTask(BaseTask):
                         chat.card.gencomponent_button(
                             "タスク実行確認", "confirm__generate_invoice"
                         ),
-                        chat.card.gencomponent_button("キャンセル", "cancel_task"),
+                        chat.card.gencomponent_button(
+                            "キャンセル", "cancel_task__generate_invoice"
+                        ),
                     ]
                 ),
             ],
         )
-        return googleapi.create_chat_message(chat_service, spacename, config_body)
+        return googleapi.create_chat_message(
+            googleapi.get_service("chat"), spacename, config_body
+        )
 
 
 class MainTask(BaseTask):
     def execute_task(self, process_data: ProcessData | None = None) -> dict:
+        gdrive_service = googleapi.get_service("drive")
+        gsheet_service = googleapi.get_service("sheets")
         ask_choiced_quote_list = process_data["task_data"].get("choiced_quote_list")
         invoice_data = generate_invoice_data(ask_choiced_quote_list)
+        invoice_pdf_filepath, invoice_list_excelpath = get_invoice_filepaths(
+            get_today_datetime()
+        )
 
         # TODO:2024-02-12 ここの変更も必須
         # * 見積一覧をexcelで記入する -> Googleスプレッドシート化してダウンロードできたら行う
 
-        generate_invoice_list_excel(ask_choiced_quote_list)
+        generate_invoice_list_excel(ask_choiced_quote_list, invoice_list_excelpath)
         # excelファイルをGoogleドライブへ保存
         upload_xlsx_result = googleapi.upload_file(
             gdrive_service,
-            INVOICE_LIST_EXCELPATH,
+            invoice_list_excelpath,
             "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
             "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
             INVOICE_DOC_SAVE_DIR_IDS,
@@ -545,21 +755,13 @@ class MainTask(BaseTask):
             f"請求分一覧xlsxファイルをGoogleドライブへ保存しました。: {upload_xlsx_result.get('id')}"
         )
 
-        # * 請求書管理表の最後尾の請求書番号を取得
-        updated_invoice_manage_gsheet = googleapi.append_sheet(
+        # * 請求書管理表の最後尾に行を追加して、請求書番号と行番号を取得
+        [(invoice_number, invoice_manage_row)] = googleapi.reserve_numbered_rows(
             gsheet_service,
             INVOICE_FILE_LIST_GSHEET_ID,
             "請求書管理",
-            [['=TEXT(ROW()-1,"0000")', "", "", ""]],
-            "USER_ENTERED",
-            "INSERT_ROWS",
-            True,
-        )
-        # 請求書番号を取得
-        invoice_number = (
-            updated_invoice_manage_gsheet.get("updates")
-            .get("updatedData")
-            .get("values")[0][0]
+            1,
+            ['=TEXT(ROW()-1,"0000")', "", "", ""],
         )
         print(f"請求書の管理表から番号を生成しました。: {invoice_number}")
 
@@ -571,20 +773,13 @@ class MainTask(BaseTask):
             invoice_data.price,
         )
 
-        # googleスプレッドシートの見積書テンプレートを複製する
+        # googleスプレッドシートの請求書テンプレートを、ファイル名と保存先を指定して複製する
         invoice_file_id = googleapi.dupulicate_file(
             gdrive_service,
             INVOICE_TEMPLATE_GSHEET_ID,
-            INVOICE_PDFFILEPATH.stem,
-        )
-
-        # 請求書スプレッドシートのファイル名と保存先を設定
-        _ = googleapi.update_file(
-            gdrive_service,
-            file_id=invoice_file_id,
-            body=None,
-            add_parents=INVOICE_GSHEET_SAVE_DIR_IDS,
-            fields="id, parents",
+            invoice_pdf_filepath.stem,
+            INVOICE_GSHEET_SAVE_DIR_IDS,
+            {"invoice_number": invoice_number},
         )
 
         # 請求書スプレッドシートへ請求情報を記入
@@ -597,9 +792,9 @@ class MainTask(BaseTask):
 
         # 請求書のPDFをダウンロード
         googleapi.export_pdf_by_driveexporturl(
-            google_cred.token,
+            googleapi.get_credentials().token,
             invoice_file_id,
-            INVOICE_PDFFILEPATH,
+            invoice_pdf_filepath,
             {
                 "gid": "0",
                 "size": "7",
@@ -612,7 +807,7 @@ class MainTask(BaseTask):
         # 請求書のPDFをGoogleドライブへ保存
         upload_pdf_result = googleapi.upload_file(
             gdrive_service,
-            INVOICE_PDFFILEPATH,
+            invoice_pdf_filepath,
             "application/pdf",
             "application/pdf",
             INVOICE_DOC_SAVE_DIR_IDS,
@@ -623,28 +818,27 @@ class MainTask(BaseTask):
         )
 
         # 請求書のGoogleスプレッドシートとPDFのURLを請求書管理表に記録
-        _ = googleapi.update_sheet(
+        # 請求書管理表の番号を確保した行のB列から追加する 例: "請求書管理!B2:D2"
+        _ = googleapi.batch_update_sheet(
             gsheet_service,
             INVOICE_FILE_LIST_GSHEET_ID,
-            # 請求書管理表の番号のセルアドレスを元にB列から追加する
-            updated_invoice_manage_gsheet.get("updates")
-            .get("updatedRange")
-            .replace("A", "B"),
-            [
-                [
-                    INVOICE_PDFFILEPATH.stem,
-                    f"http://docs.google.com/spreadsheets/d/{invoice_file_id}",
-                    f"http://drive.google.com/file/d/{upload_pdf_result.get('id')}",
+            {
+                f"請求書管理!B{invoice_manage_row}:D{invoice_manage_row}": [
+                    [
+                        invoice_pdf_filepath.stem,
+                        f"http://docs.google.com/spreadsheets/d/{invoice_file_id}",
+                        f"http://drive.google.com/file/d/{upload_pdf_result.get('id')}",
+                    ]
                 ]
-            ],
+            },
         )
 
         print("一覧と請求書生成しました")
         print(
-            f"一覧xlsxファイルパス:{INVOICE_LIST_EXCELPATH}\n請求書pdf:{INVOICE_PDFFILEPATH}"
+            f"一覧xlsxファイルパス:{invoice_list_excelpath}\n請求書pdf:{invoice_pdf_filepath}"
         )
 
-        return set_draft_mail([INVOICE_LIST_EXCELPATH, INVOICE_PDFFILEPATH])
+        return set_draft_mail([invoice_list_excelpath, invoice_pdf_filepath])
 
     # チャット用のタスクメソッド
     def execute_task_by_chat(
@@ -662,4 +856,6 @@ class MainTask(BaseTask):
             ],
         )
         # send_message_body.update({"actionResponse": {"type": "NEW_MESSAGE"}})
-        return googleapi.create_chat_message(chat_service, spacename, send_message_body)
+        return googleapi.create_chat_message(
+            googleapi.get_service("chat"), spacename, send_message_body
+        )
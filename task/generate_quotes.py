@@ -1,12 +1,13 @@
 import itertools
 import json
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
 from datetime import datetime
 from pathlib import Path
+
 # from pprint import pprint
 
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
 import chat.card
@@ -14,6 +15,8 @@ from api import googleapi
 from api.googleapi import sheet_data_mapper
 
 from helper import EXPORTDIR_PATH, chatcard, load_config
+from helper.calcsheet_cache import CalcSheetCache
+from helper.quote_index import VOID_QUOTE_FILENAME_PREFIX, QuoteIndex, QuoteIndexItem
 from itemparser import (
     EstimateCalcSheetInfo,
     MsmAnkenMap,
@@ -55,26 +58,20 @@ QUOTE_GSHEET_SAVE_DIR_IDS = SCRIPT_CONFIG.get("QUOTE_GSHEET_SAVE_DIR_IDS")
 QUOTE_PDF_SAVE_DIR_IDS = SCRIPT_CONFIG.get("QUOTE_PDF_SAVE_DIR_IDS")
 
 # 定数から全体に使う変数を作成
+# 保存先フォルダはワーカーで実行するたびに作る（MainTask）
 export_quote_dirpath = EXPORTDIR_PATH / "quote"
-export_quote_dirpath.mkdir(parents=True, exist_ok=True)
 with open(QUOTE_TEMPLATE_CELL_MAPPING_JSON_PATH, "r", encoding="utf-8") as f:
     quote_template_cell_mapping_dict = json.load(f)
 
+# 見積書管理表に番号を確保するときに追加する行。A列の数式が見積書番号になる
+QUOTE_NUMBER_ROW = ['=TEXT(ROW()-1,"0000")', "", "", ""]
+
 # TODO:2023-09-14 これは使っている部分へ戻す。これ以外で使っていないので、ここで定義する必要はない
 # 2020-01-01 のフォーマットのみ受け付ける
 START_DATE_FORMAT = "%Y-%m-%d"
 
 # API Session
-# TODO:2023-09-19 ここはtry exceptで囲む
-# Googleのtokenを用意
-google_cred = googleapi.get_cledential(googleapi.API_SCOPES)
-gdrive_service = build("drive", "v3", credentials=google_cred)
-gmail_service = build("gmail", "v1", credentials=google_cred)
-gsheet_service = build("sheets", "v4", credentials=google_cred)
-
-# チャット用の認証情報を取得
-google_sa_cred = googleapi.get_cledential_by_serviceaccount(googleapi.CHAT_API_SCOPES)
-chat_service = build("chat", "v1", credentials=google_sa_cred)
+# Google APIのサービスは使う時にgoogleapi.get_serviceで取得する（プロセス内で使い回される）
 
 spacename = config.get("google").get("CHAT_SPACENAME")
 bot_header = chatcard.bot_header
@@ -150,24 +147,155 @@ class AnkenQuote(EstimateCalcSheetInfo):
         }
 
 
+def fetch_estimate_calcsheet_data_list(
+    gsheet_service, spreadsheet_ids: list[str]
+) -> list[dict]:
+    """
+    複数の見積もり計算表のシート情報を並列に取得する
+    1回目でファイル名とシート名を全件分、2回目でシート名に合わせた価格と納期の値を全件分取得するので、件数が増えても往復は2回で済む
+    同時実行数とリトライはgoogleapi.execute_requests_concurrentlyに従う。
+
+    Args:
+        gsheet_service: sheetのservice
+        spreadsheet_ids (list[str]): 見積もり計算表のIDのリスト
+    return:
+        list[dict]: EstimateCalcSheetInfo.fetch_calcsheet_dataと同じ形のリスト。順番はspreadsheet_idsと同じ
+    """
+    credentials = googleapi.get_credentials()
+    metadata_list = googleapi.execute_requests_concurrently(
+        credentials,
+        [
+            AnkenQuote.build_metadata_request(gsheet_service, spreadsheet_id)
+            for spreadsheet_id in spreadsheet_ids
+        ],
+    )
+    values_results = googleapi.execute_requests_concurrently(
+        credentials,
+        [
+            AnkenQuote.build_values_request(gsheet_service, spreadsheet_id, metadata)
+            for spreadsheet_id, metadata in zip(
+                spreadsheet_ids, metadata_list, strict=True
+            )
+        ],
+    )
+    return [
+        {"metadata": metadata, "value_ranges": values_result.get("valueRanges")}
+        for metadata, values_result in zip(metadata_list, values_results, strict=True)
+    ]
+
+
+def fetch_calcsheet_modified_times(
+    gdrive_service, spreadsheet_ids: list[str]
+) -> dict[str, str]:
+    """
+    見積もり計算表の現在のmodifiedTimeを、Drive APIのバッチリクエストでまとめて取得する
+
+    Args:
+        gdrive_service: Drive APIのサービス
+        spreadsheet_ids: 見積もり計算表のスプレッドシートIDのリスト
+    return:
+        {スプレッドシートID: modifiedTime}。取得に失敗したものは含まない
+    """
+    batch = googleapi.BatchRequestQueue(gdrive_service)
+    for spreadsheet_id in spreadsheet_ids:
+        batch.add(
+            gdrive_service.files().get(fileId=spreadsheet_id, fields="modifiedTime"),
+            retry=True,
+        )
+
+    modified_times = {}
+    for spreadsheet_id, result in zip(spreadsheet_ids, batch.flush(), strict=True):
+        if isinstance(result, Exception):
+            print(f"modifiedTimeの取得に失敗しました: {spreadsheet_id} {result}")
+            continue
+        modified_times[spreadsheet_id] = result.get("modifiedTime")
+    return modified_times
+
+
 def generate_anken_quote_list(estimate_calcsheets: list[dict]) -> list[AnkenQuote]:
     """
     ミスミの配管計算表を元に見積もりを作成するためのAnkenQuoteのリストを作成する
+    実行時点のmodifiedTimeを取得し、一致するシート情報はCalcSheetCacheから使い、ないものだけfetch_estimate_calcsheet_data_listでまとめて取得する
 
     Args:
-        estimate_calcsheets (list[dict]): ミスミの配管計算表の情報
+        estimate_calcsheets (list[dict]): ミスミの配管計算表の情報（PrepareTaskの戻り値の要素）
     return:
         list[AnkenQuote]: 見積もりを作成するためのAnkenQuoteのリスト
     """
+    gsheet_service = googleapi.get_service("sheets")
+    calcsheet_cache = CalcSheetCache()
+    # 設定カードを作った後にシートが編集されることがあるので、modifiedTimeは実行時に取得し直す
+    # 取得できなかったものはキャッシュを使わずに取得し、キャッシュにも追加しない
+    modified_times = fetch_calcsheet_modified_times(
+        googleapi.get_service("drive"),
+        [estimate_calcsheet.get("id") for estimate_calcsheet in estimate_calcsheets],
+    )
+    calcsheet_data_by_id = calcsheet_cache.find_calcsheet_data(modified_times)
+    uncached_ids = [
+        estimate_calcsheet.get("id")
+        for estimate_calcsheet in estimate_calcsheets
+        if estimate_calcsheet.get("id") not in calcsheet_data_by_id
+    ]
+    print(
+        f"見積もり計算表: キャッシュ{len(calcsheet_data_by_id)}件, 取得{len(uncached_ids)}件"
+    )
+
+    if uncached_ids:
+        try:
+            fetched_data_list = fetch_estimate_calcsheet_data_list(
+                gsheet_service, uncached_ids
+            )
+        except HttpError as error:
+            sys.exit(f"見積もり計算表の読み込み中にエラーが発生しました: {error}")
+        fetched_data_by_id = dict(zip(uncached_ids, fetched_data_list, strict=True))
+        calcsheet_cache.upsert_calcsheet_data(
+            [
+                (spreadsheet_id, modified_times[spreadsheet_id], calcsheet_data)
+                for spreadsheet_id, calcsheet_data in fetched_data_by_id.items()
+                if spreadsheet_id in modified_times
+            ]
+        )
+        calcsheet_data_by_id |= fetched_data_by_id
+
     anken_quotes: list[AnkenQuote] = []
     for estimate_calcsheet in estimate_calcsheets:
-        anken_quote = AnkenQuote(gsheet_service, estimate_calcsheet.get("id"))
+        anken_quote = AnkenQuote(
+            gsheet_service,
+            estimate_calcsheet.get("id"),
+            calcsheet_data_by_id[estimate_calcsheet.get("id")],
+        )
         anken_quote.calcsheet_parents = estimate_calcsheet.get("parents")
         # itemをリストアップ
         anken_quotes.append(anken_quote)
     return anken_quotes
 
 
+def convert_quote_gsheet_data_to_index_item(
+    quote_gsheet_data: dict, quote_file_id: str, row_number: int
+) -> QuoteIndexItem:
+    """
+    見積書に書き込んだ内容から、見積書インデックス用のデータを作る
+    Args:
+        quote_gsheet_data (dict): 見積書に書き込んだデータ（AnkenQuote.quote_gsheet_data）
+        quote_file_id (str): 見積書のスプレッドシートID
+        row_number (int): 見積書管理表の行番号
+    return:
+        QuoteIndexItem: 見積書インデックス用のデータ
+    """
+    hinmoku = quote_gsheet_data["item_table"][0]
+    return QuoteIndexItem(
+        spreadsheet_id=quote_file_id,
+        row_number=row_number,
+        quote_id=quote_gsheet_data["quote_id"],
+        quote_date=datetime.strptime(
+            quote_gsheet_data["quote_date"], START_DATE_FORMAT
+        ).date(),
+        hinmoku_name=hinmoku["name"],
+        hinmoku_detail=hinmoku["detail"],
+        hinmoku_price=str(hinmoku["price"]),
+    )
+
+
 def update_msm_anken_schedule_sheet(
     anken_quote: AnkenQuote, gsheet_service
 ) -> list[dict]:
@@ -198,9 +326,148 @@ def update_msm_anken_schedule_sheet(
     return update_schedule_sheet(update_data, gsheet_service)
 
 
+@dataclass
+class CreatedQuoteDocument:
+    """
+    create_quote_documentで作成した見積書の情報
+    """
+
+    # 見積書インデックス用のデータ
+    index_item: QuoteIndexItem
+    # 見積書管理表のB列からE列に記録する値
+    quote_manage_values: list[str]
+    # ダウンロードした見積書PDFのパス
+    quote_pdf_path: Path
+
+
+@dataclass
+class QuoteCreationResult:
+    """
+    MainTaskでの見積書1件分の作成結果
+    番号の確保と複製は全件分をまとめて先に行うので、失敗した場合に後始末するための情報も持つ
+    """
+
+    anken_quote: AnkenQuote
+    # 確保した見積書管理表の行番号
+    quote_manage_row: int
+    # テンプレートから複製した見積書のスプレッドシートID。複製に失敗した場合はNone
+    quote_file_id: str | None = None
+    # create_quote_documentの戻り値。作成に失敗した場合はNone
+    created_document: CreatedQuoteDocument | None = None
+    error: Exception | None = None
+
+
+def generate_quote_filestem(anken_quote: AnkenQuote) -> str:
+    """見積書のファイル名（拡張子なし）。スプレッドシートとPDFで同じ名前にする"""
+    return f"見積書_{anken_quote.anken_number}"
+
+
+def create_quote_document(
+    quote_gsheet_data: dict,
+    quote_filestem: str,
+    quote_manage_row: int,
+    quote_file_id: str,
+) -> CreatedQuoteDocument:
+    """
+    見積書のスプレッドシートとPDFを作成する
+    見積書ごとに独立した処理なので、スレッドから並列に呼び出せる。サービスは呼び出したスレッドのものを使う
+    AnkenQuoteはスレッド間で共有しないように、書き込む値だけを受け取り、作成した情報は戻り値で返す
+    見積書管理表への記録と見積計算表の移動は、全件分をまとめて行うので、ここでは記録する値を返す
+    Args:
+        quote_gsheet_data (dict): 見積書に書き込むデータ（AnkenQuote.quote_gsheet_data）
+        quote_filestem (str): 見積書のファイル名（拡張子なし）
+        quote_manage_row (int): 見積書番号を確保した見積書管理表の行番号
+        quote_file_id (str): 見積書テンプレートから複製した見積書のスプレッドシートID
+    return:
+        CreatedQuoteDocument: 作成した見積書の情報
+    """
+    gdrive_service = googleapi.get_service("drive")
+    gsheet_service = googleapi.get_service("sheets")
+
+    # 見積書へ見積もり情報を記録
+    sheet_data_mapper.write_data_to_sheet(
+        gsheet_service,
+        quote_file_id,
+        quote_gsheet_data,
+        quote_template_cell_mapping_dict,
+    )
+
+    # ファイル名:見積書_[納期].pdf
+    quote_filename = f"{quote_filestem}.pdf"
+    quote_pdf_path = export_quote_dirpath / quote_filename
+
+    # 見積書のPDFをダウンロード
+    googleapi.export_pdf_by_driveexporturl(
+        googleapi.get_credentials().token,
+        quote_file_id,
+        quote_pdf_path,
+        {
+            "gid": "0",
+            "size": "7",
+            "portrait": "true",
+            "fitw": "true",
+            "gridlines": "false",
+        },
+    )
+
+    # 見積書のPDFをGoogleドライブへ保存
+    upload_pdf_result = googleapi.upload_file(
+        gdrive_service,
+        quote_pdf_path,
+        "application/pdf",
+        "application/pdf",
+        QUOTE_PDF_SAVE_DIR_IDS,
+    )
+
+    print(f"見積書のPDFをダウンロードしました。保存先:{quote_pdf_path}")
+
+    # 見積書のGoogleスプレッドシートとPDFのURLを見積管理表に記録する値
+    # B列から[ファイル名, 見積書:Gsheet のIDからURL, 見積書:GDrive PDFのIDからURL, 見積日]
+    # 見積日（E列）は請求書作成時に日付範囲で見積書を探すために使う。RAWで書くので、YYYY-MM-DDの文字列で記録される
+    quote_manage_values = [
+        quote_filename,
+        f"http://docs.google.com/spreadsheets/d/{quote_file_id}",
+        f"http://drive.google.com/file/d/{upload_pdf_result.get('id')}",
+        quote_gsheet_data["quote_date"],
+    ]
+
+    return CreatedQuoteDocument(
+        convert_quote_gsheet_data_to_index_item(
+            quote_gsheet_data, quote_file_id, quote_manage_row
+        ),
+        quote_manage_values,
+        quote_pdf_path,
+    )
+
+
+def generate_main_task_report(
+    creation_results: list[QuoteCreationResult],
+    errors: list[tuple[str, Exception]],
+) -> dict:
+    """
+    MainTaskで失敗があった場合の結果を作る。
+    番号の確保や複製など取り消せない処理の後なので、終了せずに、作成できたものと失敗したものを返す
+    Args:
+        creation_results (list[QuoteCreationResult]): 見積書ごとの作成結果
+        errors (list[tuple[str, Exception]]): (対象, エラー)のリスト
+    return:
+        dict: {"result": メッセージ, "created_quotes": 作成できた案件番号のリスト, "errors": エラーの文字列のリスト}
+    """
+    return {
+        "result": "見積書生成中にエラーが発生しました。メールの下書きは作成していません。",
+        "created_quotes": [
+            creation_result.anken_quote.anken_number
+            for creation_result in creation_results
+            if creation_result.created_document
+        ],
+        "errors": [f"{error_target}: {error!r}" for error_target, error in errors],
+    }
+
+
 class PrepareTask(BaseTask):
     def execute_task(self):
         # TODO:2023-09-28 [prepare start]
+        gdrive_service = googleapi.get_service("drive")
 
         # google sheetのリストを取得
         # - 特定のフォルダ（GSheet的にはグループ）の一覧を取得
@@ -266,16 +533,25 @@ class PrepareTask(BaseTask):
                         chat.card.gencomponent_button(
                             "タスク実行", "run_task__generate_quotes"
                         ),
-                        chat.card.gencomponent_button("キャンセル", "cancel_task"),
+                        chat.card.gencomponent_button(
+                            "キャンセル", "cancel_task__generate_quotes"
+                        ),
                     ]
                 ),
             ],
         )
-        return googleapi.create_chat_message(chat_service, spacename, config_body)
+        return googleapi.create_chat_message(
+            googleapi.get_service("chat"), spacename, config_body
+        )
 
 
 class MainTask(BaseTask):
     def execute_task(self, process_data: ProcessData | None = None):
+        gmail_service = googleapi.get_service("gmail")
+        gsheet_service = googleapi.get_service("sheets")
+        gdrive_service = googleapi.get_service("drive")
+        # 前回のジョブの後に削除されていても保存できるように、実行のたびに保存先を作る
+        export_quote_dirpath.mkdir(parents=True, exist_ok=True)
         # 渡されたデータを展開する
         selected_estimate_calcsheets = process_data["task_data"].get(
             "selected_estimate_calcsheets"
@@ -286,123 +562,182 @@ class MainTask(BaseTask):
             selected_estimate_calcsheets
         )
 
-        # MFクラウドで見積書作成
-        for anken_quote in anken_quotes:
-            try:
-                # [見積書作成を行う]
-                # 見積書管理表から番号を生成
-                updated_quote_manage_gsheet = googleapi.append_sheet(
-                    gsheet_service,
-                    QUOTE_FILE_LIST_GSHEET_ID,
-                    "見積書管理",
-                    [['=TEXT(ROW()-1,"0000")', "", "", ""]],
-                    "USER_ENTERED",
-                    "INSERT_ROWS",
-                    True,
-                )
-                print(
-                    f"見積書の管理表に番号を生成しました。: {updated_quote_manage_gsheet}"
-                )
-                # 見積書番号を取得
-                quote_id = (
-                    updated_quote_manage_gsheet.get("updates")
-                    .get("updatedData")
-                    .get("values")[0][0]
-                )
-                print(f"見積書の管理表から番号を生成しました。: {quote_id}")
-
-                # 見積書の情報を生成
-                anken_quote.convert_dict_to_gsheet_tamplate(quote_id)
-
-                # googleスプレッドシートの見積書テンプレートを複製する
-                quote_file_id = googleapi.dupulicate_file(
-                    gdrive_service,
-                    QUOTE_TEMPLATE_GSHEET_ID,
-                    quote_filestem := f"見積書_{anken_quote.anken_number}",
+        # [見積書作成を行う]
+        # 1. 見積書番号の確保: 見積書管理表に全件分の行を1回で追加して、連番を確保する
+        try:
+            quote_numbers = googleapi.reserve_numbered_rows(
+                gsheet_service,
+                QUOTE_FILE_LIST_GSHEET_ID,
+                "見積書管理",
+                len(anken_quotes),
+                QUOTE_NUMBER_ROW,
+            )
+        except HttpError as error:
+            # 番号を確保できていなければ、まだ何も作成していない
+            return generate_main_task_report([], [("見積書番号の確保", error)])
+        print(f"見積書の管理表から番号を生成しました。: {quote_numbers}")
+
+        # 2. 見積書テンプレートの複製: ファイル名と保存先を指定して、全件分を1回のバッチリクエストで複製する
+        duplicated_results = googleapi.dupulicate_files(
+            gdrive_service,
+            QUOTE_TEMPLATE_GSHEET_ID,
+            [
+                googleapi.generate_copy_body(
+                    generate_quote_filestem(anken_quote),
+                    QUOTE_GSHEET_SAVE_DIR_IDS,
+                    {"quote_id": quote_id},
                 )
-
-                # 見積書のファイル名と保存先を設定
-                _ = googleapi.update_file(
-                    gdrive_service,
-                    file_id=quote_file_id,
-                    body=None,
-                    add_parents=QUOTE_GSHEET_SAVE_DIR_IDS,
-                    fields="id, parents",
+                for anken_quote, (quote_id, _) in zip(
+                    anken_quotes, quote_numbers, strict=True
                 )
+            ],
+        )
 
-                # 見積書へanken_quoteの内容を記録
-                sheet_data_mapper.write_data_to_sheet(
-                    gsheet_service,
-                    quote_file_id,
+        # 3. 見積書の作成: 見積書ごとに独立しているので、同時実行数を制限して並列に行う
+        # サービスはスレッドごとにgoogleapi.get_serviceで作られる
+        creation_results: list[QuoteCreationResult] = []
+        with ThreadPoolExecutor(
+            max_workers=googleapi.CONCURRENT_MAX_WORKERS
+        ) as executor:
+            futures = []
+            for anken_quote, (quote_id, quote_manage_row), duplicated in zip(
+                anken_quotes, quote_numbers, duplicated_results, strict=True
+            ):
+                creation_result = QuoteCreationResult(anken_quote, quote_manage_row)
+                creation_results.append(creation_result)
+                # 複製に失敗した見積書は作成しない
+                if isinstance(duplicated, Exception):
+                    creation_result.error = duplicated
+                    continue
+                creation_result.quote_file_id = duplicated["id"]
+                # 見積書の情報はここ（メインスレッド）で生成し、スレッドには書き込む値だけを渡す
+                try:
+                    anken_quote.convert_dict_to_gsheet_tamplate(quote_id)
+                except Exception as error:
+                    creation_result.error = error
+                    continue
+                future = executor.submit(
+                    create_quote_document,
                     anken_quote.quote_gsheet_data,
-                    quote_template_cell_mapping_dict,
+                    generate_quote_filestem(anken_quote),
+                    quote_manage_row,
+                    duplicated["id"],
                 )
+                futures.append((creation_result, future))
+        for creation_result, future in futures:
+            # PDFのエクスポート（requests）など、HttpError以外の例外も1件ごとに受け止めて、他の見積書の記録を続ける
+            try:
+                creation_result.created_document = future.result()
+            except Exception as error:
+                creation_result.error = error
+                continue
+            creation_result.anken_quote.quote_pdf_path = (
+                creation_result.created_document.quote_pdf_path
+            )
 
-                # ファイル名:見積書_[納期].pdf
-                quote_filename = f"{quote_filestem}.pdf"
-                anken_quote.quote_pdf_path = export_quote_dirpath / quote_filename
-
-                # 見積書のPDFをダウンロード
-                googleapi.export_pdf_by_driveexporturl(
-                    google_cred.token,
-                    quote_file_id,
-                    anken_quote.quote_pdf_path,
-                    {
-                        "gid": "0",
-                        "size": "7",
-                        "portrait": "true",
-                        "fitw": "true",
-                        "gridlines": "false",
-                    },
+        # 4. 作成できた見積書の後処理は順番に行う。失敗したものがあっても、作成できたものは必ず記録する
+        created_results = [
+            creation_result
+            for creation_result in creation_results
+            if creation_result.created_document
+        ]
+        failed_results = [
+            creation_result
+            for creation_result in creation_results
+            if not creation_result.created_document
+        ]
+        # 報告するエラー: (案件番号, エラー)
+        errors: list[tuple[str, Exception]] = [
+            (creation_result.anken_quote.anken_number, creation_result.error)
+            for creation_result in failed_results
+        ]
+
+        # 見積書管理表の確保した行へ、全件分をまとめて記録する
+        # 例: 行番号 = 2 -> "見積書管理!B2:E2"
+        # 作成できなかった行は、B列に作成失敗の印を付けて、番号だけ確保された行だとわかるようにする
+        quote_manage_range_values = {
+            f"見積書管理!B{creation_result.quote_manage_row}:E{creation_result.quote_manage_row}": [
+                creation_result.created_document.quote_manage_values
+            ]
+            for creation_result in created_results
+        } | {
+            f"見積書管理!B{creation_result.quote_manage_row}": [
+                [
+                    f"{VOID_QUOTE_FILENAME_PREFIX}{creation_result.anken_quote.anken_number}"
+                ]
+            ]
+            for creation_result in failed_results
+        }
+        try:
+            googleapi.batch_update_sheet(
+                gsheet_service, QUOTE_FILE_LIST_GSHEET_ID, quote_manage_range_values
+            )
+        except HttpError as error:
+            errors.append(("見積書管理表", error))
+        # 請求書作成時に見積書を再取得しなくて済むように、インデックスへ記録する
+        QuoteIndex().upsert_quotes(
+            [
+                creation_result.created_document.index_item
+                for creation_result in created_results
+            ]
+        )
+        for creation_result in created_results:
+            # スケジュール表の該当行に価格や納期を追加する
+            try:
+                update_msm_anken_schedule_sheet(
+                    creation_result.anken_quote, gsheet_service
                 )
-
-                # 見積書のPDFをGoogleドライブへ保存
-                upload_pdf_result = googleapi.upload_file(
-                    gdrive_service,
-                    anken_quote.quote_pdf_path,
-                    "application/pdf",
-                    "application/pdf",
-                    QUOTE_PDF_SAVE_DIR_IDS,
+            except Exception as error:
+                errors.append((creation_result.anken_quote.anken_number, error))
+
+        # 作成できなかった見積書の複製は、使われないので削除する
+        cleanup_batch = googleapi.BatchRequestQueue(gdrive_service)
+        cleanup_results = [
+            creation_result
+            for creation_result in failed_results
+            if creation_result.quote_file_id
+        ]
+        for creation_result in cleanup_results:
+            cleanup_batch.add(
+                gdrive_service.files().delete(fileId=creation_result.quote_file_id)
+            )
+        for creation_result, cleanup_result in zip(
+            cleanup_results, cleanup_batch.flush(), strict=True
+        ):
+            if isinstance(cleanup_result, Exception):
+                errors.append(
+                    (
+                        f"{creation_result.anken_quote.anken_number}の複製の削除",
+                        cleanup_result,
+                    )
                 )
 
-                # 見積書のGoogleスプレッドシートとPDFのURLを見積管理表に記録
-
-                # 見積管理表を更新する。B列から[ファイル名, 見積書:Gsheet のIDからURL, 見積書:GDrive PDFのIDからURL]
-                # 見積管理表に番号を追加したupdatedRows（updated_quote_manage_cell_address）を使うがB列以降を使う
-                # 生成した見積番号のセルアドレスからB列に置き換えて取得。AのみをBにする
-                # 例: updated_quote_manage_cell_address = "見積書管理!A2:D2" -> "見積書管理!B2:D2"
-                _ = googleapi.update_sheet(
-                    gsheet_service,
-                    QUOTE_FILE_LIST_GSHEET_ID,
-                    updated_quote_manage_gsheet.get("updates")
-                    .get("updatedRange")
-                    .replace("A", "B"),
-                    [
-                        [
-                            quote_filename,
-                            f"http://docs.google.com/spreadsheets/d/{quote_file_id}",
-                            f"http://drive.google.com/file/d/{upload_pdf_result.get('id')}",
-                        ]
-                    ],
-                )
-                # TODO:2024-02-06 ここのestimate_pdf_pathは変数名が微妙なので、quote_pdf_pathとして変更する。影響範囲を確認すること
-                print(
-                    f"見積書のPDFをダウンロードしました。保存先:{anken_quote.quote_pdf_path}"
-                )
-                # 見積書生成後、今回選択した見積計算書スプレッドシートは生成済みフォルダへ移動する
-                _ = googleapi.update_file(
+        # 見積書生成後、今回選択した見積計算書スプレッドシートは生成済みフォルダへまとめて移動する
+        archive_batch = googleapi.BatchRequestQueue(gdrive_service)
+        for creation_result in created_results:
+            anken_quote = creation_result.anken_quote
+            archive_batch.add(
+                googleapi.build_update_file_request(
                     gdrive_service,
-                    file_id=anken_quote.calcsheet_source,
+                    anken_quote.calcsheet_source,
+                    fields="id",
                     add_parents=ARCHIVED_ESTIMATECALCSHEET_DIR_IDS,
                     remove_parents=anken_quote.calcsheet_parents,
-                    fields="id",
+                ),
+                # 親フォルダの付け替えは、何度送っても同じ結果になるので送り直してよい
+                retry=True,
+            )
+        for creation_result, archive_result in zip(
+            created_results, archive_batch.flush(), strict=True
+        ):
+            if isinstance(archive_result, Exception):
+                errors.append(
+                    (creation_result.anken_quote.anken_number, archive_result)
                 )
 
-            except HttpError as error:
-                sys.exit(f"見積書生成中にエラーが発生しました: {error}")
-
-            # スケジュール表の該当行に価格や納期を追加する
-            update_msm_anken_schedule_sheet(anken_quote, gsheet_service)
+        # 1件でも失敗していれば、これまでと同じくメール下書きは作らずに、失敗したものをまとめて返す
+        if errors:
+            return generate_main_task_report(creation_results, errors)
 
         # TODO:2023-09-28 下書き生成は、上の見積書が生成できたら実行するタスクになる。
         # TODO: 2024-02-06 以前に複数の案件ベース番号があった時に、二番めのメールが作成できなかったことがあるので検証する
@@ -411,9 +746,9 @@ class MainTask(BaseTask):
         quote_groups = itertools.groupby(anken_quotes, lambda x: x.anken_base_number)
 
         for group_key, quote_iter in quote_groups:
-            # メールのスレッドを取得して、スレッドに返信する
+            # メールのスレッドを取得して、スレッドに返信する。使うのは一番上のスレッドだけ
             threads = googleapi.search_threads(
-                gmail_service, f"label:snd-ミスミ (*{group_key}*)"
+                gmail_service, f"label:snd-ミスミ (*{group_key}*)", max_results=1
             )
             # スレッドが見つからない場合は終了
             if not threads:
@@ -425,8 +760,12 @@ class MainTask(BaseTask):
             # TODO:2023-04-18 ここは複数スレッドがあった場合は選択制にする。
             # 出ない場合は一番上のものを使いますと、タイトルを出して確認させる。
             # メッセージが大抵一つだが、一番上を取り出す（一番上が最新のはず）
+            # 返信にはメッセージIDだけ使うので、本文は取得しない
             message = googleapi.get_messages_by_threadid(
-                gmail_service, threads[0].get("id", "")
+                gmail_service,
+                threads[0].get("id", ""),
+                format_="minimal",
+                fields="messages/id",
             )[0]
 
             # メールの必要な情報を生成する
@@ -453,14 +792,25 @@ class MainTask(BaseTask):
     def execute_task_by_chat(self, process_data: ProcessData | None = None):
         result = self.execute_task(process_data)
         # チャット用のメッセージを作成する
+        # 失敗があった場合やスレッドがなかった場合は、resultのメッセージを表示する
+        if result.get("errors"):
+            result_text = "\n".join(
+                [
+                    result["result"],
+                    f"作成できた見積書: {result['created_quotes']}",
+                    *result["errors"],
+                ]
+            )
+        elif "result" in result:
+            result_text = result["result"]
+        else:
+            result_text = f"見積書を作成しました。: {result.get('id')}"
         send_message_body = chat.card.create_card(
             "result_card__generate_quote",
             header=bot_header,
-            widgets=[
-                chat.card.genwidget_textparagraph(
-                    f"見積書を作成しました。: {result.get('id')}"
-                ),
-            ],
+            widgets=[chat.card.genwidget_textparagraph(result_text)],
         )
         # send_message_body.update({"actionResponse": {"type": "NEW_MESSAGE"}})
-        return googleapi.create_chat_message(chat_service, spacename, send_message_body)
+        return googleapi.create_chat_message(
+            googleapi.get_service("chat"), spacename, send_message_body
+        )
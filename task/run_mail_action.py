@@ -5,11 +5,8 @@ from datetime import datetime
 from pathlib import Path
 
 import copier
-import openpyxl
 from bs4 import BeautifulSoup
 from dateutil.relativedelta import relativedelta
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 from jinja2 import Environment, FileSystemLoader
 
@@ -19,25 +16,20 @@ from helper import (
     EXPORTDIR_PATH,
     ROOTDIR,
     chatcard,
-    decode_base64url,
     extract_compressfile,
     load_config,
 )
+from helper.attachment_cache import ATTACHMENT_CACHE_MAX_BYTES, AttachmentCache
+from helper.excel_reader import read_excel_cells
 from helper.regexpatterns import MSM_ANKEN_NUMBER
-from itemparser import ExpandedMessageItem
+from itemparser import ExpandedMessageItem, RenrakukoumokuInfo
 from task import BaseTask, ProcessData
 
-# # generate Path
-# parent_dirpath = Path(__file__).parents[0]
-exportfiles_dirpath = (
-    EXPORTDIR_PATH
-    / "export_files"
-    / f"export_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-)
-attachment_dirpath = exportfiles_dirpath / "attachments"
-
 GOOGLE_API_SCOPES = googleapi.API_SCOPES
 
+# メール選択で表示する候補のスレッド数
+PREPARE_THREADS_COUNT = 10
+
 # load config
 config = load_config.CONFIG
 
@@ -57,25 +49,36 @@ copy_project_dir_dest_path = Path(
     config.get("run_mail_action").get("COPY_PROJECT_DIR_DEST_PATH")
 )
 nyukin_standard_day = config.get("run_mail_action").get("NYUKIN_STANDARD_DAY")
+# 添付ファイルキャッシュの上限サイズ（MB）
+attachment_cache_max_mb = config.get("run_mail_action").get(
+    "ATTACHMENT_CACHE_MAX_MB", ATTACHMENT_CACHE_MAX_BYTES // (1024 * 1024)
+)
 
 # google api service
+# サービスは使う時にgoogleapi.get_serviceで取得する（プロセス内で使い回される）
 target_userid = config.get("google").get("GMAIL_USER_ID")
-google_cred: Credentials = googleapi.get_cledential(GOOGLE_API_SCOPES)
-drive_service = build("drive", "v3", credentials=google_cred)
-sheet_service = build("sheets", "v4", credentials=google_cred)
-gmail_service = build("gmail", "v1", credentials=google_cred)
-
-# チャット用の認証情報を取得
-google_sa_cred = googleapi.get_cledential_by_serviceaccount(googleapi.CHAT_API_SCOPES)
-chat_service = build("chat", "v1", credentials=google_sa_cred)
 
 spacename = config.get("google").get("CHAT_SPACENAME")
 bot_header = chatcard.bot_header
 
 
-def generate_dirs() -> None:
+def generate_dirs() -> tuple[Path, Path]:
+    """
+    実行ごとの出力先フォルダを作成する
+    ワーカーはモジュールを読み込んだまま複数のジョブを実行するので、フォルダ名の日時は実行時に決める
+
+    return:
+        (出力先フォルダのパス, 添付ファイル保存先のパス)
+    """
+    exportfiles_dirpath = (
+        EXPORTDIR_PATH
+        / "export_files"
+        / f"export_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    )
+    attachment_dirpath = exportfiles_dirpath / "attachments"
     exportfiles_dirpath.mkdir(exist_ok=True, parents=True)
     attachment_dirpath.mkdir(exist_ok=True)
+    return exportfiles_dirpath, attachment_dirpath
 
 
 def generate_mail_printhtml(
@@ -83,19 +86,12 @@ def generate_mail_printhtml(
 ) -> None:
     # メール印刷用HTML生成
 
-    # TODO:2023-04-07 この部分はExpandMessageItemへ移動する。今後の課題
-
-    # mimetypeがplaneかhtmlで分ける
-    messages_text_parts = next(
-        (i for i in messageitem.body_parts if "text/html" in i.get("mimeType")), None
-    )
-    if not messages_text_parts:
-        messages_text_parts = next(
-            (i for i in messageitem.body_parts if "text/plain" in i.get("mimeType"))
-        )
+    # mimetypeがplaneかhtmlで分ける。htmlがあればhtmlを使う
+    # 本文のデコードはExpandedMessageItemのパートで1回だけ行われる
+    messages_text_part = messageitem.html_part or messageitem.text_part
 
     mail_body = ""
-    b64decoded_mail_body = decode_base64url(messages_text_parts.get("body").get("data"))
+    b64decoded_mail_body = messages_text_part.decode_body()
 
     mail_html_bs4 = BeautifulSoup(b64decoded_mail_body, "html.parser")
 
@@ -134,6 +130,7 @@ def generate_pdf_by_renrakukoumoku_excel(
     attachment_dirpath: Path,
 ) -> None:
     # 連絡項目の印刷用PDFファイル生成
+    drive_service = googleapi.get_service("drive")
     target_filepath = next(attachment_dirpath.glob("*MA-*.xlsx"))
     if not target_filepath:
         print("cant generate_pdf_byrenrakuexcel")
@@ -154,6 +151,7 @@ def generate_pdf_by_renrakukoumoku_excel(
             upload_results.get("id"),
             "application/pdf",
             attachment_dirpath / Path("./連絡項目印刷用ファイル.pdf"),
+            progress_callback=googleapi.print_download_progress,
         )
 
         # post-porcess: Googleドキュメントに一時保持した配管連絡項目を除去する
@@ -262,6 +260,7 @@ def add_schedule_spreadsheet(
     return:
         None
     """
+    sheet_service = googleapi.get_service("sheets")
     target_filepath = next(attachment_dirpath.glob("*MA-*.xlsx"))
     if not target_filepath:
         print("cant add schedule")
@@ -274,12 +273,10 @@ def add_schedule_spreadsheet(
     # 顧客
     renrakukoumoku_range_kokyaku = "D6"
 
-    # openpyxlで必要な位置から値を取り出す
-    renrakukoumoku_wb = openpyxl.load_workbook(target_filepath)
-    renrakukoumoku_ws = renrakukoumoku_wb.active
-    add_schedule_kokyaku = renrakukoumoku_ws[renrakukoumoku_range_kokyaku].value
-
-    renrakukoumoku_wb.close()
+    # 必要な位置の値だけを読み込む。RenrakukoumokuInfoと同じセルを指定して、読み込みを1回で済ませる
+    add_schedule_kokyaku = read_excel_cells(
+        target_filepath, RenrakukoumokuInfo.renrakukoumoku_cell_addrs
+    )[renrakukoumoku_range_kokyaku]
 
     # 型式
     add_schedule_msm_katasiki = f"MA-{msm_katasiki_num}"
@@ -341,6 +338,7 @@ def generate_estimate_calcsheet(attachment_dirpath: Path) -> None:
         None
     """
 
+    drive_service = googleapi.get_service("drive")
     target_filepath = next(attachment_dirpath.glob("*MA-*.xlsx"))
     if not target_filepath:
         print("cant add schedule")
@@ -402,38 +400,54 @@ def copy_projectdir(export_path: Path) -> None:
 
 class PrepareTask(BaseTask):
     def execute_task(self):
+        gmail_service = googleapi.get_service("gmail")
         messages: list[ExpandedMessageItem] = []
         try:
             # Call the Gmail API
 
-            # 該当メールのスレッド検索
-            threads = googleapi.search_threads(
-                gmail_service, "label:snd-ミスミ (*MA-*)"
+            # 該当メールのスレッド検索。使うのは上位の件数分だけなので、それ以上は取得しない
+            top_threads = googleapi.search_threads(
+                gmail_service,
+                "label:snd-ミスミ (*MA-*)",
+                max_results=PREPARE_THREADS_COUNT,
             )
 
-            # 上位10件のスレッド -> メッセージを取得。
+            # 上位のスレッド -> メッセージを取得。
             # スレッドに紐づきが2件ぐらいのメッセージの部分でのもので十分かな
-            if threads:
-                top_threads = list(itertools.islice(threads, 0, 10))
+            if top_threads:
+                # スレッドの取得は1回のバッチリクエストにまとめる
+                thread_batch = googleapi.BatchRequestQueue(
+                    gmail_service, googleapi.GMAIL_BATCH_MAX_REQUESTS
+                )
                 for thread in top_threads:
                     # threadsのid = threadsの一番最初のmessage>idなので、そのまま使う
-                    message_id = thread.get("id", "")
+                    # 選択肢の表示にはヘッダーだけあればよいので、本文は取得しない
+                    thread_batch.add(
+                        gmail_service.users()
+                        .threads()
+                        .get(
+                            userId=target_userid,
+                            id=thread.get("id", ""),
+                            format="metadata",
+                            metadataHeaders=googleapi.MESSAGE_LIST_HEADERS,
+                            fields="messages(id,payload/headers)",
+                        ),
+                        retry=True,
+                    )
+
+                for thread_result in thread_batch.flush():
+                    if isinstance(thread_result, Exception):
+                        raise thread_result
 
                     # スレッドの数が2以上 = すでに納品済みと思われるので削る。
                     # TODO:2022-12-09 ここは2件以上でもまだやり取り中だったりする場合もあるので悩ましい
                     # （数見るだけでもいいかもしれない
-                    thread_result = googleapi.get_thread_by_message_id(
-                        gmail_service,
-                        message_id,
-                        user_id=target_userid,
-                        fields="messages",
-                    )
-
                     if len(thread_result.get("messages")) <= 2:
                         # スレッドの一番先頭にあるメッセージを取得する
                         messages.append(
                             ExpandedMessageItem(
-                                gmail_message=thread_result.get("messages")[0]
+                                gmail_message=thread_result.get("messages")[0],
+                                message_loader=googleapi.get_full_message,
                             )
                         )
 
@@ -499,17 +513,22 @@ class PrepareTask(BaseTask):
                         chat.card.gencomponent_button(
                             "タスク実行", "run_task__run_mail_action"
                         ),
-                        chat.card.gencomponent_button("キャンセル", "cancel_task"),
+                        chat.card.gencomponent_button(
+                            "キャンセル", "cancel_task__run_mail_action"
+                        ),
                     ]
                 ),
             ],
         )
         # print(config_body)
-        return googleapi.create_chat_message(chat_service, spacename, config_body)
+        return googleapi.create_chat_message(
+            googleapi.get_service("chat"), spacename, config_body
+        )
 
 
 class MainTask(BaseTask):
     def execute_task(self, process_data: ProcessData | None = None) -> dict | str:
+        gmail_service = googleapi.get_service("gmail")
         selected_message_id = process_data["task_data"].get("selected_message_id")
         ask_generate_projectfile = process_data["task_data"].get(
             "ask_generate_projectfile", None
@@ -523,7 +542,7 @@ class MainTask(BaseTask):
             "ask_add_schedule_nextmonth", None
         )
         print("[Generate Dirs...]")
-        generate_dirs()
+        exportfiles_dirpath, attachment_dirpath = generate_dirs()
 
         print("[Save Attachment file and mail image]")
 
@@ -532,37 +551,31 @@ class MainTask(BaseTask):
             googleapi.get_message_by_message_id(gmail_service, selected_message_id)
         )
 
-        # TODO:2023-09-14 ここはExpandedMessageItemへ移動する。
-        # メール本文にimgファイルがある場合はそれを取り出す
-        # multipart/relatedの時にあるので、それを狙い撃ちで取る
-
-        if selected_message.body_related:
-            message_imgs = [
-                i
-                for i in selected_message.body_related.get("parts")
-                if "image" in i.get("mimeType")
-            ]
-            for msg_img in message_imgs:
-                googleapi.save_attachment_file(
-                    gmail_service,
-                    selected_message.id,
-                    msg_img.get("body").get("attachmentId"),
-                    attachment_dirpath / msg_img.get("filename"),
-                )
-        # 添付ファイルの保持
-        message_attachmentfiles = [
-            i
-            for i in selected_message.payload.get("parts")
-            if "application" in i.get("mimeType")
+        # メール本文の画像（multipart/relatedの中の画像）と添付ファイルを保存する
+        # 分類はExpandedMessageItemでパートをたどって行われる。ファイル名がないものは保存できないので除く
+        message_files = [
+            msg_part
+            for msg_part in selected_message.inline_images
+            + selected_message.attachments
+            if msg_part.filename and msg_part.attachment_id
         ]
 
-        for msg_attach in message_attachmentfiles:
-            googleapi.save_attachment_file(
-                gmail_service,
-                selected_message.id,
-                msg_attach.get("body").get("attachmentId"),
-                attachment_dirpath / msg_attach.get("filename"),
-            )
+        # 本文の画像と添付ファイルは、まとめて並列に保存する
+        # 再実行時にダウンロードし直さないように、メッセージIDとパートIDでキャッシュする
+        googleapi.save_attachment_files(
+            selected_message.id,
+            [
+                (
+                    msg_part.attachment_id,
+                    attachment_dirpath / msg_part.filename,
+                    f"{msg_part.part_id}:{msg_part.filename}",
+                )
+                for msg_part in message_files
+            ],
+            attachment_cache=AttachmentCache(
+                max_size_bytes=attachment_cache_max_mb * 1024 * 1024
+            ),
+        )
 
         print("[Generate Mail Printable PDF]")
         generate_mail_printhtml(selected_message, attachment_dirpath)
@@ -604,4 +617,6 @@ class MainTask(BaseTask):
             ],
         )
         # send_message_body.update({"actionResponse": {"type": "NEW_MESSAGE"}})
-        return googleapi.create_chat_message(chat_service, spacename, send_message_body)
+        return googleapi.create_chat_message(
+            googleapi.get_service("chat"), spacename, send_message_body
+        )
@@ -0,0 +1,69 @@
+"""
+タスクを実行するRQワーカーです。
+
+`rq worker`の既定のワーカーはジョブごとにforkするので、ジョブのたびにタスクのモジュールの読み込みと
+Google APIの認証・サービス作成が行われます。
+WarmWorkerはジョブをワーカーのプロセス内で実行し、読み込んだモジュールと作成済みのサービスを使い回します。
+
+    rq worker -w task.worker.WarmWorker
+"""
+
+import importlib
+
+from rq.worker import SimpleWorker
+
+from api import googleapi
+
+# ワーカー起動時に読み込んでおくタスクのモジュール
+PRELOAD_TASK_MODULES = (
+    "task.bot_calc_add",
+    "task.generate_invoice",
+    "task.generate_quotes",
+    "task.run_mail_action",
+)
+
+# ワーカー起動時に作成しておくGoogle APIのサービス
+PRELOAD_SERVICES = ("sheets", "drive", "gmail", "chat")
+
+
+def preload_task_modules() -> None:
+    for module_name in PRELOAD_TASK_MODULES:
+        importlib.import_module(module_name)
+
+
+def preload_services() -> None:
+    """
+    Google APIのサービスを作成しておく。
+    トークンがまだない場合は認証フローが必要になるので、ここでは作成せず最初のジョブに任せる
+    """
+    if not googleapi.token_save_path.exists():
+        print("google api token not found. skip preload services")
+        return
+
+    for service_name in PRELOAD_SERVICES:
+        try:
+            googleapi.get_service(service_name)
+        except Exception as e:
+            print(f"preload service failed: {service_name}: {e}")
+
+
+class WarmWorker(SimpleWorker):
+    """
+    タスクのモジュールとGoogle APIのサービスを読み込んだまま、ジョブを実行するワーカーです。
+    ジョブの実行前に認証情報の期限を確認し、切れていれば更新します。
+    ジョブはワーカーのメインスレッドで実行されるので、サービスはワーカーの中で1つずつになります。
+    """
+
+    def work(self, *args, **kwargs):
+        preload_task_modules()
+        preload_services()
+        return super().work(*args, **kwargs)
+
+    def execute_job(self, job, queue):
+        if googleapi.token_save_path.exists():
+            try:
+                googleapi.get_credentials()
+            except Exception as e:
+                # 更新できなくてもワーカーは止めない。ジョブ側でAPIのエラーとして扱われる
+                print(f"refresh credentials failed: {e}")
+        return super().execute_job(job, queue)
@@ -0,0 +1,127 @@
+from unittest import mock
+
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+
+from api.googleapi import BatchRequestQueue, dupulicate_files, generate_copy_body
+
+# BatchRequestQueue.flushのテスト。バッチの結果と送り直しの有無を確認する
+
+
+def http_error(status: int) -> HttpError:
+    return HttpError(httplib2.Response({"status": status}), b"")
+
+
+class FakeBatch:
+    """バッチ内の結果を、リクエストごとに決めた値で返すバッチ"""
+
+    def __init__(self, callback, batch_results: dict, batch_error: Exception | None):
+        self.callback = callback
+        self.batch_results = batch_results
+        self.batch_error = batch_error
+        self.request_ids = []
+
+    def add(self, api_request, request_id):
+        self.request_ids.append(request_id)
+
+    def execute(self):
+        if self.batch_error:
+            raise self.batch_error
+        for request_id in self.request_ids:
+            result = self.batch_results[request_id]
+            if isinstance(result, HttpError):
+                self.callback(request_id, None, result)
+            else:
+                self.callback(request_id, result, None)
+
+
+def create_api_request(execute_result):
+    api_request = mock.Mock()
+    if isinstance(execute_result, Exception):
+        api_request.execute.side_effect = execute_result
+    else:
+        api_request.execute.return_value = execute_result
+    return api_request
+
+
+@pytest.mark.parametrize(
+    ("batch_result", "batch_error", "retry", "execute_result", "expected", "resent"),
+    [
+        # 成功したものは送り直さない
+        ({"id": "a"}, None, True, {"id": "b"}, {"id": "a"}, False),
+        # 429/5xxでもretry=Falseなら送り直さない（copy, delete等）
+        (http_error(503), None, False, {"id": "b"}, 503, False),
+        # retry=Trueなら429/5xxは送り直す
+        (http_error(429), None, True, {"id": "b"}, {"id": "b"}, True),
+        # 404等は送り直しても変わらないので送り直さない
+        (http_error(404), None, True, {"id": "b"}, 404, False),
+        # バッチ全体が通信エラーになった場合、retry=Falseならその例外が入る
+        (None, OSError("reset"), False, {"id": "b"}, OSError, False),
+        # バッチ全体が通信エラーになった場合、retry=Trueなら送り直す
+        (None, httplib2.HttpLib2Error("reset"), True, {"id": "b"}, {"id": "b"}, True),
+        # 送り直しも通信エラーになった場合は、例外を出さずに結果に入れる
+        (None, OSError("reset"), True, OSError("reset again"), OSError, True),
+    ],
+)
+def test_flush(batch_result, batch_error, retry, execute_result, expected, resent):
+    service = mock.Mock()
+    service.new_batch_http_request.side_effect = lambda callback: FakeBatch(
+        callback, {"0": batch_result}, batch_error
+    )
+    api_request = create_api_request(execute_result)
+
+    queue = BatchRequestQueue(service)
+    queue.add(api_request, retry=retry)
+    (result,) = queue.flush()
+
+    if isinstance(expected, int):
+        assert result.resp.status == expected
+    elif isinstance(expected, type):
+        assert isinstance(result, expected)
+    else:
+        assert result == expected
+    assert api_request.execute.called == resent
+    assert len(queue) == 0
+
+
+# dupulicate_filesのテスト。copyは送り直さず、複製できたか分からないものだけpropertiesで探す
+@pytest.mark.parametrize(
+    ("copy_result", "found_files", "expected"),
+    [
+        # 複製できたものは探さない
+        ({"id": "copied"}, None, {"id": "copied"}),
+        # 5xxでも複製済みのファイルが1件だけあれば、それを使う
+        (http_error(500), [{"id": "found"}], {"id": "found"}),
+        # 見つからない、または複数ある場合は失敗のまま
+        (http_error(500), [], 500),
+        (http_error(500), [{"id": "found1"}, {"id": "found2"}], 500),
+        # 4xxは複製されていないので探さない
+        (http_error(403), None, 403),
+    ],
+)
+def test_dupulicate_files(copy_result, found_files, expected):
+    batch_results = iter([{"0": copy_result}, {"0": {"files": found_files}}])
+    service = mock.Mock()
+    service.new_batch_http_request.side_effect = lambda callback: FakeBatch(
+        callback, next(batch_results), None
+    )
+
+    (result,) = dupulicate_files(
+        service,
+        "template_id",
+        [generate_copy_body("MA-0001", None, {"quote_id": "0001"})],
+    )
+
+    if isinstance(expected, int):
+        assert result.resp.status == expected
+    else:
+        assert result == expected
+    # copyは1件ずつ送り直さない
+    assert not service.files().copy().execute.called
+    if found_files is None:
+        assert not service.files().list.called
+    else:
+        assert service.files().list.call_args.kwargs["q"] == (
+            "properties has { key='quote_id' and value='0001' } and trashed = false"
+        )
@@ -0,0 +1,82 @@
+import json
+
+import pytest
+
+from chat.session_codec import (
+    TAG_JSON,
+    TAG_JSON_ZLIB,
+    TAG_MSGPACK,
+    TAG_MSGPACK_ZLIB,
+    MsgpackSessionCodec,
+    SessionCodec,
+)
+
+SESSION_DATA = {
+    "choiced_quote_list": [
+        {"quote_id": "DCCF6E-Q-0001", "hinmoku_title": "ガススプリング配管図"}
+    ]
+}
+LARGE_SESSION_DATA = {"choiced_quote_list": SESSION_DATA["choiced_quote_list"] * 100}
+
+
+# 小さいデータは圧縮せず、大きいデータはzlibで圧縮されるか。どちらのコーデックからも読めるか
+@pytest.mark.parametrize(
+    ("codec", "data", "expected_tag"),
+    [
+        (SessionCodec(1024), SESSION_DATA, TAG_JSON),
+        (SessionCodec(1024), LARGE_SESSION_DATA, TAG_JSON_ZLIB),
+        (SessionCodec(None), LARGE_SESSION_DATA, TAG_JSON),
+        (MsgpackSessionCodec(1024), SESSION_DATA, TAG_MSGPACK),
+        (MsgpackSessionCodec(1024), LARGE_SESSION_DATA, TAG_MSGPACK_ZLIB),
+        (MsgpackSessionCodec(None), LARGE_SESSION_DATA, TAG_MSGPACK),
+    ],
+)
+def test_encode_decode(codec, data, expected_tag):
+    payload = codec.encode(data)
+
+    assert payload[:1] == expected_tag
+    assert codec.decode(payload) == data
+    # コーデックを切り替えても、保存済みのデータは読める
+    assert SessionCodec().decode(payload) == data
+    assert MsgpackSessionCodec().decode(payload) == data
+
+
+# タグのない以前のjson文字列も読めるか（Redisからはバイト列、テスト等では文字列）
+@pytest.mark.parametrize(
+    "payload",
+    [
+        json.dumps(SESSION_DATA),
+        json.dumps(SESSION_DATA).encode(),
+        json.dumps(SESSION_DATA, ensure_ascii=False).encode(),
+    ],
+)
+def test_decode_legacy_json(payload):
+    assert SessionCodec().decode(payload) == SESSION_DATA
+
+
+# 壊れたデータは、形式に関係なくValueErrorになるか
+@pytest.mark.parametrize(
+    "payload",
+    [
+        b"",
+        # タグだけで本体がない
+        TAG_JSON,
+        TAG_JSON_ZLIB,
+        TAG_MSGPACK,
+        TAG_MSGPACK_ZLIB,
+        # 本体が壊れている
+        TAG_JSON + b'{"choiced_quote_list": [',
+        TAG_JSON_ZLIB + b"not compressed",
+        TAG_MSGPACK + b"\xc1",
+        TAG_MSGPACK_ZLIB + b"not compressed",
+        # 途中で切れている
+        MsgpackSessionCodec(None).encode(SESSION_DATA)[:-1],
+        MsgpackSessionCodec(0).encode(SESSION_DATA)[:-1],
+        # タグもjsonでもない
+        b"x",
+        b"\xff\xfe",
+    ],
+)
+def test_decode_corrupt_payload(payload):
+    with pytest.raises(ValueError):
+        SessionCodec().decode(payload)
@@ -0,0 +1,118 @@
+# generate_invoice 見積書管理表の読み込み（開始行の探索、インデックスの同期）のテスト
+# tests/test_generate_invoice.pyは、今はないgenerate_billing_info_json等をimportしていて読み込めないので分けている
+from datetime import date
+from unittest import mock
+
+import pytest
+
+from helper.quote_index import QuoteIndex
+from task import generate_invoice
+from task.generate_invoice import (
+    QUOTE_LIST_DATELESS_FALLBACK_ROWS,
+    convert_quote_values_to_index_item,
+    find_start_row_by_quote_dates,
+    sync_quote_index,
+)
+
+FALLBACK = QUOTE_LIST_DATELESS_FALLBACK_ROWS
+D = date(2024, 5, 10)
+BEFORE = date(2024, 5, 1)
+AFTER = date(2024, 5, 20)
+
+
+# find_start_row_by_quote_dates
+# 見積日のリストは2行目から。結果は行番号（2始まり）
+@pytest.mark.parametrize(
+    ("quote_dates", "expected"),
+    [
+        # 全ての行に見積日がある
+        ([BEFORE, BEFORE, D, AFTER], 4),
+        ([BEFORE, BEFORE], 4),
+        ([D, AFTER], 2),
+        # 作成中の行（見積日なし）は、直前の見積日がある行の続きとして扱う
+        ([BEFORE, None, D, None, AFTER], 3),
+        ([BEFORE, BEFORE, None, None], 4),
+        # E列追加前の古い行のあとに見積日がある行が続く場合、古い行はfrom_date以前の見積日が見つかれば含めない
+        ([None] * 500 + [BEFORE, D], 2 + 501),
+        # from_date以前の見積日がない場合は、最初の見積日がある行から決まった行数だけさかのぼる
+        ([None] * 500 + [D, AFTER], 2 + 500 - FALLBACK),
+        ([None] * 10 + [D, AFTER], 2),
+        # 見積日がある行がない場合は、最後の行から決まった行数だけさかのぼる
+        ([None] * 500, 2 + 500 - FALLBACK),
+        ([None] * 10, 2),
+        ([], 2),
+    ],
+)
+def test_find_start_row_by_quote_dates(quote_dates, expected):
+    assert find_start_row_by_quote_dates(quote_dates, D) == expected
+
+
+def quote_values(quote_date: str = "2024/05/10") -> dict:
+    return {
+        "quote_id": "DCCF6E-Q-0001",
+        "quote_date": quote_date,
+        "hinmoku_name": "MA-9901 ガススプリング配管図",
+        "hinmoku_detail": "納期 05/12",
+        "hinmoku_price": "54000",
+    }
+
+
+# sync_quote_index
+# 前回は9行目まで読み込み済み。読み込み済みの行は、先頭からインデックスに記録できた行が続くところまで進むか
+@pytest.mark.parametrize(
+    ("url_rows", "void_rows", "indexed_ids", "unreadable_ids", "expected_row"),
+    [
+        # 全て記録できた
+        ([(10, "d/id_10"), (11, "d/id_11")], set(), [], [], 11),
+        # URLが空の行（作成中）で止まる。後ろの行は記録するが、次回も読む
+        ([(10, "d/id_10"), (12, "d/id_12")], set(), [], [], 10),
+        # 作成失敗の行は読み込み済みとして進む
+        ([(10, "d/id_10"), (12, "d/id_12")], {11}, [], [], 12),
+        # 記録済みの見積書の行も進む
+        ([(10, "d/id_10"), (11, "d/id_11")], set(), ["id_10"], [], 11),
+        # 見積日が読めない行で止まる（先頭なら読み込み済みの行は変えない）
+        ([(10, "d/id_10"), (11, "d/id_11")], set(), [], ["id_10"], 9),
+        # 新しい行がない
+        ([], set(), [], [], 9),
+    ],
+)
+def test_sync_quote_index(
+    tmp_path, url_rows, void_rows, indexed_ids, unreadable_ids, expected_row
+):
+    quote_index = QuoteIndex(tmp_path / "quote_index.sqlite3")
+    quote_index.set_last_synced_row(9)
+    quote_index.upsert_quotes(
+        [
+            convert_quote_values_to_index_item(spreadsheet_id, 0, quote_values())
+            for spreadsheet_id in indexed_ids
+        ]
+    )
+
+    def get_values_by_range_list(gsheet_service, spreadsheet_ids, celladdrs):
+        return [
+            quote_values("不明" if spreadsheet_id in unreadable_ids else "2024/05/10")
+            for spreadsheet_id in spreadsheet_ids
+        ]
+
+    with (
+        mock.patch.object(
+            generate_invoice,
+            "get_quote_gsheet_urls_from_row",
+            return_value=(url_rows, void_rows),
+        ) as get_urls,
+        mock.patch.object(
+            generate_invoice, "get_values_by_range_list", get_values_by_range_list
+        ),
+        mock.patch.object(generate_invoice, "get_hinmoku_celladdrs_by_gsheet"),
+    ):
+        sync_quote_index(None, quote_index, date(2024, 5, 1))
+
+    get_urls.assert_called_once_with(None, 10)
+    assert quote_index.get_last_synced_row() == expected_row
+    # 読めた見積書は、読み込み済みの行に関係なく記録される
+    readable_ids = [
+        url.split("/")[-1]
+        for _, url in url_rows
+        if url.split("/")[-1] not in unreadable_ids
+    ]
+    assert quote_index.filter_unindexed_ids(readable_ids) == []
@@ -0,0 +1,173 @@
+# generate_quotes MainTaskのテスト
+# Google APIはモックにして、一部の見積書が失敗した場合の後処理を確認する
+from unittest import mock
+
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+
+from task import generate_quotes
+from task.generate_quotes import CreatedQuoteDocument, MainTask
+
+QUOTE_NUMBERS = [("0001", 2), ("0002", 3)]
+
+
+class FakeAnkenQuote:
+    """MainTaskが使う属性だけを持つAnkenQuote"""
+
+    def __init__(self, anken_number: str, convert_error: Exception | None = None):
+        self.anken_number = anken_number
+        self.anken_base_number = anken_number
+        self.calcsheet_source = f"calcsheet_{anken_number}"
+        self.calcsheet_parents = ["estimate_dir"]
+        self.quote_gsheet_data = None
+        self.quote_pdf_path = None
+        self.convert_error = convert_error
+
+    def convert_dict_to_gsheet_tamplate(self, quote_number):
+        if self.convert_error:
+            raise self.convert_error
+        self.quote_gsheet_data = {"quote_id": quote_number, "quote_date": "2024-05-10"}
+
+
+class FakeBatchRequestQueue:
+    """追加されたリクエストを記録し、flushでは決めた結果を返すBatchRequestQueue"""
+
+    instances: list["FakeBatchRequestQueue"] = []
+    # 作られた順番（削除, 移動）ごとの、失敗させるエラー
+    errors: list[Exception | None] = []
+
+    def __init__(self, service):
+        self.requests = []
+        self.error = self.errors[len(self.instances)]
+        self.instances.append(self)
+
+    def add(self, api_request, retry: bool = False):
+        self.requests.append((api_request, retry))
+
+    def flush(self):
+        return [self.error or {"id": "ok"} for _ in self.requests]
+
+
+def http_error(status: int) -> HttpError:
+    return HttpError(httplib2.Response({"status": status}), b"")
+
+
+@pytest.fixture
+def main_task_env(tmp_path, monkeypatch):
+    """MainTaskが呼ぶGoogle APIと記録先をモックにする"""
+    env = mock.Mock()
+    env.reserve_numbered_rows.return_value = QUOTE_NUMBERS
+    env.dupulicate_files.return_value = [{"id": "copy_0001"}, {"id": "copy_0002"}]
+    env.search_threads.return_value = []
+    env.create_errors = {}
+
+    def create_quote_document(quote_gsheet_data, quote_filestem, row, file_id):
+        if quote_filestem in env.create_errors:
+            raise env.create_errors[quote_filestem]
+        return CreatedQuoteDocument(
+            f"index_{row}",
+            [f"{quote_filestem}.pdf", file_id, "pdf_url", "2024-05-10"],
+            tmp_path / f"{quote_filestem}.pdf",
+        )
+
+    FakeBatchRequestQueue.instances = []
+    FakeBatchRequestQueue.errors = [None, None]
+    monkeypatch.setattr(generate_quotes, "export_quote_dirpath", tmp_path)
+    monkeypatch.setattr(generate_quotes, "QuoteIndex", env.QuoteIndex)
+    monkeypatch.setattr(
+        generate_quotes, "update_msm_anken_schedule_sheet", env.update_schedule
+    )
+    monkeypatch.setattr(generate_quotes, "create_quote_document", create_quote_document)
+    for name in [
+        "get_service",
+        "reserve_numbered_rows",
+        "dupulicate_files",
+        "batch_update_sheet",
+        "search_threads",
+    ]:
+        monkeypatch.setattr(generate_quotes.googleapi, name, getattr(env, name))
+    monkeypatch.setattr(
+        generate_quotes.googleapi, "BatchRequestQueue", FakeBatchRequestQueue
+    )
+    return env
+
+
+def run_main_task(anken_quotes):
+    with mock.patch.object(
+        generate_quotes, "generate_anken_quote_list", return_value=anken_quotes
+    ):
+        return MainTask().execute_task({"task_data": {}})
+
+
+# 2件目の見積書がどこで失敗しても、1件目は記録・移動され、2件目の行は作成失敗になり、終了せずに結果を返すか
+@pytest.mark.parametrize(
+    ("copy_result", "convert_error", "create_error", "cleanup_error", "deleted"),
+    [
+        # 複製に失敗: 複製がないので削除しない
+        (http_error(500), None, None, None, 0),
+        # 見積書の情報の生成に失敗: 複製を削除する
+        ({"id": "copy_0002"}, ValueError("price"), None, None, 1),
+        # スレッドでの作成に失敗: 複製を削除する
+        ({"id": "copy_0002"}, None, OSError("export"), None, 1),
+        # 複製の削除にも失敗: エラーとして報告する
+        ({"id": "copy_0002"}, None, OSError("export"), http_error(503), 1),
+    ],
+)
+def test_main_task_partial_failure(
+    main_task_env, copy_result, convert_error, create_error, cleanup_error, deleted
+):
+    main_task_env.dupulicate_files.return_value = [{"id": "copy_0001"}, copy_result]
+    if create_error:
+        main_task_env.create_errors["見積書_MA-0002"] = create_error
+    FakeBatchRequestQueue.errors = [cleanup_error, None]
+    anken_quotes = [FakeAnkenQuote("MA-0001"), FakeAnkenQuote("MA-0002", convert_error)]
+
+    result = run_main_task(anken_quotes)
+
+    assert result["created_quotes"] == ["MA-0001"]
+    assert result["errors"][0].startswith("MA-0002: ")
+    assert len(result["errors"]) == (2 if cleanup_error else 1)
+    # 作成できたものは記録し、作成できなかった行は作成失敗にする
+    (_, _, range_values), _ = main_task_env.batch_update_sheet.call_args
+    assert range_values == {
+        "見積書管理!B2:E2": [
+            ["見積書_MA-0001.pdf", "copy_0001", "pdf_url", "2024-05-10"]
+        ],
+        "見積書管理!B3": [["作成失敗:MA-0002"]],
+    }
+    main_task_env.QuoteIndex().upsert_quotes.assert_called_once_with(["index_2"])
+    main_task_env.update_schedule.assert_called_once()
+    assert anken_quotes[0].quote_pdf_path.name == "見積書_MA-0001.pdf"
+    # 複製の削除は送り直さない。見積計算表の移動は作成できたものだけ
+    cleanup_queue, archive_queue = FakeBatchRequestQueue.instances
+    assert len(cleanup_queue.requests) == deleted
+    assert not any(retry for _, retry in cleanup_queue.requests)
+    assert len(archive_queue.requests) == 1
+    # 失敗があればメールの下書きは作らない
+    main_task_env.search_threads.assert_not_called()
+
+
+# 番号の確保に失敗した場合は、複製せずに結果を返すか
+def test_main_task_reserve_failure(main_task_env):
+    main_task_env.reserve_numbered_rows.side_effect = http_error(500)
+
+    result = run_main_task([FakeAnkenQuote("MA-0001"), FakeAnkenQuote("MA-0002")])
+
+    assert result["created_quotes"] == []
+    assert result["errors"][0].startswith("見積書番号の確保: ")
+    main_task_env.dupulicate_files.assert_not_called()
+    main_task_env.batch_update_sheet.assert_not_called()
+
+
+# 全て作成できた場合は、メールの下書きの作成に進むか
+def test_main_task_success(main_task_env):
+    result = run_main_task([FakeAnkenQuote("MA-0001"), FakeAnkenQuote("MA-0002")])
+
+    assert "errors" not in result
+    main_task_env.search_threads.assert_called_once()
+    main_task_env.QuoteIndex().upsert_quotes.assert_called_once_with(
+        ["index_2", "index_3"]
+    )
+    assert len(FakeBatchRequestQueue.instances[0].requests) == 0
+    assert len(FakeBatchRequestQueue.instances[1].requests) == 2
@@ -0,0 +1,86 @@
+import os
+
+import pytest
+
+from helper.attachment_cache import AttachmentCache
+
+# キャッシュの上限サイズ（バイト）
+MAX_SIZE_BYTES = 10
+
+
+# 同じメッセージID・同じパートのキーのときだけキャッシュから配置されるか
+@pytest.mark.parametrize(
+    ("message_id", "part_key", "expected"),
+    [
+        ("msg1", "1:sample.zip", True),
+        # 別のメッセージの同じパートは別のキャッシュ
+        ("msg2", "1:sample.zip", False),
+        ("msg1", "2:sample.zip", False),
+    ],
+)
+def test_restore(tmp_path, message_id, part_key, expected):
+    attachment_cache = AttachmentCache(tmp_path / "cache", MAX_SIZE_BYTES)
+    src_path = tmp_path / "sample.zip"
+    src_path.write_bytes(b"abc")
+    attachment_cache.store("msg1", "1:sample.zip", src_path)
+
+    save_path = tmp_path / "restored.zip"
+    assert attachment_cache.restore(message_id, part_key, save_path) == expected
+    assert save_path.exists() == expected
+    if expected:
+        assert save_path.read_bytes() == b"abc"
+
+
+# 上限を超えたら、最後に使った日時が古いものから削除されるか
+# 操作: ("store", パートのキー, バイト数) / ("restore", パートのキー) / ("tmp", ファイル名, バイト数)
+@pytest.mark.parametrize(
+    ("operations", "expected_sizes"),
+    [
+        # 5バイトは2つまで。一番古いaが削除される
+        (
+            [("store", "a", 5), ("store", "b", 5), ("store", "c", 5)],
+            {"b": 5, "c": 5},
+        ),
+        # 取り出したaは新しく使ったものになるので、bが削除される
+        (
+            [("store", "a", 5), ("store", "b", 5), ("restore", "a"), ("store", "c", 5)],
+            {"a": 5, "c": 5},
+        ),
+        # ちょうど上限なら削除しない
+        ([("store", "a", 4), ("store", "b", 6)], {"a": 4, "b": 6}),
+        # 1ファイルで上限を超えるものはキャッシュしない（他のものも削除しない）
+        ([("store", "a", 5), ("store", "b", 11)], {"a": 5}),
+        # 同じキーは置き換えになり、古い方のサイズは数えない
+        ([("store", "a", 5), ("store", "a", 8)], {"a": 8}),
+        # 追加途中の一時ファイルは数えず、削除もしない
+        ([("tmp", "partial.tmp", 20), ("store", "a", 5)], {"a": 5}),
+    ],
+)
+def test_evict_least_recently_used(tmp_path, operations, expected_sizes):
+    attachment_cache = AttachmentCache(tmp_path / "cache", MAX_SIZE_BYTES)
+    tmp_filenames = []
+
+    for step, (operation, name, *size) in enumerate(operations):
+        if operation == "tmp":
+            (attachment_cache.cache_dirpath / name).write_bytes(b"x" * size[0])
+            tmp_filenames.append(name)
+            continue
+        if operation == "store":
+            src_path = tmp_path / f"{step}.bin"
+            src_path.write_bytes(b"x" * size[0])
+            attachment_cache.store("msg1", name, src_path)
+        else:
+            assert attachment_cache.restore("msg1", name, tmp_path / f"{step}.out")
+        # 最後に使った日時はmtimeで決まるので、操作の順番どおりに1秒ずつずらす
+        cache_path = attachment_cache._get_cache_path("msg1", name)
+        if cache_path.exists():
+            os.utime(cache_path, (1_000_000 + step, 1_000_000 + step))
+
+    restored_sizes = {}
+    for name in {operation[1] for operation in operations if operation[0] != "tmp"}:
+        restored_path = tmp_path / f"restored_{name}"
+        if attachment_cache.restore("msg1", name, restored_path):
+            restored_sizes[name] = restored_path.stat().st_size
+    assert restored_sizes == expected_sizes
+    for tmp_filename in tmp_filenames:
+        assert (attachment_cache.cache_dirpath / tmp_filename).exists()
@@ -0,0 +1,37 @@
+import base64
+import io
+import json
+
+import pytest
+
+from helper import decode_base64url_to_file, iter_json_string_field
+
+
+def split_chunks(data: bytes, chunk_size: int) -> list[bytes]:
+    return [data[i : i + chunk_size] for i in range(0, len(data), chunk_size)]
+
+
+# Gmail APIの添付ファイルのレスポンスと同じ形のjsonを、チャンクの大きさを変えて読む
+@pytest.mark.parametrize(("chunk_size"), [1, 3, 7, 64, 4096])
+def test_decode_attachment_data_by_chunks(chunk_size):
+    # パディングが必要な長さにする
+    attachment = bytes(range(256)) * 10 + b"end"
+    response = json.dumps(
+        {
+            "size": len(attachment),
+            "data": base64.urlsafe_b64encode(attachment).decode().rstrip("="),
+        }
+    ).encode()
+
+    output = io.BytesIO()
+    written_size = decode_base64url_to_file(
+        iter_json_string_field(split_chunks(response, chunk_size), "data"), output
+    )
+
+    assert output.getvalue() == attachment
+    assert written_size == len(attachment)
+
+
+def test_iter_json_string_field_not_found():
+    with pytest.raises(ValueError):
+        list(iter_json_string_field([b'{"size": 0}'], "data"))
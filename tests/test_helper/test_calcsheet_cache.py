@@ -0,0 +1,64 @@
+import pytest
+
+from helper.calcsheet_cache import CalcSheetCache
+
+MAY_1 = "2024-05-01T00:00:00.000Z"
+MAY_2 = "2024-05-02T00:00:00.000Z"
+
+
+def calcsheet_data(price: str):
+    return {
+        "metadata": {
+            "properties": {"title": "MA-9901 見積もり計算表"},
+            "sheets": [{"properties": {"title": "計算結果"}}],
+        },
+        "value_ranges": [{"values": [[price]]}, {"values": [["2024/05/12"]]}],
+    }
+
+
+# modifiedTimeが一致するものだけ返るか
+# 追加は1回ごとに別のインスタンス（別のプロセス）から行い、検索もさらに別のインスタンスから行う
+# 追加: [[(スプレッドシートID, modifiedTime, 金額)]]
+@pytest.mark.parametrize(
+    ("upserts", "modified_times", "expected"),
+    [
+        # 一致する
+        ([[("id_1", MAY_1, "54000")]], {"id_1": MAY_1}, {"id_1": "54000"}),
+        # シートが更新された（modifiedTimeが違う）ものは返らない
+        ([[("id_1", MAY_1, "54000")]], {"id_1": MAY_2}, {}),
+        # 記録していないIDは返らない
+        ([[("id_1", MAY_1, "54000")]], {"id_3": MAY_1}, {}),
+        ([[("id_1", MAY_1, "54000")]], {}, {}),
+        # 一致するものだけ返る
+        (
+            [[("id_1", MAY_1, "54000"), ("id_2", MAY_1, "32000")]],
+            {"id_1": MAY_1, "id_2": MAY_2, "id_3": MAY_1},
+            {"id_1": "54000"},
+        ),
+        # 同じIDは新しいmodifiedTimeで上書きされ、古いものは残らない
+        (
+            [[("id_1", MAY_1, "54000")], [("id_1", MAY_2, "60000")]],
+            {"id_1": MAY_2},
+            {"id_1": "60000"},
+        ),
+        (
+            [[("id_1", MAY_1, "54000")], [("id_1", MAY_2, "60000")]],
+            {"id_1": MAY_1},
+            {},
+        ),
+    ],
+)
+def test_find_calcsheet_data(tmp_path, upserts, modified_times, expected):
+    db_path = tmp_path / "calcsheet_cache.sqlite3"
+    for items in upserts:
+        CalcSheetCache(db_path).upsert_calcsheet_data(
+            [
+                (spreadsheet_id, modified_time, calcsheet_data(price))
+                for spreadsheet_id, modified_time, price in items
+            ]
+        )
+
+    assert CalcSheetCache(db_path).find_calcsheet_data(modified_times) == {
+        spreadsheet_id: calcsheet_data(price)
+        for spreadsheet_id, price in expected.items()
+    }
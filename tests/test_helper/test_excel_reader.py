@@ -0,0 +1,94 @@
+import openpyxl
+import pytest
+
+from helper import excel_reader
+from helper.excel_reader import read_excel_cells
+
+# 連絡項目表（新フォーマット）と同じ位置に値を入れたブックの内容
+RENRAKUKOUMOKU_VALUES = {
+    "B9": "顧客連絡先",
+    "D6": "顧客名",
+    "D10": "エンドユーザー名",
+    "A1": "=1+1",
+}
+
+
+def save_workbook(filepath, cell_values: dict):
+    workbook = openpyxl.Workbook()
+    for cell_addr, value in cell_values.items():
+        workbook.active[cell_addr] = value
+    workbook.save(filepath)
+    return filepath
+
+
+@pytest.mark.parametrize(
+    ("cell_addrs", "expected"),
+    [
+        (
+            ("B9", "D6", "D10"),
+            {"B9": "顧客連絡先", "D6": "顧客名", "D10": "エンドユーザー名"},
+        ),
+        # 数式はそのまま
+        (("A1",), {"A1": "=1+1"}),
+        # 値のないセル（行の途中・行の後ろ）と範囲外のセルはNone
+        (
+            ("D9", "C10", "E10", "Z100"),
+            {"D9": None, "C10": None, "E10": None, "Z100": None},
+        ),
+    ],
+)
+def test_read_excel_cells(tmp_path, cell_addrs, expected):
+    filepath = save_workbook(tmp_path / "MA-0000.xlsx", RENRAKUKOUMOKU_VALUES)
+
+    assert read_excel_cells(filepath, cell_addrs) == expected
+
+
+# 同じ内容のブックは読み直さず、内容が変わったら読み直すか
+# 2回目の読み込み: ("copy" | "rewrite" | "same", 読むセル番地)
+@pytest.mark.parametrize(
+    ("second_read", "second_cell_addrs", "expected", "expected_load_count"),
+    [
+        # 同じ内容のファイルは、パスが違っても読み直さない
+        ("copy", ("D6",), {"D6": "顧客名"}, 1),
+        # 同じパスでも、ディスク上で書き換えられたら読み直す
+        ("rewrite", ("D6",), {"D6": "変更後の顧客名"}, 2),
+        # 読むセルが違えば読み直す
+        ("same", ("B9",), {"B9": "顧客連絡先"}, 2),
+    ],
+)
+def test_read_excel_cells_memoized_by_file_hash(
+    tmp_path,
+    monkeypatch,
+    second_read,
+    second_cell_addrs,
+    expected,
+    expected_load_count,
+):
+    load_workbook = openpyxl.load_workbook
+    load_count = 0
+
+    def count_load_workbook(*args, **kwargs):
+        nonlocal load_count
+        load_count += 1
+        return load_workbook(*args, **kwargs)
+
+    monkeypatch.setattr(excel_reader, "_cell_values_cache", {})
+    monkeypatch.setattr(excel_reader.openpyxl, "load_workbook", count_load_workbook)
+
+    filepath = save_workbook(tmp_path / "MA-0000.xlsx", RENRAKUKOUMOKU_VALUES)
+    first_result = read_excel_cells(filepath, ("D6",))
+    # 戻り値を書き換えても、覚えている値は変わらない
+    first_result["D6"] = "書き換え"
+
+    if second_read == "copy":
+        second_path = tmp_path / "copied.xlsx"
+        second_path.write_bytes(filepath.read_bytes())
+    elif second_read == "rewrite":
+        second_path = save_workbook(
+            filepath, RENRAKUKOUMOKU_VALUES | {"D6": "変更後の顧客名"}
+        )
+    else:
+        second_path = filepath
+
+    assert read_excel_cells(second_path, second_cell_addrs) == expected
+    assert load_count == expected_load_count
@@ -0,0 +1,94 @@
+from datetime import date
+
+import pytest
+
+from helper.quote_index import QuoteIndex, QuoteIndexItem
+
+# (スプレッドシートID, 行番号, 見積日)
+QUOTES = [
+    ("id_3", 3, date(2024, 3, 1)),
+    ("id_1", 1, date(2024, 1, 1)),
+    ("id_2", 2, date(2024, 2, 1)),
+    # 同じ見積日は行番号順
+    ("id_5", 5, date(2024, 2, 1)),
+    ("id_4", 4, date(2024, 2, 1)),
+]
+
+
+def quote_item(spreadsheet_id: str, row_number: int, quote_date: date, price="54000"):
+    return QuoteIndexItem(
+        spreadsheet_id,
+        row_number,
+        f"DCCF6E-Q-{row_number:04}",
+        quote_date,
+        "MA-9901 ガススプリング配管図",
+        "納期 05/12",
+        price,
+    )
+
+
+# 見積日の範囲（両端を含む）で検索でき、見積日・行番号順になるか
+@pytest.mark.parametrize(
+    ("from_date", "to_date", "expected_ids"),
+    [
+        (date(2024, 2, 1), None, ["id_2", "id_4", "id_5", "id_3"]),
+        (date(2024, 1, 1), date(2024, 2, 1), ["id_1", "id_2", "id_4", "id_5"]),
+        (date(2024, 1, 2), date(2024, 1, 31), []),
+        (date(2024, 3, 2), None, []),
+    ],
+)
+def test_find_quotes_by_date(tmp_path, from_date, to_date, expected_ids):
+    quote_index = QuoteIndex(tmp_path / "quote_index.sqlite3")
+    quote_index.upsert_quotes([quote_item(*quote) for quote in QUOTES])
+
+    result = quote_index.find_quotes_by_date(from_date, to_date)
+
+    assert [item.spreadsheet_id for item in result] == expected_ids
+    assert all(isinstance(item.quote_date, date) for item in result)
+
+
+# 記録済みのIDは除外され、元の順番が保たれるか
+@pytest.mark.parametrize(
+    ("spreadsheet_ids", "expected"),
+    [
+        (["id_9", "id_1", "id_0"], ["id_9", "id_0"]),
+        (["id_1", "id_2"], []),
+        ([], []),
+    ],
+)
+def test_filter_unindexed_ids(tmp_path, spreadsheet_ids, expected):
+    quote_index = QuoteIndex(tmp_path / "quote_index.sqlite3")
+    quote_index.upsert_quotes([quote_item(*quote) for quote in QUOTES])
+
+    assert quote_index.filter_unindexed_ids(spreadsheet_ids) == expected
+
+
+# 同じスプレッドシートIDは上書きされ、別のインスタンス（別のプロセス）からも読めるか
+def test_upsert_quotes_replaces_and_persists(tmp_path):
+    db_path = tmp_path / "quote_index.sqlite3"
+    QuoteIndex(db_path).upsert_quotes([quote_item("id_1", 1, date(2024, 1, 1))])
+    QuoteIndex(db_path).upsert_quotes(
+        [quote_item("id_1", 1, date(2024, 1, 1), price="60000")]
+    )
+
+    (result,) = QuoteIndex(db_path).find_quotes_by_date(date(2024, 1, 1))
+    assert result.hinmoku_price == "60000"
+
+
+# 読み込み済みの行は、最後に記録した値になり、別のインスタンスからも読めるか
+@pytest.mark.parametrize(
+    ("synced_rows", "expected"),
+    [
+        ([], None),
+        ([10], 10),
+        ([10, 12], 12),
+        # 戻す場合もそのまま記録する
+        ([12, 10], 10),
+    ],
+)
+def test_last_synced_row(tmp_path, synced_rows, expected):
+    db_path = tmp_path / "quote_index.sqlite3"
+    for synced_row in synced_rows:
+        QuoteIndex(db_path).set_last_synced_row(synced_row)
+
+    assert QuoteIndex(db_path).get_last_synced_row() == expected
@@ -5,7 +5,12 @@ import json
 from datetime import datetime
 import dateutil.tz
 import helper
-from itemparser import *
+from itemparser import (
+    CsvFileInfo,
+    ExpandedMessageItem,
+    MessagePartKind,
+    convert_gmail_datetimestr,
+)
 
 
 # convert_gmail_datetimestr
@@ -80,6 +85,62 @@ def test_ExpandedMessageItem(jsonfilepath, expected):
     assert item.body == helper.decode_base64url(expected["body"]).decode("utf8")
 
 
+# format=metadataで取得したメッセージは、本文へアクセスした時にmessage_loaderで取得する
+def test_ExpandedMessageItem_lazy_body():
+    jsonfile = Path("tests/testdata/gmailapi_sample_html.json")
+    with jsonfile.open(mode="r", encoding="utf-8") as f:
+        jsondata = json.load(f)
+
+    loaded_ids = []
+
+    def message_loader(message_id):
+        loaded_ids.append(message_id)
+        return jsondata
+
+    metadata_message = {
+        "id": jsondata["id"],
+        "payload": {"headers": jsondata["payload"]["headers"]},
+    }
+    item = ExpandedMessageItem(metadata_message, message_loader=message_loader)
+
+    # ヘッダーだけなら取得しない
+    assert item.title == ExpandedMessageItem(jsondata).title
+    assert loaded_ids == []
+
+    # 本文は最初のアクセスで1回だけ取得する
+    assert item.body == ExpandedMessageItem(jsondata).body
+    assert item.body_parts
+    assert loaded_ids == [jsondata["id"]]
+
+
+# パートの分類。multipart/mixedの中に本文（alternative）と添付ファイル2つがあるメール
+def test_ExpandedMessageItem_parts():
+    jsonfile = Path("tests/testdata/gmailapi_sample_html.json")
+    with jsonfile.open(mode="r", encoding="utf-8") as f:
+        jsondata = json.load(f)
+
+    item = ExpandedMessageItem(jsondata)
+
+    # ヘッダー名は大文字小文字を区別しない
+    assert item.get_header("SUBJECT") == item.title
+    assert item.get_header("X-Not-Exists") is None
+
+    assert [(part.part_id, part.kind) for part in item.parts] == [
+        ("", MessagePartKind.MULTIPART),
+        ("0", MessagePartKind.MULTIPART),
+        ("0.0", MessagePartKind.TEXT),
+        ("0.1", MessagePartKind.HTML),
+        ("1", MessagePartKind.ATTACHMENT),
+        ("2", MessagePartKind.ATTACHMENT),
+    ]
+    assert [part.filename.split("_")[0] for part in item.attachments] == [
+        "MA-0947",
+        "MA-0947",
+    ]
+    assert item.inline_images == []
+    assert b"<html" in item.html_part.decode_body()
+
+
 # RenrakukoumokuInfo: 次回
 
 # CsvFileInfo: 次回
@@ -94,3 +155,71 @@ def test_ExpandedMessageItem(jsonfilepath, expected):
 # generate_update_valueranges:次回。pandasでデータ構造の例を用意して生成結果が正しいか確認できればよし
 
 #
+
+
+def test_CsvFileInfo(tmp_path):
+    # 部品表と同じ列を持つShift-JISのCSV。集計に使わない列も混ぜておく
+    csv_filepath = tmp_path / "MA-0000_1.csv"
+    csv_filepath.write_text(
+        "No,品名,型式・寸法,数量,備考\r\n"
+        "1,ホース(継手付),HS-SS-1000,1,耐熱\r\n"
+        "2,ガススプリング,GS-150,1,\r\n"
+        "3,ホース(継手付),HS-LL-1500,1,標準\r\n"
+        "4,ホース(継手付),HS-SS-800,1,耐熱\r\n"
+        "5,ブロック,BL-10,2,\r\n",
+        encoding="shift-jis",
+    )
+
+    csvfile_info = CsvFileInfo(csv_filepath)
+
+    assert csvfile_info.anken_number == "MA-0000-1"
+    assert csvfile_info.anken_base_number == "MA-0000"
+    assert csvfile_info.gas_qty == 1
+    assert csvfile_info.hose_qty == 3
+    assert csvfile_info.hose_type == "耐熱"
+    assert csvfile_info.hose_attachment_types == "LL/SS"
+
+
+# 本数の集計。数量の列があれば合計、なければ行数になるか
+# リポジトリに実際の部品表がないので、元のpandasの実装が読んでいた列（品名, 型式・寸法, 備考）をもとにしている
+@pytest.mark.parametrize(
+    ("csv_text", "expected_gas_qty", "expected_hose_qty"),
+    [
+        # 数量の列がない部品表は行数
+        (
+            "品名,型式・寸法,備考\r\n"
+            "ホース(継手付),HS-SS-1000,耐熱\r\n"
+            "ガススプリング,GS-150,\r\n"
+            "ホース(継手付),HS-LL-1500,耐熱\r\n",
+            1,
+            2,
+        ),
+        # 数量の列があれば合計。小数の表記は整数に、空のセルは0にする
+        (
+            "No,品名,型式・寸法,数量,備考\r\n"
+            "1,ホース(継手付),HS-SS-1000,4,耐熱\r\n"
+            "2,ガススプリング,GS-150,6,\r\n"
+            "3,ホース(継手付),HS-LL-1500,2.0,耐熱\r\n"
+            "4,ガススプリング,GS-200,,\r\n",
+            6,
+            6,
+        ),
+        # 品名がガススプリングと一致するものだけ数える（部分一致の部品は数えない）
+        (
+            "No,品名,型式・寸法,数量,備考\r\n"
+            "1,ガススプリング,GS-150,2,\r\n"
+            "2,ガススプリング用ブラケット,BR-10,4,\r\n"
+            "3,ホース(継手付),HS-SS-1000,1,耐熱\r\n",
+            2,
+            1,
+        ),
+    ],
+)
+def test_CsvFileInfo_qty(tmp_path, csv_text, expected_gas_qty, expected_hose_qty):
+    csv_filepath = tmp_path / "MA-0001.csv"
+    csv_filepath.write_text(csv_text, encoding="shift-jis")
+
+    csvfile_info = CsvFileInfo(csv_filepath)
+
+    assert csvfile_info.gas_qty == expected_gas_qty
+    assert csvfile_info.hose_qty == expected_hose_qty